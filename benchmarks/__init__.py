@@ -0,0 +1 @@
+"""Benchmarks for drf-cached-instances."""
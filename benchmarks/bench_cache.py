@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Microbenchmarks for BaseCache and CachedQueryset hot paths.
+
+Run from the project folder, with an in-memory database:
+
+    $ python -m benchmarks.bench_cache --output results.json
+
+Results are written as JSON, and a previous results file can be compared
+to the current run with --compare.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import sys
+from datetime import datetime, timedelta
+from timeit import default_timer
+
+from django.core.cache.backends.base import BaseCache as DjangoBaseCache
+from django.core.cache.backends.locmem import LocMemCache
+
+DEFAULT_SIZES = (1, 100, 10000)
+FIELD_ITERATIONS = 10000
+
+
+class DictCache(DjangoBaseCache):
+    """A cache backend that stores values in a dictionary.
+
+    This stands in for an external cache like memcached, without network or
+    pickling costs, so that the overhead of drf-cached-instances is measured.
+    Timeouts are ignored.
+    """
+
+    def __init__(self, params):
+        """Initialize the DictCache."""
+        super(DictCache, self).__init__(params)
+        self._data = {}
+
+    def add(self, key, value, timeout=None, version=None):
+        """Set a value if the key is not in the cache."""
+        if key in self._data:
+            return False
+        self._data[key] = value
+        return True
+
+    def get(self, key, default=None, version=None):
+        """Get a value from the cache."""
+        return self._data.get(key, default)
+
+    def get_many(self, keys, version=None):
+        """Get several values from the cache."""
+        data = self._data
+        return dict((key, data[key]) for key in keys if key in data)
+
+    def set(self, key, value, timeout=None, version=None):
+        """Set a value in the cache."""
+        self._data[key] = value
+
+    def set_many(self, data, timeout=None, version=None):
+        """Set several values in the cache."""
+        self._data.update(data)
+        return []
+
+    def delete(self, key, version=None):
+        """Delete a value from the cache."""
+        self._data.pop(key, None)
+
+    def has_key(self, key, version=None):
+        """Return True if the key is in the cache."""
+        return key in self._data
+
+    def clear(self):
+        """Remove all values from the cache."""
+        self._data.clear()
+
+
+def make_backends():
+    """Return the cache backends to benchmark, as (name, backend) pairs."""
+    return [
+        ('locmem', LocMemCache(
+            'drfc-benchmark', {'OPTIONS': {'MAX_ENTRIES': 1000000}})),
+        ('dict', DictCache({})),
+    ]
+
+
+def measure(func, repeat, setup=None):
+    """Time a function, returning a list of durations in seconds."""
+    times = []
+    for x in range(repeat):
+        if setup:
+            setup()
+        start = default_timer()
+        func()
+        times.append(default_timer() - start)
+    return times
+
+
+def result(name, backend, size, times, ops=1):
+    """Summarize benchmark timings."""
+    times = sorted(times)
+    return {
+        'name': name,
+        'backend': backend,
+        'size': size,
+        'repeat': len(times),
+        'ops': ops,
+        'min': times[0],
+        'median': times[len(times) // 2],
+        'mean': sum(times) / len(times),
+    }
+
+
+def make_cache(backend):
+    """Create a SampleCache using a cache backend."""
+    from sample_poll_app.cache import SampleCache
+    cache = SampleCache()
+    cache._cache = backend
+    return cache
+
+
+def ensure_users(count):
+    """Ensure there are at least count Users, and return their pks."""
+    from django.contrib.auth.models import User
+    existing = User.objects.count()
+    if existing < count:
+        User.objects.bulk_create([
+            User(username='bench_user_%d' % x)
+            for x in range(existing, count)])
+    return list(
+        User.objects.order_by('pk').values_list('pk', flat=True)[:count])
+
+
+def bench_get_instances(backend_name, backend, sizes, repeat):
+    """Time get_instances for cache hits and misses."""
+    results = []
+    cache = make_cache(backend)
+    for size in sizes:
+        specs = [('User', pk, None) for pk in ensure_users(size)]
+        times = measure(
+            lambda: cache.get_instances(specs), repeat, setup=backend.clear)
+        results.append(
+            result('get_instances.miss', backend_name, size, times, size))
+        cache.get_instances(specs)
+        times = measure(lambda: cache.get_instances(specs), repeat)
+        results.append(
+            result('get_instances.hit', backend_name, size, times, size))
+        times = measure(lambda: cache.get_instances(specs, lazy=True), repeat)
+        results.append(
+            result('get_instances.hit_lazy', backend_name, size, times, size))
+    return results
+
+
+def bench_update_instance(backend_name, backend, repeat):
+    """Time update_instance for a Choice, with cascading updates."""
+    from django.utils.timezone import now
+    from sample_poll_app.models import Choice, Question
+    cache = make_cache(backend)
+    voter_pks = ensure_users(10)
+    question = Question.objects.create(
+        question_text='Benchmark question', pub_date=now())
+    choices = []
+    for x in range(10):
+        choice = Choice.objects.create(
+            question=question, choice_text='Choice %d' % x)
+        choice.voters.add(*voter_pks)
+        choices.append(choice)
+
+    def update():
+        to_update = [('Choice', choice.pk, None) for choice in choices]
+        while to_update:
+            model_name, pk, version = to_update.pop()
+            to_update.extend(cache.update_instance(model_name, pk, None,
+                                                   version))
+
+    times = measure(update, repeat, setup=backend.clear)
+    bench_result = result(
+        'update_instance.cascade', backend_name, len(choices), times,
+        len(choices))
+    Choice.objects.filter(question=question).delete()
+    question.delete()
+    return [bench_result]
+
+
+def field_samples():
+    """Return (type code, description, JSON value) to decode."""
+    from django.contrib.auth.models import User
+    from drf_cached_instances.cache import BaseCache
+    cache = BaseCache()
+    now = datetime(2016, 8, 14, 12, 30, 15, 123456)
+    return [
+        ('DateTime', 'seconds', cache.field_datetime_to_json(
+            now.replace(microsecond=0))),
+        ('DateTime', 'microseconds', cache.field_datetime_to_json(now)),
+        ('Date', 'date', cache.field_date_to_json(now.date())),
+        ('TimeDelta', 'seconds', cache.field_timedelta_to_json(
+            timedelta(days=1, seconds=5))),
+        ('TimeDelta', 'microseconds', cache.field_timedelta_to_json(
+            timedelta(days=1, seconds=5, microseconds=10))),
+        ('PK', 'pk', cache.field_pk_to_json(User, 1)),
+        ('PKList', '100 pks', cache.field_pklist_to_json(
+            User, range(1, 101))),
+        ('CompactPK', 'pk', cache.field_compactpk_to_json(User, 1)),
+        ('CompactPKList', '100 pks', cache.field_compactpklist_to_json(
+            User, range(1, 101))),
+    ]
+
+
+def bench_field_decoding(repeat, iterations=FIELD_ITERATIONS):
+    """Time the field decoders for each type code, by value and column.
+
+    The loads_field_from_json results include parsing the JSON value, which
+    is where the cost of a plain list of primary keys is paid.
+    """
+    from drf_cached_instances.cache import BaseCache
+    cache = BaseCache()
+    results = []
+    for type_code, description, json_value in field_samples():
+        from_json = cache.field_function(type_code, 'from_json')
+
+        def decode():
+            for x in range(iterations):
+                from_json(json_value)
+
+        times = measure(decode, repeat)
+        name = 'field_from_json.%s.%s' % (type_code, description)
+        results.append(result(name, None, 1, times, iterations))
+
+        raw = json.dumps(json_value)
+
+        def load_and_decode():
+            for x in range(iterations):
+                from_json(json.loads(raw))
+
+        times = measure(load_and_decode, repeat)
+        name = 'loads_field_from_json.%s.%s' % (type_code, description)
+        results.append(result(name, None, 1, times, iterations))
+
+        column = [json_value] * iterations
+        key_and_type = 'field:%s' % type_code
+        times = measure(
+            lambda: cache.fields_from_json(key_and_type, column), repeat)
+        name = 'fields_from_json.%s.%s' % (type_code, description)
+        results.append(result(name, None, 1, times, iterations))
+    return results
+
+
+def bench_cached_queryset(backend_name, backend, sizes, repeat):
+    """Time iterating a CachedQueryset with a warm cache."""
+    from django.contrib.auth.models import User
+    from drf_cached_instances.models import CachedQueryset
+    results = []
+    cache = make_cache(backend)
+    for size in sizes:
+        pks = ensure_users(size)
+        queryset = User.objects.filter(pk__in=pks).order_by('pk')
+        cache.get_instances([('User', pk, None) for pk in pks])
+
+        def iterate():
+            for cached in CachedQueryset(cache, queryset):
+                cached.username
+
+        times = measure(iterate, repeat)
+        results.append(
+            result('CachedQueryset.iter', backend_name, size, times, size))
+    return results
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat=3, backends=None,
+                   iterations=FIELD_ITERATIONS):
+    """Run all the benchmarks, returning a list of results."""
+    results = []
+    for backend_name, backend in (backends or make_backends()):
+        results.extend(
+            bench_get_instances(backend_name, backend, sizes, repeat))
+        results.extend(bench_update_instance(backend_name, backend, repeat))
+        results.extend(
+            bench_cached_queryset(backend_name, backend, sizes, repeat))
+    results.extend(bench_field_decoding(repeat, iterations))
+    return results
+
+
+def result_key(bench_result):
+    """Identify a result, for comparing runs."""
+    return (
+        bench_result['name'], bench_result['backend'], bench_result['size'])
+
+
+def format_results(results, previous=None):
+    """Format results as a text table."""
+    old = dict((result_key(r), r) for r in (previous or []))
+    lines = []
+    for bench_result in results:
+        per_op = bench_result['median'] / bench_result['ops']
+        line = '%-45s %-7s %6d %12.1f us/op' % (
+            bench_result['name'], bench_result['backend'] or '-',
+            bench_result['size'], per_op * 1e6)
+        old_result = old.get(result_key(bench_result))
+        if old_result:
+            old_per_op = old_result['median'] / old_result['ops']
+            line += ' %6.2fx' % (per_op / old_per_op)
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def setup_django():
+    """Configure Django with an in-memory database."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sample_site.settings')
+    os.environ['DATABASE_URL'] = 'sqlite://:memory:'
+    os.environ.setdefault('DEBUG', '0')
+    import django
+    from django.core.management import call_command
+    django.setup()
+    call_command('migrate', verbosity=0, interactive=False)
+
+
+def main(argv=None):
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+        help='Comma-separated numbers of instances (default %(default)s)')
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='Number of timed runs per benchmark (default %(default)s)')
+    parser.add_argument(
+        '--output', help='Write results as JSON to this file')
+    parser.add_argument(
+        '--compare', help='Compare to results in this JSON file')
+    args = parser.parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    setup_django()
+    import django
+    results = run_benchmarks(sizes, args.repeat)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as compare_file:
+            previous = json.load(compare_file)['results']
+    print(format_results(results, previous))
+
+    if args.output:
+        report = {
+            'meta': {
+                'date': datetime.utcnow().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'platform': platform.platform(),
+                'sizes': sizes,
+                'repeat': args.repeat,
+            },
+            'results': results,
+        }
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
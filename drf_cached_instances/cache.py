@@ -1,16 +1,43 @@
 """BaseCache for foundation of app-specific caching strategy."""
 
+from base64 import b64encode
+from binascii import a2b_base64
 from calendar import timegm
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
 from datetime import date, datetime, timedelta
+from hashlib import md5
 from pytz import utc
+from random import randrange
+from time import time
+from uuid import uuid4
 import json
+import struct
+import zlib
 
 from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import connections
 from django.utils.dateparse import parse_date, parse_datetime
 from django.utils import six
 
-from .compat import get_model, parse_duration
+from .compat import accumulate, get_model, lzma, parse_duration
+from .hotkeys import hot_key_tracker
 from .models import PkOnlyModel, PkOnlyQueryset
+from .stats import get_stats
+
+# The cached value for an instance that does not exist
+MISSING = json.dumps(None)
+
+# The first byte of compressed cache entries.  Uncompressed entries are JSON
+# text, which never starts with these.
+COMPRESSION_MARKERS = {
+    'zlib': b'z',
+    'lzma': b'x',
+}
+
+# The start of the cached value for an entry split into chunks
+CHUNKED = 'drfc_chunked'
 
 
 class BaseCache(object):
@@ -24,10 +51,93 @@ class BaseCache(object):
     default_version = 'default'
     versions = ['default']
 
+    # The earlier cache version to upgrade missing entries from, such as
+    # user_v2_upgrade_from = 'default'.  On a cache miss, get_instances reads
+    # the earlier entry in the same get_many, and converts it with a function
+    # like user_v2_upgrader(native), instead of loading the instance.  None
+    # disables upgrades.
+    default_upgrade_from = None
+
+    # Declarative model specs, which generate the model functions.  See
+    # drf_cached_instances.spec.CacheSpec.
+    specs = ()
+
+    # Cache timeout for instances, in seconds.  Override for a model and
+    # version with an attribute like user_default_timeout.  DEFAULT_TIMEOUT
+    # uses the timeout configured for the Django cache backend.
+    default_timeout = DEFAULT_TIMEOUT
+
+    # Cache timeout for instances that do not exist, in seconds, so that
+    # repeated requests for a missing instance skip the database.  Override
+    # with an attribute like user_default_missing_timeout, or 0 to disable.
+    default_missing_timeout = 60
+
+    # Compress cache entries that are at least this many bytes of JSON, or
+    # None to disable compression.  The compressor is 'zlib' or 'lzma'
+    # (Python 3 only), and the level is passed to the compressor.  Override
+    # with attributes like user_default_compress_threshold.
+    default_compress_threshold = None
+    default_compressor = 'zlib'
+    default_compress_level = 6
+
+    # The Django cache alias for instances.  Override for a model and version
+    # with an attribute like user_default_cache_alias, to keep busy models in
+    # a separate cache backend.
+    default_cache_alias = 'default'
+
+    # Entries larger than this many bytes are split into chunks, to fit in
+    # the item size limit of the cache backend, such as 1 MB for memcached.
+    max_entry_size = 1000 * 1000
+
+    # Hot key replication.  Reads are sampled at hot_key_sample_rate, and a
+    # key with an estimated hot_key_threshold reads in hot_key_window seconds
+    # is copied to hot_key_replicas replica keys, and read from a random
+    # replica.  Replicas expire after hot_key_window seconds.  A threshold of
+    # None disables detection.
+    hot_key_threshold = None
+    hot_key_replicas = 4
+    hot_key_sample_rate = 0.01
+    hot_key_window = 60
+    hot_key_tracker = hot_key_tracker
+
+    # Store a fingerprint, the MD5 hash of the entry, in a small key next to
+    # each entry.  Updates compare the fingerprint of the new entry to the
+    # stored one, instead of reading and decoding the full entry.  The
+    # fingerprints can also be used as ETags.
+    fingerprints = False
+
+    # Attempts to change a cached primary key list with compare-and-set, in
+    # update_pklist, before the entry is rebuilt with update_instance.  The
+    # compare-and-set lock expires after lock_timeout seconds.
+    pklist_retries = 3
+    lock_timeout = 5
+
+    # Orderings with a cached index of sorted primary keys, such as
+    # question_default_pk_indexes = ('pk', '-pub_date').  CachedQueryset uses
+    # the index for the slices and counts of unfiltered querysets with the
+    # same ordering, and update_instance keeps it up to date.  An ordering is
+    # the primary key, or one number, date, or datetime field.
+    default_pk_indexes = ()
+
+    # Cached instance counts, by name and filter, such as
+    # user_default_counters = {'all': {}, 'active': {'is_active': True}}.
+    # A filter is a dictionary of field names and exact values.  Counters
+    # are adjusted with incr and decr for created and deleted instances, and
+    # CachedQueryset.count() uses the counter with the same filter.
+    default_counters = {}
+
+    # Cache timeout for counters, in seconds.  A count loaded while another
+    # transaction commits may be off by one until it expires.  Override with
+    # an attribute like user_default_counter_timeout.
+    default_counter_timeout = 300
+
     def __init__(self):
         """Initialize BaseCache."""
         self._cache = None
+        self.stats = get_stats()
         assert self.default_version in self.versions
+        for spec in self.specs:
+            spec.install(self)
 
     @property
     def cache(self):
@@ -44,6 +154,20 @@ class BaseCache(object):
                 self._cache = cache
         return self._cache
 
+    def cache_for(self, model_name, version):
+        """Get the Django cache backend for a model and version.
+
+        The 'default' alias uses the cache property, and no alias is used if
+        the cache is disabled with settings.USE_DRF_INSTANCE_CACHE=False.
+        """
+        if self.cache is None:
+            return None
+        alias = self.model_option(model_name, version, 'cache_alias')
+        if alias == 'default':
+            return self.cache
+        from django.core.cache import caches
+        return caches[alias]
+
     def key_for(self, version, model_name, obj_pk):
         """Get the cache key for the cached instance."""
         return 'drfc_{0}_{1}_{2}'.format(version, model_name, obj_pk)
@@ -53,18 +177,362 @@ class BaseCache(object):
         if self.cache:
             for version in self.versions:
                 key = self.key_for(version, model_name, obj_pk)
-                self.cache.delete(key)
+                self.delete_entry(key, self.cache_for(model_name, version))
 
     def model_function(self, model_name, version, func_name):
         """Return the model-specific caching function."""
-        assert func_name in ('serializer', 'loader', 'invalidator')
+        assert func_name in (
+            'serializer', 'loader', 'invalidator', 'upgrader')
         name = "%s_%s_%s" % (model_name.lower(), version, func_name)
         return getattr(self, name)
 
+    def model_option(self, model_name, version, option):
+        """Return a model-specific option, or the default for all models.
+
+        For example, the 'timeout' option for the User model and the 'v1'
+        version is user_v1_timeout, falling back to default_timeout.
+        """
+        name = "%s_%s_%s" % (model_name.lower(), version, option)
+        default = getattr(self, 'default_%s' % option)
+        return getattr(self, name, default)
+
+    def timed_model_function(self, model_name, version, func_name):
+        """Return the model function, timed if collecting statistics."""
+        func = self.model_function(model_name, version, func_name)
+        if func and self.stats:
+            func = self.stats.timed(model_name, version, func_name, func)
+        return func
+
+    def encode_entry(self, model_name, version, native):
+        """Convert a cached instance representation to a cache entry.
+
+        The representation is converted to JSON with sorted keys, so that the
+        same representation is always the same entry, and then compressed if
+        it is larger than the compression threshold.
+        """
+        raw = json.dumps(native, sort_keys=True)
+        threshold = self.model_option(
+            model_name, version, 'compress_threshold')
+        if threshold is None or len(raw) < threshold:
+            return raw
+        compressor = self.model_option(model_name, version, 'compressor')
+        level = self.model_option(model_name, version, 'compress_level')
+        data = raw.encode('utf-8')
+        if compressor == 'lzma':
+            assert lzma, 'lzma compression requires Python 3'
+            compressed = lzma.compress(data, preset=level)
+        else:
+            assert compressor == 'zlib'
+            compressed = zlib.compress(data, level)
+        compressed = COMPRESSION_MARKERS[compressor] + compressed
+        if len(compressed) >= len(data):
+            return raw
+        if self.stats:
+            self.stats.incr(
+                model_name, version, 'bytes_saved',
+                len(data) - len(compressed))
+        return compressed
+
+    def decode_entry(self, raw):
+        """Convert a cache entry to the cached instance representation."""
+        if isinstance(raw, bytes):
+            marker, data = raw[:1], raw[1:]
+            if marker == COMPRESSION_MARKERS['zlib']:
+                raw = zlib.decompress(data)
+            elif marker == COMPRESSION_MARKERS['lzma']:
+                raw = lzma.decompress(data)
+            raw = raw.decode('utf-8')
+        return json.loads(raw)
+
+    def chunk_key(self, key, number):
+        """Get the cache key for a chunk of a large entry."""
+        return '{0}_chunk_{1}'.format(key, number)
+
+    def split_entry(self, key, raw):
+        """Split a large cache entry into chunks if needed.
+
+        Return is a dictionary of cache keys to values.  For large entries,
+        the entry key is set to a manifest with a token unique to this write
+        and the chunk count.  The chunk keys are the same for every write, so
+        that a rewrite replaces the chunks, and each chunk starts with the
+        token, so that chunks from different writes are not mixed.
+        """
+        size = self.max_entry_size
+        if len(raw) <= size:
+            return {key: raw}
+        data = raw if isinstance(raw, bytes) else raw.encode('utf-8')
+        token = uuid4().hex[:8]
+        prefix = token.encode('ascii')
+        size -= len(prefix)
+        count = (len(data) + size - 1) // size
+        to_set = {key: '%s:%s:%d' % (CHUNKED, token, count)}
+        for number in range(count):
+            chunk_key = self.chunk_key(key, number)
+            chunk = data[number * size:(number + 1) * size]
+            to_set[chunk_key] = prefix + chunk
+        return to_set
+
+    def stale_chunk_keys(self, key, old_count, new_count=0):
+        """Get the keys of an entry's chunks that a rewrite does not replace.
+
+        old_count is the chunk count of the replaced entry, and new_count is
+        the chunk count of the new entry, or 0 if it is deleted or not
+        chunked.
+        """
+        return [
+            self.chunk_key(key, number)
+            for number in range(new_count, old_count)]
+
+    def replica_key(self, key, number):
+        """Get the cache key for a replica of a hot entry."""
+        return '{0}_replica_{1}'.format(key, number)
+
+    def hot_flag_key(self, key):
+        """Get the cache key that marks an entry as replicated."""
+        return '{0}_hot'.format(key)
+
+    def fingerprint_key(self, key):
+        """Get the cache key for the fingerprint of an entry."""
+        return '{0}_fp'.format(key)
+
+    def fingerprint(self, raw):
+        """Get the fingerprint of a cache entry, as a hex string."""
+        if not isinstance(raw, bytes):
+            raw = raw.encode('utf-8')
+        return md5(raw).hexdigest()
+
+    def get_fingerprints(self, model_name, pks, version=None):
+        """Get the stored fingerprints of cached instances, such as for ETags.
+
+        Return is a dictionary of primary keys to fingerprints, for instances
+        that are cached with a fingerprint.
+        """
+        version = version or self.default_version
+        cache = self.cache_for(model_name, version)
+        if cache is None or not self.fingerprints:
+            return {}
+        keys = dict(
+            (self.fingerprint_key(self.key_for(version, model_name, pk)), pk)
+            for pk in pks)
+        found = cache.get_many(list(keys))
+        return dict((keys[key], value) for key, value in found.items())
+
+    def hot_key_stats(self):
+        """Return the hot key detection statistics for this process."""
+        return self.hot_key_tracker.snapshot()
+
+    def get_hot_entries(self, keys, cache):
+        """Get entries from the cache, reading hot keys from a replica.
+
+        If a replica is missing, the entry is read from the original key.
+
+        Return is a tuple of the entries, by cache key, and the set of hot
+        keys that need their replicas written.
+        """
+        if not self.hot_key_threshold:
+            return self.get_entries(keys, cache), set()
+        hot = self.hot_key_tracker.sample(
+            keys, self.hot_key_sample_rate, self.hot_key_threshold,
+            self.hot_key_window)
+        read_keys = {}
+        for key in keys:
+            if key in hot:
+                number = randrange(self.hot_key_replicas)
+                read_keys[self.replica_key(key, number)] = key
+            else:
+                read_keys[key] = key
+        entries = {}
+        missed = set()
+        read = self.get_entries(list(read_keys), cache)
+        for read_key, key in read_keys.items():
+            if read_key in read:
+                entries[key] = read[read_key]
+            elif key in hot:
+                missed.add(key)
+        if missed:
+            entries.update(self.get_entries(list(missed), cache))
+        if hot:
+            self.hot_key_tracker.record_replica_reads(len(hot), len(missed))
+        return entries, missed
+
+    def set_replicas(self, entries, cache):
+        """Write the replicas of hot entries, and mark them as replicated."""
+        to_set = {}
+        for key, raw in entries.items():
+            for number in range(self.hot_key_replicas):
+                to_set[self.replica_key(key, number)] = raw
+            to_set[self.hot_flag_key(key)] = str(self.hot_key_replicas)
+        self.set_entries(
+            to_set, self.hot_key_window, cache, fingerprint=False)
+
+    def extra_keys(self, key):
+        """Get the keys stored with an entry, such as replicas."""
+        keys = []
+        if self.hot_key_threshold:
+            keys.append(self.hot_flag_key(key))
+            keys.extend(
+                self.replica_key(key, number)
+                for number in range(self.hot_key_replicas))
+        if self.fingerprints:
+            keys.append(self.fingerprint_key(key))
+        return keys
+
+    def delete_entry(self, key, cache):
+        """Delete an entry from the cache, including any replicas and chunks.
+
+        The manifests are read first, to find the chunks.
+        """
+        extra = self.extra_keys(key)
+        extra.extend(self.manifest_chunk_keys([key] + extra, cache))
+        if extra:
+            cache.delete_many([key] + extra)
+        else:
+            cache.delete(key)
+
+    def delete_entries(self, keys, cache):
+        """Delete entries from the cache, including any replicas and chunks.
+
+        The manifests are read first, with one get_many, to find the chunks.
+        """
+        keys = list(keys)
+        for key in list(keys):
+            keys.extend(self.extra_keys(key))
+        keys.extend(self.manifest_chunk_keys(keys, cache))
+        cache.delete_many(keys)
+
+    def manifest_chunk_keys(self, keys, cache):
+        """Read the entries at keys, and get the chunk keys of chunked ones."""
+        chunk_keys = []
+        for key, raw in cache.get_many(keys).items():
+            manifest = chunk_manifest(raw)
+            if manifest:
+                chunk_keys.extend(self.stale_chunk_keys(key, manifest[1]))
+        return chunk_keys
+
+    def get_entries(self, keys, cache=None, chunks=None):
+        """Get entries from the cache, reassembling chunked entries.
+
+        All the chunks are fetched with a single get_many.  An entry with a
+        missing chunk, or a chunk from a different write, is treated as a
+        cache miss.  The cache backend defaults to the cache property.  If
+        chunks is a dictionary, it is filled with the chunk counts of the
+        chunked entries, by key, to pass to set_entries.
+
+        Return is a dictionary of cache keys to entries.
+        """
+        if cache is None:
+            cache = self.cache
+        entries = cache.get_many(keys)
+        chunk_keys = {}
+        for key, raw in entries.items():
+            manifest = chunk_manifest(raw)
+            if manifest:
+                token, count = manifest
+                chunk_keys[key] = (token.encode('ascii'), [
+                    self.chunk_key(key, number) for number in range(count)])
+                if chunks is not None:
+                    chunks[key] = count
+        if chunk_keys:
+            found = cache.get_many(
+                [ck for prefix, cks in chunk_keys.values() for ck in cks])
+            for key, (prefix, cks) in chunk_keys.items():
+                if all(found.get(ck, b'').startswith(prefix) for ck in cks):
+                    entries[key] = b''.join(
+                        found[ck][len(prefix):] for ck in cks)
+                else:
+                    del entries[key]
+        return entries
+
+    def set_entries(
+            self, entries, timeout, cache=None, fingerprint=True,
+            chunks=None):
+        """Set entries in the cache, splitting large entries into chunks.
+
+        If fingerprints are enabled, the fingerprints are set as well, unless
+        fingerprint is False.
+
+        The chunks of the replaced entries that are not overwritten are
+        deleted.  chunks is the dictionary of chunk counts from get_entries,
+        if the entries were just read.  The replaced manifests are read for
+        the other entries that are chunked now.
+        """
+        if cache is None:
+            cache = self.cache
+        to_set = {}
+        counts = {}
+        for key, raw in entries.items():
+            split = self.split_entry(key, raw)
+            counts[key] = len(split) - 1
+            to_set.update(split)
+            if fingerprint and self.fingerprints:
+                to_set[self.fingerprint_key(key)] = self.fingerprint(raw)
+        chunks = dict(chunks or {})
+        chunked = [
+            key for key, count in counts.items()
+            if count and key not in chunks]
+        if chunked:
+            for key, raw in cache.get_many(chunked).items():
+                manifest = chunk_manifest(raw)
+                if manifest:
+                    chunks[key] = manifest[1]
+        stale = []
+        for key, old_count in chunks.items():
+            if key in counts:
+                stale.extend(
+                    self.stale_chunk_keys(key, old_count, counts[key]))
+        cache.set_many(to_set, timeout)
+        if stale:
+            cache.delete_many(stale)
+
+    def read_current(self, keys, cache, chunks=None):
+        """Read cache entries before an update, with their hot key flags.
+
+        If fingerprints are enabled, the fingerprints are read first, and
+        full entries are only read for keys without a fingerprint.  chunks
+        is passed to get_entries.
+
+        Return is a dictionary of cache keys to entries, fingerprints, and
+        hot key flags.
+        """
+        flag_keys = []
+        if self.hot_key_threshold:
+            flag_keys = [self.hot_flag_key(key) for key in keys]
+        if not self.fingerprints:
+            return self.get_entries(list(keys) + flag_keys, cache, chunks)
+        entries = self.get_entries(
+            [self.fingerprint_key(key) for key in keys] + flag_keys, cache)
+        unknown = [
+            key for key in keys if self.fingerprint_key(key) not in entries]
+        if unknown:
+            entries.update(self.get_entries(unknown, cache, chunks))
+        return entries
+
+    def compare_entry(self, model_name, version, key, entries, new):
+        """Compare a new representation to the current cache entry.
+
+        entries is from read_current.  If there is a fingerprint, the new
+        representation is encoded and its fingerprint is compared, without
+        decoding the current entry.
+
+        Return is a tuple of True if the entry changed, and the new entry, or
+        None if it was not encoded.
+        """
+        fingerprint = entries.get(self.fingerprint_key(key))
+        if fingerprint is not None:
+            new_raw = self.encode_entry(model_name, version, new)
+            if self.stats:
+                self.stats.incr(model_name, version, 'fingerprint_checks')
+            return self.fingerprint(new_raw) != fingerprint, new_raw
+        current_raw = entries.get(key)
+        current = self.decode_entry(current_raw) if current_raw else None
+        return current != new, None
+
     def field_function(self, type_code, func_name):
         """Return the field function."""
-        assert func_name in ('to_json', 'from_json')
+        assert func_name in ('to_json', 'from_json', 'from_json_many')
         name = "field_%s_%s" % (type_code.lower(), func_name)
+        if func_name == 'from_json_many':
+            return getattr(self, name, None)
         return getattr(self, name)
 
     def field_to_json(self, type_code, key, *args, **kwargs):
@@ -83,7 +551,24 @@ class BaseCache(object):
         value = from_json(json_value)
         return key, value
 
-    def get_instances(self, object_specs, version=None):
+    def fields_from_json(self, key_and_type, json_values):
+        """Convert a list of JSON-serializable values of a field at once.
+
+        If the field type has a from_json_many function, such as
+        field_datetime_from_json_many, it converts the whole list.  Otherwise,
+        each value is converted with the from_json function.
+
+        Return is the field name and the list of values.
+        """
+        assert ':' in key_and_type
+        key, type_code = key_and_type.split(':', 1)
+        from_json_many = self.field_function(type_code, 'from_json_many')
+        if from_json_many:
+            return key, from_json_many(json_values)
+        from_json = self.field_function(type_code, 'from_json')
+        return key, [from_json(json_value) for json_value in json_values]
+
+    def get_instances(self, object_specs, version=None, lazy=False):
         """Get the cached native representation for one or more objects.
 
         Keyword arguments:
@@ -92,6 +577,11 @@ class BaseCache(object):
         - pk - the primary key of the instance
         - obj - the instance, or None to load it
         version - The cache version to use, or None for default
+        lazy - If True, typed fields such as 'pub_date:DateTime' are not
+            converted, so that CachedModel can convert them when used
+
+        The instances missing from the cache are loaded with one bulk_load
+        call per model.
 
         To get the 'new object' representation, set pk and obj to None
 
@@ -101,10 +591,14 @@ class BaseCache(object):
         """
         ret = dict()
         spec_keys = set()
-        cache_keys = []
+        aliases = {}
+        upgrades = {}
+        backends = {}
+        cache_keys = defaultdict(list)
         version = version or self.default_version
+        stats = self.stats
 
-        # Construct all the cache keys to fetch
+        # Construct all the cache keys to fetch, grouped by cache backend
         for model_name, obj_pk, obj in object_specs:
             assert model_name
             assert obj_pk
@@ -112,53 +606,195 @@ class BaseCache(object):
             # Get cache keys to fetch
             obj_key = self.key_for(version, model_name, obj_pk)
             spec_keys.add((model_name, obj_pk, obj, obj_key))
-            cache_keys.append(obj_key)
+            if model_name not in aliases:
+                alias = self.model_option(model_name, version, 'cache_alias')
+                aliases[model_name] = alias
+                if alias not in backends:
+                    backends[alias] = self.cache_for(model_name, version)
+                old_version = self.model_option(
+                    model_name, version, 'upgrade_from')
+                if old_version:
+                    old_alias = self.model_option(
+                        model_name, old_version, 'cache_alias')
+                    upgrades[model_name] = (old_version, old_alias)
+                    if old_alias not in backends:
+                        backends[old_alias] = self.cache_for(
+                            model_name, old_version)
+            if backends[aliases[model_name]] is not None:
+                cache_keys[aliases[model_name]].append(obj_key)
 
-        # Fetch the cache keys
-        if cache_keys and self.cache:
-            cache_vals = self.cache.get_many(cache_keys)
-        else:
-            cache_vals = {}
+            # Get the earlier version's cache key, to upgrade on a miss
+            if model_name in upgrades and not obj:
+                old_version, old_alias = upgrades[model_name]
+                if backends[old_alias] is not None:
+                    cache_keys[old_alias].append(
+                        self.key_for(old_version, model_name, obj_pk))
+
+        # Fetch the cache keys, with one get_many per cache backend
+        cache_vals = {}
+        replicate = {}
+        for alias, keys in cache_keys.items():
+            start = time()
+            entries, missed = self.get_hot_entries(keys, backends[alias])
+            cache_vals.update(entries)
+            replicate.update((key, alias) for key in missed)
+            if stats:
+                stats.timing(None, version, 'cache_get', time() - start)
+
+        # Load the cache misses, with one bulk_load per model
+        to_load = defaultdict(list)
+        for model_name, obj_pk, obj, obj_key in spec_keys:
+            if obj or cache_vals.get(obj_key):
+                continue
+            if model_name in upgrades:
+                old_val = cache_vals.get(self.key_for(
+                    upgrades[model_name][0], model_name, obj_pk))
+                if old_val and old_val != MISSING:
+                    continue
+            to_load[model_name].append(obj_pk)
+        loaded = {}
+        for model_name, pks in to_load.items():
+            start = time()
+            for instance in self.bulk_load(model_name, version, pks):
+                loaded[(model_name, six.text_type(instance.pk))] = instance
+            if stats:
+                stats.timing(model_name, version, 'loader', time() - start)
+        bulk_loaded = set(
+            (model_name, six.text_type(pk))
+            for model_name, pks in to_load.items() for pk in pks)
 
         # Use cached representations, or recreate
         cache_to_set = {}
+        columns = defaultdict(list)
+        replicas_to_set = defaultdict(dict)
+        counts = defaultdict(int)
+        decode_times = defaultdict(float)
         for model_name, obj_pk, obj, obj_key in spec_keys:
+            start = time()
 
             # Load cached objects
             obj_val = cache_vals.get(obj_key)
-            obj_native = json.loads(obj_val) if obj_val else None
+            if obj_val == MISSING and not obj:
+                # Cached as missing - skip the database
+                if stats:
+                    counts[(model_name, 'requested')] += 1
+                    counts[(model_name, 'hits')] += 1
+                    counts[(model_name, 'missing')] += 1
+                continue
+            obj_native = self.decode_entry(obj_val) if obj_val else None
+            if stats:
+                counts[(model_name, 'requested')] += 1
+                if obj_native:
+                    counts[(model_name, 'hits')] += 1
+                    counts[(model_name, 'bytes_read')] += len(obj_val)
+                else:
+                    counts[(model_name, 'misses')] += 1
+
+            # Not set - upgrade the entry from an earlier version
+            if not obj_native and not obj and model_name in upgrades:
+                old_version = upgrades[model_name][0]
+                old_val = cache_vals.get(
+                    self.key_for(old_version, model_name, obj_pk))
+                if old_val and old_val != MISSING:
+                    old_native = self.decode_entry(old_val)
+                    # The upgrader is timed separately, not as decoding
+                    decode_times[model_name] += time() - start
+                    upgrader = self.timed_model_function(
+                        model_name, version, 'upgrader')
+                    obj_native = upgrader(old_native)
+                    start = time()
+                if obj_native:
+                    timeout = self.model_option(model_name, version, 'timeout')
+                    obj_val = self.encode_entry(
+                        model_name, version, obj_native)
+                    cache_to_set.setdefault(
+                        (aliases[model_name], timeout), {})[obj_key] = obj_val
+                    if stats:
+                        counts[(model_name, 'upgrades')] += 1
+                        counts[(model_name, 'bytes_written')] += len(obj_val)
 
             # Invalid or not set - load from database
             if not obj_native:
+                decode_times[model_name] += time() - start
                 if not obj:
-                    loader = self.model_function(model_name, version, 'loader')
-                    obj = loader(obj_pk)
-                serializer = self.model_function(
+                    spec = (model_name, six.text_type(obj_pk))
+                    if spec in bulk_loaded:
+                        obj = loaded.get(spec)
+                    else:
+                        loader = self.timed_model_function(
+                            model_name, version, 'loader')
+                        obj = loader(obj_pk)
+                serializer = self.timed_model_function(
                     model_name, version, 'serializer')
                 obj_native = serializer(obj) or {}
                 if obj_native:
-                    cache_to_set[obj_key] = json.dumps(obj_native)
+                    timeout = self.model_option(model_name, version, 'timeout')
+                    obj_val = self.encode_entry(
+                        model_name, version, obj_native)
+                    cache_to_set.setdefault(
+                        (aliases[model_name], timeout), {})[obj_key] = obj_val
+                    if stats:
+                        counts[(model_name, 'bytes_written')] += len(obj_val)
+                elif obj is None:
+                    # Cache as missing for a short time
+                    timeout = self.model_option(
+                        model_name, version, 'missing_timeout')
+                    if timeout:
+                        cache_to_set.setdefault(
+                            (aliases[model_name], timeout), {}
+                        )[obj_key] = MISSING
+                start = time()
 
-            # Get fields to convert
-            keys = [key for key in obj_native.keys() if ':' in key]
-            for key in keys:
-                json_value = obj_native.pop(key)
-                name, value = self.field_from_json(key, json_value)
-                assert name not in obj_native
-                obj_native[name] = value
+            # Replicate hot entries
+            if obj_key in replicate and obj_native:
+                replicas_to_set[replicate[obj_key]][obj_key] = obj_val
+
+            # Get fields to convert, grouped by field across instances
+            if not lazy:
+                keys = [key for key in obj_native.keys() if ':' in key]
+                for key in keys:
+                    columns[(model_name, key)].append(
+                        (obj_native, obj_native.pop(key)))
+            decode_times[model_name] += time() - start
 
             if obj_native:
                 ret[(model_name, obj_pk)] = (obj_native, obj_key, obj)
 
-        # Save any new cached representations
-        if cache_to_set and self.cache:
-            self.cache.set_many(cache_to_set)
+        if stats:
+            for model_name, seconds in decode_times.items():
+                stats.timing(model_name, version, 'decode', seconds)
+
+        # Convert typed fields, one column at a time
+        convert_times = defaultdict(float)
+        for (model_name, key), column in columns.items():
+            start = time()
+            name, values = self.fields_from_json(
+                key, [json_value for obj_native, json_value in column])
+            for (obj_native, json_value), value in zip(column, values):
+                assert name not in obj_native
+                obj_native[name] = value
+            convert_times[model_name] += time() - start
+        if stats:
+            for model_name, seconds in convert_times.items():
+                stats.timing(model_name, version, 'convert', seconds)
+
+        # Save any new cached representations, grouped by backend and timeout
+        for (alias, timeout), to_set in cache_to_set.items():
+            if backends[alias] is not None:
+                self.set_entries(to_set, timeout, backends[alias])
+        for alias, to_set in replicas_to_set.items():
+            self.set_replicas(to_set, backends[alias])
 
+        if stats:
+            for (model_name, name), value in counts.items():
+                stats.incr(model_name, version, name, value)
+            stats.flush(self.cache)
         return ret
 
     def update_instance(
             self, model_name, pk, instance=None, version=None,
-            update_only=False):
+            update_only=False, update_fields=None, created=False,
+            deleted=False):
         """Create or update a cached instance.
 
         Keyword arguments are:
@@ -170,61 +806,951 @@ class BaseCache(object):
             populated and will cause follow-on invalidation.  If True, then
             only entries already in the cache will be updated and cause
             follow-on invalidation.
+        update_fields - The names of the changed fields, from
+            save(update_fields=...), or None if unknown.  If the model has a
+            field serializer, such as user_default_field_serializer, only
+            the changed cached fields are patched, without cascading.
+        created - True if the instance was just created, to add it to the
+            primary key indexes
+        deleted - True if the instance was deleted.  If False, the instance
+            is treated as deleted if it can not be loaded.
+
+        If the instance is not passed, the update is treated as a cascaded
+        update from a related instance, and the counters are not changed.
+        Otherwise, the old and new cache entries are compared, so that a
+        counter is only reset if a field it filters on changed.
 
         Return is a list of tuples (model name, pk, immediate) that also needs
         to be updated.
         """
         versions = [version] if version else self.versions
         invalid = []
+        stats = self.stats
         for version in versions:
-            serializer = self.model_function(model_name, version, 'serializer')
-            loader = self.model_function(model_name, version, 'loader')
+            serializer = self.timed_model_function(
+                model_name, version, 'serializer')
+            loader = self.timed_model_function(model_name, version, 'loader')
             invalidator = self.model_function(
                 model_name, version, 'invalidator')
             if serializer is None and loader is None and invalidator is None:
                 continue
 
-            if self.cache is None:
+            cache = self.cache_for(model_name, version)
+            if cache is None:
                 continue
 
+            # Patch the changed fields, if possible
+            field_serializer = getattr(self, '%s_%s_field_serializer' % (
+                model_name.lower(), version), None)
+            patchable = (
+                update_fields is not None and instance and not created and
+                not deleted and field_serializer)
+            if patchable:
+                patch = field_serializer(instance, update_fields)
+                if patch is not None:
+                    self.patch_instance(model_name, version, pk, patch, cache)
+                    self.update_pk_indexes(
+                        model_name, version, pk, instance,
+                        update_fields=update_fields)
+                    self.update_counters(
+                        model_name, version, instance,
+                        update_fields=update_fields)
+                    continue
+
             # Try to load the instance
-            if not instance:
+            cascade = not instance
+            if cascade and not deleted:
                 instance = loader(pk)
+            removed = deleted or not instance
+            changed_fields = update_fields
 
             if serializer:
-                # Get current value, if in cache
+                # Get current value, or its fingerprint, if in cache
                 key = self.key_for(version, model_name, pk)
-                current_raw = self.cache.get(key)
-                current = json.loads(current_raw) if current_raw else None
+                chunks = {}
+                entries = self.read_current([key], cache, chunks)
+                current_raw = entries.get(key)
+                exists = (
+                    current_raw is not None or
+                    self.fingerprint_key(key) in entries)
+                if stats and current_raw:
+                    stats.incr(
+                        model_name, version, 'bytes_read', len(current_raw))
 
                 # Get new value
-                if update_only and current_raw is None:
+                if (update_only and not exists) or removed:
                     new = None
                 else:
                     new = serializer(instance)
-                deleted = not instance
 
                 # If cache is invalid, update cache
-                invalidate = (current != new) or deleted
+                changed, new_raw = self.compare_entry(
+                    model_name, version, key, entries, new)
+                invalidate = changed or removed
+
+                # Find the changed fields, if a counter filters on fields
+                counters = self.model_option(model_name, version, 'counters')
+                if not (cascade or created or removed) and any(
+                        counters.values()):
+                    if not changed:
+                        old = new
+                    elif current_raw and current_raw != MISSING:
+                        old = self.decode_entry(current_raw)
+                    else:
+                        old = None
+                    changed_fields = entry_changed_fields(
+                        type(instance), old, new, update_fields)
                 if invalidate:
-                    if deleted:
-                        self.cache.delete(key)
+                    if removed:
+                        self.delete_entry(key, cache)
                     else:
-                        self.cache.set(key, json.dumps(new))
+                        timeout = self.model_option(
+                            model_name, version, 'timeout')
+                        if new_raw is None:
+                            new_raw = self.encode_entry(
+                                model_name, version, new)
+                        self.set_entries(
+                            {key: new_raw}, timeout, cache, chunks=chunks)
+                        if self.hot_flag_key(key) in entries:
+                            self.set_replicas({key: new_raw}, cache)
+                        if stats:
+                            stats.incr(
+                                model_name, version, 'bytes_written',
+                                len(new_raw))
+                    if stats:
+                        stats.incr(model_name, version, 'updates')
             else:
                 invalidate = True
 
+            # Add, move, or remove the instance in the primary key indexes
+            self.update_pk_indexes(
+                model_name, version, pk, None if removed else instance,
+                created, update_fields)
+
+            # Adjust the cached counters
+            if instance and not cascade:
+                self.update_counters(
+                    model_name, version, instance, created, deleted,
+                    changed_fields)
+
             # Invalidate upstream caches
             if instance and invalidate:
-                for upstream in invalidator(instance):
+                upstreams = list(invalidator(instance))
+                for upstream in upstreams:
                     if isinstance(upstream, str):
                         self.cache.delete(upstream)
                     else:
                         m, i, immediate = upstream
                         if immediate:
                             invalidate_key = self.key_for(version, m, i)
-                            self.cache.delete(invalidate_key)
+                            self.delete_entry(
+                                invalidate_key, self.cache_for(m, version))
+                        invalid.append((m, i, version))
+                if stats:
+                    stats.incr(
+                        model_name, version, 'invalidations', len(upstreams))
+        if stats:
+            stats.flush(self.cache)
+        return invalid
+
+    def pk_index_key(self, version, model_name, ordering):
+        """Get the cache key for a primary key index."""
+        return 'drfc_{0}_{1}_index_{2}'.format(version, model_name, ordering)
+
+    def pk_index_value(self, value):
+        """Convert an ordering field's value to a sortable JSON value."""
+        if isinstance(value, datetime):
+            return float(self.field_datetime_to_json(value))
+        if isinstance(value, date):
+            return value.toordinal()
+        return value
+
+    def build_pk_index(self, model, ordering):
+        """Load a primary key index from the database.
+
+        The index is a dictionary with the primary keys in ascending order,
+        and the ordering field's values for orderings other than the primary
+        key.  Return is None if a value is NULL.
+        """
+        field = ordering.lstrip('-')
+        queryset = model._default_manager.all()
+        if field == 'pk':
+            return {'pks': list(
+                queryset.order_by('pk').values_list('pk', flat=True))}
+        index = {'values': [], 'pks': []}
+        for value, pk in queryset.order_by(field, 'pk').values_list(
+                field, 'pk'):
+            value = self.pk_index_value(value)
+            if value is None:
+                return None
+            index['values'].append(value)
+            index['pks'].append(pk)
+        return index
+
+    def get_pk_index(self, model, ordering, version=None):
+        """Get the cached primary keys of a model, in an ordering.
+
+        Keyword arguments are:
+        model - The Django model
+        ordering - The ordering, such as 'pk' or '-pub_date', which must be
+            in the model's pk_indexes option.  Expressions are not indexed.
+        version - The cache version, or None for the default version
+
+        The index is loaded from the database if it is not cached.  Return
+        is the list of primary keys, or None if the ordering is not indexed.
+        """
+        version = version or self.default_version
+        model_name = model.__name__
+        orderings = self.model_option(model_name, version, 'pk_indexes')
+        cache = self.cache_for(model_name, version)
+        if not isinstance(ordering, six.string_types):
+            return None
+        if ordering not in orderings or cache is None:
+            return None
+        key = self.pk_index_key(version, model_name, ordering)
+        raw = self.get_entries([key], cache).get(key)
+        if raw is None:
+            index = self.build_pk_index(model, ordering)
+            if index is None:
+                return None
+            timeout = self.model_option(model_name, version, 'timeout')
+            self.set_entries(
+                {key: self.encode_entry(model_name, version, index)},
+                timeout, cache)
+            if self.stats:
+                self.stats.incr(model_name, version, 'pk_index_rebuilds')
+        else:
+            index = self.decode_entry(raw)
+        if ordering.startswith('-'):
+            return index['pks'][::-1]
+        return index['pks']
+
+    def update_pk_indexes(
+            self, model_name, version, pk, instance, created=False,
+            update_fields=None):
+        """Add, move, or remove an instance in the cached primary key indexes.
+
+        instance is None for a deleted instance.  A created instance is
+        added, and an updated instance is moved if the ordering field may
+        have changed.
+        """
+        orderings = []
+        for ordering in self.model_option(model_name, version, 'pk_indexes'):
+            field = ordering.lstrip('-')
+            if instance is not None and not created:
+                if field == 'pk':
+                    continue
+                if update_fields is not None and field not in update_fields:
+                    continue
+            orderings.append(ordering)
+        self.change_pk_indexes(model_name, version, {pk: instance}, orderings)
+
+    def change_pk_indexes(
+            self, model_name, version, instances, orderings=None):
+        """Change several instances in the cached primary key indexes.
+
+        Keyword arguments are:
+        model_name - The name of the model
+        version - The cache version
+        instances - A dictionary of primary keys to instances, or to None for
+            deleted instances
+        orderings - The orderings to change, or None for all
+
+        Each instance is added, or moved to its position in the ordering, and
+        deleted instances are removed.  Indexes that are not cached are
+        skipped.  An index is changed with compare_and_set, and deleted to be
+        rebuilt if that fails pklist_retries times, or if an ordering field
+        is NULL.
+        """
+        if orderings is None:
+            orderings = self.model_option(model_name, version, 'pk_indexes')
+        cache = self.cache_for(model_name, version)
+        if not orderings or not instances or cache is None:
+            return
+        timeout = self.model_option(model_name, version, 'timeout')
+        remove = [pk for pk, instance in instances.items() if instance is None]
+        for ordering in orderings:
+            key = self.pk_index_key(version, model_name, ordering)
+            add = self.pk_index_additions(ordering, instances)
+            if add is None:
+                self.delete_entry(key, cache)
+                continue
+            for attempt in range(self.pklist_retries):
+                raw = self.get_entries([key], cache).get(key)
+                if raw is None:
+                    break
+                index = self.decode_entry(raw)
+                new_index = change_pk_index(index, remove, add)
+                if new_index == index:
+                    break
+                new_raw = self.encode_entry(model_name, version, new_index)
+                if self.compare_and_set(key, raw, new_raw, timeout, cache):
+                    break
+            else:
+                self.delete_entry(key, cache)
+
+    def pk_index_additions(self, ordering, instances):
+        """Get the primary keys to add to an index, with ordering values.
+
+        Return is a list of primary keys for the 'pk' ordering, a list of
+        (value, pk) pairs for others, or None if an ordering value is NULL.
+        """
+        field = ordering.lstrip('-')
+        add = []
+        for pk, instance in instances.items():
+            if instance is None:
+                continue
+            if field == 'pk':
+                add.append(pk)
+                continue
+            attname = instance._meta.get_field(field).attname
+            value = self.pk_index_value(getattr(instance, attname))
+            if value is None:
+                return None
+            add.append((value, pk))
+        return add
+
+    def counter_key(self, version, model_name, name):
+        """Get the cache key for a counter."""
+        return 'drfc_{0}_{1}_count_{2}'.format(version, model_name, name)
+
+    def get_count(self, model, filter_kwargs=None, version=None):
+        """Get a cached count of instances.
+
+        Keyword arguments are:
+        model - The Django model
+        filter_kwargs - The exact filter, such as {'is_active': True}, or None
+            to count all instances
+        version - The cache version, or None for the default version
+
+        The count is loaded from the database if it is not cached.  It is not
+        cached inside an atomic block, where it could include uncommitted
+        instances that are counted again when the transaction commits.
+        Return is the count, or None if no counter has the filter.
+        """
+        version = version or self.default_version
+        model_name = model.__name__
+        filters = dict(filter_kwargs or {})
+        counters = self.model_option(model_name, version, 'counters')
+        cache = self.cache_for(model_name, version)
+        names = sorted(
+            name for name, counter_filters in counters.items()
+            if counter_filters == filters)
+        if not names or cache is None:
+            return None
+        key = self.counter_key(version, model_name, names[0])
+        count = cache.get(key)
+        if count is None:
+            queryset = model._default_manager.filter(**filters)
+            count = queryset.count()
+            if not connections[queryset.db].in_atomic_block:
+                timeout = self.model_option(
+                    model_name, version, 'counter_timeout')
+                cache.add(key, count, timeout)
+                if self.stats:
+                    self.stats.incr(model_name, version, 'counter_rebuilds')
+        return count
+
+    def update_counters(
+            self, model_name, version, instance, created=False,
+            deleted=False, update_fields=None):
+        """Adjust the cached counters for a changed instance.
+
+        A created instance increments, and a deleted instance decrements, the
+        counters with filters that it matches.  For other updates, the
+        counters that filter on a field that may have changed are deleted, to
+        be rebuilt.
+        """
+        if created and deleted:
+            return
+        self.change_counters(
+            model_name, version, type(instance),
+            created=[instance] if created else (),
+            deleted=[instance] if deleted else (),
+            updated=not (created or deleted), update_fields=update_fields)
+
+    def change_counters(
+            self, model_name, version, model, created=(), deleted=(),
+            updated=False, update_fields=None):
+        """Adjust the cached counters for several changed instances.
+
+        Keyword arguments are:
+        model_name - The name of the model
+        version - The cache version
+        model - The Django model
+        created - Created instances, which increment the counters with
+            filters that they match
+        deleted - Deleted instances, which decrement them
+        updated - True if other instances were updated.  The counters that
+            filter on a field that may have changed are deleted, to be
+            rebuilt.
+        update_fields - The changed fields of the updated instances, or None
+            for all fields
+
+        Each counter is changed with one incr or decr.  Counters that are not
+        cached are skipped.
+        """
+        counters = self.model_option(model_name, version, 'counters')
+        cache = self.cache_for(model_name, version)
+        if not counters or cache is None:
+            return
+        opts = model._meta
+        for name, filters in sorted(counters.items()):
+            key = self.counter_key(version, model_name, name)
+            fields = [opts.get_field(field_name) for field_name in filters]
+            if updated and fields:
+                names = set()
+                for field in fields:
+                    names.update((field.name, field.attname))
+                if update_fields is None or names.intersection(update_fields):
+                    cache.delete(key)
+                    continue
+            values = list(filters.values())
+            delta = (
+                sum(1 for obj in created
+                    if counter_matches(obj, fields, values)) -
+                sum(1 for obj in deleted
+                    if counter_matches(obj, fields, values)))
+            try:
+                if delta > 0:
+                    cache.incr(key, delta)
+                elif delta < 0:
+                    cache.decr(key, -delta)
+            except ValueError:
+                pass  # Not cached
+
+    def update_bulk_counters(
+            self, model_name, version, pks, instances, deleted, created,
+            update_fields=None):
+        """Adjust the cached counters for update_instances.
+
+        instances is a dictionary of primary keys to the loaded instances, and
+        deleted and created are the arguments to update_instances.  The
+        counters are reset if created is None, or if an instance is missing
+        and not a known deleted instance.  An instance that was created and
+        deleted is not counted.  update_fields is the set of fields changed
+        in the updated instances, or None if unknown.
+        """
+        if created is None:
+            self.reset_counters(model_name, version)
+            return
+        created = set(created)
+        created_instances = []
+        deleted_instances = []
+        updated = False
+        for pk in pks:
+            if pk in instances:
+                if pk in created:
+                    created_instances.append(instances[pk])
+                else:
+                    updated = True
+            elif deleted.get(pk) is not None:
+                if pk not in created:
+                    deleted_instances.append(deleted[pk])
+            elif pk not in created:
+                self.reset_counters(model_name, version)
+                return
+        changed = created_instances or deleted_instances
+        if changed or updated:
+            model = type((changed or list(instances.values()))[0])
+            self.change_counters(
+                model_name, version, model, created_instances,
+                deleted_instances, updated, update_fields)
+
+    def reset_counters(self, model_name, version):
+        """Delete the cached counters of a model, to be rebuilt."""
+        counters = self.model_option(model_name, version, 'counters')
+        cache = self.cache_for(model_name, version)
+        if counters and cache is not None:
+            cache.delete_many(sorted(
+                self.counter_key(version, model_name, name)
+                for name in counters))
+
+    def patch_instance(self, model_name, version, pk, patch, cache=None):
+        """Update some fields of a cached instance.
+
+        patch is a dictionary of fields in the cached representation, such
+        as {'username': 'new_name'}, from a field serializer.  The cached
+        entry is changed only if it exists and the fields are different.
+
+        Return is True if the cached entry was changed.
+        """
+        if cache is None:
+            cache = self.cache_for(model_name, version)
+        if not patch or cache is None:
+            return False
+        key = self.key_for(version, model_name, pk)
+        flag_key = self.hot_flag_key(key)
+        chunks = {}
+        if self.hot_key_threshold:
+            entries = self.get_entries([key, flag_key], cache, chunks)
+        else:
+            entries = self.get_entries([key], cache, chunks)
+        current_raw = entries.get(key)
+        if not current_raw or current_raw == MISSING:
+            return False
+        current = self.decode_entry(current_raw)
+        if all(current.get(name) == value for name, value in patch.items()):
+            return False
+        current.update(patch)
+        new_raw = self.encode_entry(model_name, version, current)
+        timeout = self.model_option(model_name, version, 'timeout')
+        self.set_entries({key: new_raw}, timeout, cache, chunks=chunks)
+        if flag_key in entries:
+            self.set_replicas({key: new_raw}, cache)
+        stats = self.stats
+        if stats:
+            stats.incr(model_name, version, 'bytes_read', len(current_raw))
+            stats.incr(model_name, version, 'bytes_written', len(new_raw))
+            stats.incr(model_name, version, 'updates')
+        return True
+
+    def update_pklist(
+            self, model_name, pk, field_name, add=(), remove=(),
+            version=None):
+        """Add and remove primary keys in a cached primary key list.
+
+        Keyword arguments are:
+        model_name - The name of the model
+        pk - The primary key of the cached instance
+        field_name - The name of a PKList or CompactPKList field, such as
+            'voters'
+        add - Primary keys to add to the list
+        remove - Primary keys to remove from the list
+        version - Version to update, or None for all
+
+        This changes the cached entry without loading the instance, such as
+        for an m2m_changed signal.  Entries that are not cached are skipped.
+        The entry is written with compare_and_set, and is rebuilt with
+        update_instance after pklist_retries conflicts, or if it does not
+        have the field.  Related instances are not updated, except by a
+        rebuild.
+
+        Return is a list of tuples (model name, pk, version) that also need
+        to be updated, from rebuilds.
+        """
+        versions = [version] if version else self.versions
+        invalid = []
+        stats = self.stats
+        for version in versions:
+            if self.model_function(model_name, version, 'serializer') is None:
+                continue
+            cache = self.cache_for(model_name, version)
+            if cache is None:
+                continue
+            changed = False
+            for attempt in range(self.pklist_retries):
+                changed = self.change_pklist(
+                    model_name, version, pk, field_name, add, remove, cache)
+                if changed is not False:
+                    break
+                if stats:
+                    stats.incr(model_name, version, 'pklist_conflicts')
+            if not changed:
+                invalid.extend(
+                    self.update_instance(model_name, pk, version=version))
+                if stats:
+                    stats.incr(model_name, version, 'pklist_rebuilds')
+        if stats:
+            stats.flush(self.cache)
+        return invalid
+
+    def change_pklist(
+            self, model_name, version, pk, field_name, add, remove, cache):
+        """Try once to change a cached primary key list.
+
+        Return is True if the entry was changed or needs no change, False if
+        another process changed it first, or None if it must be rebuilt.
+        """
+        key = self.key_for(version, model_name, pk)
+        flag_key = self.hot_flag_key(key)
+        if self.hot_key_threshold:
+            entries = self.get_entries([key, flag_key], cache)
+        else:
+            entries = self.get_entries([key], cache)
+        current_raw = entries.get(key)
+        if current_raw is None:
+            return True
+        if current_raw == MISSING:
+            return None
+        native = self.decode_entry(current_raw)
+        for key_and_type, value in native.items():
+            name, _, type_code = key_and_type.partition(':')
+            if name == field_name:
+                break
+        else:
+            return None
+        if type_code == 'PKList':
+            value = dict(value, pks=change_pks(value['pks'], add, remove))
+        elif type_code == 'CompactPKList':
+            label, pks = value
+            if not isinstance(pks, list):
+                pks = list(decode_pks(pks))
+            pks = change_pks(pks, add, remove)
+            if all(isinstance(pk, six.integer_types) for pk in pks):
+                pks = encode_pks(pks)
+            value = [label, pks]
+        else:
+            return None
+        if value == native[key_and_type]:
+            return True
+        native[key_and_type] = value
+        new_raw = self.encode_entry(model_name, version, native)
+        timeout = self.model_option(model_name, version, 'timeout')
+        if not self.compare_and_set(key, current_raw, new_raw, timeout, cache):
+            return False
+        if flag_key in entries:
+            self.set_replicas({key: new_raw}, cache)
+        stats = self.stats
+        if stats:
+            stats.incr(model_name, version, 'bytes_read', len(current_raw))
+            stats.incr(model_name, version, 'bytes_written', len(new_raw))
+            stats.incr(model_name, version, 'updates')
+        return True
+
+    def compare_and_set(self, key, current_raw, new_raw, timeout, cache):
+        """Replace a cache entry, if it is still current_raw.
+
+        Django's cache API does not have compare-and-set, so a lock key is
+        added with cache.add, which is atomic in memcached and Redis.  Writers
+        that use the lock do not overwrite each other's changes.
+
+        Return is True if the entry was replaced, or False if the lock was
+        held or the entry changed.
+        """
+        lock_key = '{0}_lock'.format(key)
+        if not cache.add(lock_key, uuid4().hex, self.lock_timeout):
+            return False
+        try:
+            chunks = {}
+            if self.get_entries([key], cache, chunks).get(key) != current_raw:
+                return False
+            self.set_entries({key: new_raw}, timeout, cache, chunks=chunks)
+            return True
+        finally:
+            cache.delete(lock_key)
+
+    def update_instances(
+            self, model_name, pks, version=None, update_only=False,
+            deleted=None, created=None, cascade=False):
+        """Create or update several cached instances of a model at once.
+
+        Keyword arguments are:
+        model_name - The name of the model
+        pks - The primary keys of the instances
+        versions - Version to update, or None for all
+        update_only - If False (default), then missing cache entries will be
+            populated and will cause follow-on invalidation.  If True, then
+            only entries already in the cache will be updated and cause
+            follow-on invalidation.
+        deleted - A dictionary of primary keys to deleted instances, or to
+            None if the instance is not known.  Deleted instances are passed
+            to the invalidator, to update the related instances.
+        created - The primary keys of created instances, or None if it is not
+            known which instances were created.  The counters are adjusted
+            for created and deleted instances if known, and deleted to be
+            rebuilt if not.  For updated instances, a counter is only reset if
+            a field it filters on changed in the cached representation.
+        cascade - True if the instances are updated because related instances
+            changed, so the counters are not changed
+
+        This is like update_instance for each primary key, but instances are
+        loaded with bulk_load, and the cache is read and written with one
+        call each.  Instances that no longer exist are deleted from the
+        cache.
+
+        Return is a list of tuples (model name, pk, version) that also need
+        to be updated, without duplicates.
+        """
+        versions = [version] if version else self.versions
+        invalid = []
+        seen = set()
+        stats = self.stats
+        pks = list(pks)
+        deleted = deleted or {}
+        for version in versions:
+            serializer = self.timed_model_function(
+                model_name, version, 'serializer')
+            loader = self.model_function(model_name, version, 'loader')
+            invalidator = self.model_function(
+                model_name, version, 'invalidator')
+            if serializer is None and loader is None and invalidator is None:
+                continue
+
+            cache = self.cache_for(model_name, version)
+            if cache is None or not pks:
+                continue
+
+            start = time()
+            instances = dict(
+                (obj.pk, obj)
+                for obj in self.bulk_load(model_name, version, pks)
+                if obj.pk not in deleted)
+            if stats:
+                stats.timing(model_name, version, 'loader', time() - start)
+
+            changed = []
+            changed_fields = None
+            if serializer:
+                keys = dict(
+                    (pk, self.key_for(version, model_name, pk)) for pk in pks)
+                chunks = {}
+                entries = self.read_current(
+                    list(keys.values()), cache, chunks)
+                to_delete = []
+                to_set = {}
+                counters = self.model_option(model_name, version, 'counters')
+                if any(counters.values()) and created is not None:
+                    changed_fields = set()
+                for pk in pks:
+                    key = keys[pk]
+                    instance = instances.get(pk)
+                    exists = (
+                        key in entries or
+                        self.fingerprint_key(key) in entries)
+                    if update_only and not exists:
+                        new = None
+                    else:
+                        new = serializer(instance)
+                    removed = not instance
+                    is_changed, new_raw = self.compare_entry(
+                        model_name, version, key, entries, new)
+                    if changed_fields is not None and not (
+                            removed or pk in created):
+                        if not is_changed:
+                            old = new
+                        elif entries.get(key, MISSING) != MISSING:
+                            old = self.decode_entry(entries[key])
+                        else:
+                            old = None
+                        fields = entry_changed_fields(
+                            type(instance), old, new)
+                        if fields is None:
+                            changed_fields = None
+                        else:
+                            changed_fields.update(fields)
+                    if is_changed or removed:
+                        if removed:
+                            to_delete.append(key)
+                            changed.append(deleted.get(pk))
+                        else:
+                            to_set[key] = new_raw or self.encode_entry(
+                                model_name, version, new)
+                            changed.append(instance)
+                if to_delete:
+                    self.delete_entries(to_delete, cache)
+                if to_set:
+                    timeout = self.model_option(model_name, version, 'timeout')
+                    self.set_entries(to_set, timeout, cache, chunks=chunks)
+                    hot = dict(
+                        (key, raw) for key, raw in to_set.items()
+                        if self.hot_flag_key(key) in entries)
+                    if hot:
+                        self.set_replicas(hot, cache)
+                if stats:
+                    stats.incr(
+                        model_name, version, 'bytes_read',
+                        sum(len(raw) for raw in entries.values()))
+                    stats.incr(
+                        model_name, version, 'bytes_written',
+                        sum(len(raw) for raw in to_set.values()))
+                    stats.incr(
+                        model_name, version, 'updates',
+                        len(to_delete) + len(to_set))
+            else:
+                changed = list(instances.values()) + list(deleted.values())
+
+            # Add, move, or remove the instances in the primary key indexes
+            self.change_pk_indexes(
+                model_name, version,
+                dict((pk, instances.get(pk)) for pk in pks))
+
+            # Adjust the cached counters, or reset them if changes are unknown
+            if not cascade:
+                self.update_bulk_counters(
+                    model_name, version, pks, instances, deleted, created,
+                    changed_fields)
+
+            # Invalidate upstream caches, merged across the instances
+            upstream_keys = set()
+            immediate = defaultdict(set)
+            count = 0
+            for instance in changed:
+                if not instance:
+                    continue
+                for upstream in invalidator(instance):
+                    count += 1
+                    if isinstance(upstream, str):
+                        upstream_keys.add(upstream)
+                        continue
+                    m, i, is_immediate = upstream
+                    if is_immediate:
+                        immediate[m].add(self.key_for(version, m, i))
+                    if (m, i, version) not in seen:
+                        seen.add((m, i, version))
                         invalid.append((m, i, version))
+            if upstream_keys:
+                self.cache.delete_many(sorted(upstream_keys))
+            for m, keys in immediate.items():
+                self.delete_entries(sorted(keys), self.cache_for(m, version))
+            if stats:
+                stats.incr(model_name, version, 'invalidations', count)
+        if stats:
+            stats.flush(self.cache)
+        return invalid
+
+    @contextmanager
+    def deferred(self, using=None):
+        """Defer cache updates from signals, and update in bulk on exit.
+
+        Use this for imports and migrations that save many instances:
+
+            with cache.deferred():
+                for row in rows:
+                    import_row(row)
+
+        Updates from update_on_commit are recorded instead of run.  On exit,
+        the recorded instances are updated with update_deferred, after the
+        transaction commits if in an atomic block.  If the block raises an
+        exception, the updates are discarded.
+        """
+        from .signals import defer_updates, on_commit
+        with defer_updates() as touched:
+            yield
+        if touched:
+            on_commit(lambda: self.update_deferred(touched), using)
+
+    def update_deferred(self, touched):
+        """Update instances in bulk, following cascades.
+
+        touched is the dictionary from defer_updates, or a sequence of
+        (model name, pk, version) tuples.  The instances are updated with
+        update_instances, grouped by model and version, and the cascaded
+        updates are merged and updated the same way, until there are none
+        left.  Each tuple is updated once.  Deleted instances from
+        defer_updates are passed to the invalidators, and the created and
+        deleted flags adjust the counters.  Cascaded updates do not change
+        the counters.
+        """
+        details = touched if isinstance(touched, dict) else {}
+        done = set()
+        pending = list(touched)
+        cascade = False
+        while pending:
+            groups = OrderedDict()
+            for spec in pending:
+                if spec not in done:
+                    done.add(spec)
+                    model_name, pk, version = spec
+                    group = groups.setdefault(
+                        (model_name, version), ([], {}, []))
+                    group[0].append(pk)
+                    instance, created, deleted = details.get(
+                        spec, (None, False, False))
+                    if deleted:
+                        group[1][pk] = instance
+                    if created:
+                        group[2].append(pk)
+            pending = []
+            for (model_name, version), group in groups.items():
+                pks, deleted, created = group
+                pending.extend(self.update_instances(
+                    model_name, pks, version, deleted=deleted,
+                    created=created, cascade=cascade))
+            cascade = True
+
+    def bulk_load(self, model_name, version, pks):
+        """Load several instances from the database.
+
+        If the cache defines a bulk loader, such as user_default_bulk_loader,
+        it is called with the list of primary keys, and should return the
+        instances that exist.  Otherwise, each instance is loaded with the
+        loader.
+
+        Return is a list of instances.  Missing instances are omitted.
+        """
+        name = "%s_%s_bulk_loader" % (model_name.lower(), version)
+        bulk_loader = getattr(self, name, None)
+        if bulk_loader:
+            return list(bulk_loader(pks))
+        loader = self.model_function(model_name, version, 'loader')
+        return [obj for obj in (loader(pk) for pk in pks) if obj]
+
+    def warm_instances(self, model_name, pks, version=None):
+        """Load, serialize, and cache several instances at once.
+
+        Keyword arguments are:
+        model_name - The name of the model
+        pks - The primary keys of the instances to cache
+        version - Version to cache, or None for the default version
+
+        Existing cache entries are replaced without comparison, and related
+        instances are not invalidated.
+
+        Return is the number of instances cached.
+        """
+        version = version or self.default_version
+        cache = self.cache_for(model_name, version)
+        if cache is None or not pks:
+            return 0
+        serializer = self.timed_model_function(
+            model_name, version, 'serializer')
+        if serializer is None:
+            return 0
+        stats = self.stats
+        start = time()
+        instances = self.bulk_load(model_name, version, pks)
+        if stats:
+            stats.timing(model_name, version, 'loader', time() - start)
+        to_set = {}
+        for obj in instances:
+            obj_native = serializer(obj)
+            if obj_native:
+                key = self.key_for(version, model_name, obj.pk)
+                to_set[key] = self.encode_entry(
+                    model_name, version, obj_native)
+        if to_set:
+            timeout = self.model_option(model_name, version, 'timeout')
+            self.set_entries(to_set, timeout, cache)
+        if stats:
+            stats.incr(
+                model_name, version, 'bytes_written',
+                sum(len(value) for value in to_set.values()))
+            stats.flush(self.cache)
+        return len(to_set)
+
+    def invalidate_queryset(self, queryset, version=None, batch_size=500):
+        """Update the cached instances in a queryset, if already cached.
+
+        Use this after QuerySet.update(), which does not send signals.  The
+        primary keys are read in batches, and each batch is updated with
+        update_instances(update_only=True).
+
+        Return is a list of tuples (model name, pk, version) that also need
+        to be updated, merged across the batches.
+        """
+        return self.update_queryset(queryset, version, batch_size, True)
+
+    def refresh_queryset(self, queryset, version=None, batch_size=500):
+        """Cache the instances in a queryset, whether cached or not.
+
+        Use this after bulk_create(), which does not send signals.  This is
+        like invalidate_queryset, but cache misses are also populated.
+        """
+        return self.update_queryset(queryset, version, batch_size, False)
+
+    def update_queryset(self, queryset, version, batch_size, update_only):
+        """Update the cached instances in a queryset, in batches."""
+        model_name = queryset.model.__name__
+        invalid = []
+        seen = set()
+        pks = queryset.order_by('pk').values_list('pk', flat=True)
+        for batch in pk_batches(pks, batch_size):
+            for upstream in self.update_instances(
+                    model_name, batch, version, update_only):
+                if upstream not in seen:
+                    seen.add(upstream)
+                    invalid.append(upstream)
         return invalid
 
     #
@@ -235,6 +1761,10 @@ class BaseCache(object):
         """Convert a date triple to the date."""
         return date(*date_triple) if date_triple else None
 
+    def field_date_from_json_many(self, date_triples):
+        """Convert a list of date triples to dates."""
+        return [date(*triple) if triple else None for triple in date_triples]
+
     def field_date_to_json(self, day):
         """Convert a date to a date triple."""
         if isinstance(day, six.string_types):
@@ -254,6 +1784,25 @@ class BaseCache(object):
             dt += timedelta(microseconds=microseconds)
         return dt
 
+    def field_datetime_from_json_many(self, json_vals):
+        """Convert a list of UTC timestamps to UTC datetimes.
+
+        The datetimes are offsets from the epoch, which skips the timezone
+        conversion of datetime.fromtimestamp.
+        """
+        epoch = datetime(1970, 1, 1, tzinfo=utc)
+        dts = []
+        for json_val in json_vals:
+            if type(json_val) == int:
+                dts.append(epoch + timedelta(seconds=json_val))
+            elif json_val is None:
+                dts.append(None)
+            else:
+                seconds, microseconds = json_val.split('.')
+                dts.append(epoch + timedelta(
+                    seconds=int(seconds), microseconds=int(microseconds)))
+        return dts
+
     def field_datetime_to_json(self, dt):
         """Convert a datetime to a UTC timestamp w/ microsecond resolution.
 
@@ -305,6 +1854,18 @@ class BaseCache(object):
         model = get_model(data['app'], data['model'])
         return PkOnlyQueryset(self, model, data['pks'])
 
+    def field_pklist_from_json_many(self, datas):
+        """Load a list of PkOnlyQuerysets, looking up each model once."""
+        models = {}
+        querysets = []
+        for data in datas:
+            label = (data['app'], data['model'])
+            if label not in models:
+                models[label] = get_model(*label)
+            querysets.append(
+                PkOnlyQueryset(self, models[label], data['pks']))
+        return querysets
+
     def field_pklist_to_json(self, model, pks):
         """Convert a list of primary keys to a JSON dict.
 
@@ -318,11 +1879,54 @@ class BaseCache(object):
             'pks': list(pks),
         }
 
+    def field_compactpklist_from_json(self, data):
+        """Load a PkOnlyQueryset from a compact JSON list."""
+        label, pks = data
+        model = get_model(*label.split('.'))
+        if not isinstance(pks, list):
+            pks = decode_pks(pks)
+        return PkOnlyQueryset(self, model, pks)
+
+    def field_compactpklist_to_json(self, model, pks):
+        """Convert a list of primary keys to a compact JSON list.
+
+        The list is the model label and the primary keys.  Integer primary
+        keys are stored as fixed-width differences, in a base64 string from
+        encode_pks.  Other primary keys, such as strings, are stored as a
+        list.
+        """
+        label = '%s.%s' % (model._meta.app_label, model._meta.model_name)
+        pks = list(pks)
+        if all(isinstance(pk, six.integer_types) for pk in pks):
+            return [label, encode_pks(pks)]
+        return [label, pks]
+
+    def field_compactpk_from_json(self, data):
+        """Load a PkOnlyModel from a compact JSON list."""
+        label, pk = data
+        return PkOnlyModel(self, get_model(*label.split('.')), pk)
+
+    def field_compactpk_to_json(self, model, pk):
+        """Convert a primary key to a compact JSON list."""
+        label = '%s.%s' % (model._meta.app_label, model._meta.model_name)
+        return [label, pk]
+
     def field_pk_from_json(self, data):
         """Load a PkOnlyModel from a JSON dict."""
         model = get_model(data['app'], data['model'])
         return PkOnlyModel(self, model, data['pk'])
 
+    def field_pk_from_json_many(self, datas):
+        """Load a list of PkOnlyModels, looking up each model once."""
+        models = {}
+        instances = []
+        for data in datas:
+            label = (data['app'], data['model'])
+            if label not in models:
+                models[label] = get_model(*label)
+            instances.append(PkOnlyModel(self, models[label], data['pk']))
+        return instances
+
     def field_pk_to_json(self, model, pk):
         """Convert a primary key to a JSON dict."""
         app_label = model._meta.app_label
@@ -332,3 +1936,156 @@ class BaseCache(object):
             'model': model_name,
             'pk': pk,
         }
+
+
+# struct format codes for little-endian signed integers, by width in bytes
+FIXED_WIDTH_CODES = ((1, 'b'), (2, 'h'), (4, 'i'), (8, 'q'))
+STRUCT_CODES = dict(FIXED_WIDTH_CODES)
+
+
+def fixed_width(values):
+    """Get the smallest (width, struct code) that holds all the values."""
+    low = min(values) if values else 0
+    high = max(values) if values else 0
+    for width, code in FIXED_WIDTH_CODES:
+        limit = 1 << (width * 8 - 1)
+        if -limit <= low and high < limit:
+            return width, code
+    raise ValueError('Primary key difference does not fit in 64 bits')
+
+
+def encode_pks(pks):
+    """Encode integer primary keys as a base64 string.
+
+    The first primary key is stored, followed by the difference from the
+    previous primary key for the others, as little-endian integers of the
+    smallest width that holds them all.  The header byte has the widths of
+    the first key and the differences.  Sorted, dense primary keys take one
+    byte each, but one large gap makes every difference wider.
+    """
+    pks = list(pks)
+    data = b''
+    if pks:
+        deltas = [pk - last for last, pk in zip(pks, pks[1:])]
+        first_width, first_code = fixed_width(pks[:1])
+        width, code = fixed_width(deltas)
+        data = struct.pack(
+            '<B%s%d%s' % (first_code, len(deltas), code),
+            (first_width << 4) | width, pks[0], *deltas)
+    return b64encode(data).decode('ascii')
+
+
+def decode_pks(encoded):
+    """Decode a base64 string from encode_pks into a list.
+
+    The differences are unpacked with one struct call, and summed with
+    itertools.accumulate.
+    """
+    data = a2b_base64(encoded)
+    if not data:
+        return []
+    header = bytearray(data[:1])[0]
+    first_width, width = header >> 4, header & 0x0f
+    count = (len(data) - 1 - first_width) // width
+    values = struct.unpack('<%s%d%s' % (
+        STRUCT_CODES[first_width], count, STRUCT_CODES[width]), data[1:])
+    return list(accumulate(values))
+
+
+def change_pks(pks, add, remove):
+    """Add and remove primary keys in a list, keeping the order."""
+    remove = set(remove)
+    changed = [pk for pk in pks if pk not in remove]
+    present = set(changed)
+    for pk in add:
+        if pk not in present:
+            present.add(pk)
+            changed.append(pk)
+    return changed
+
+
+def entry_changed_fields(model, old, new, update_fields=None):
+    """Get the fields that changed between two cached representations.
+
+    A field in the representations, such as 'pub_date:DateTime', changed if
+    the values differ.  Other fields changed if they are in update_fields,
+    or if update_fields is None.
+
+    Return is a set of field names and attribute names, or None for all
+    fields if old or new is None and update_fields is None.
+    """
+    if old is None or new is None:
+        return None if update_fields is None else set(update_fields)
+    old_values = dict((key.split(':', 1)[0], val) for key, val in old.items())
+    new_values = dict((key.split(':', 1)[0], val) for key, val in new.items())
+    changed = set()
+    for field in model._meta.concrete_fields:
+        names = set((field.name, field.attname))
+        cached = names.intersection(set(old_values) | set(new_values))
+        if cached:
+            is_changed = any(
+                (name in old_values) != (name in new_values) or
+                old_values.get(name) != new_values.get(name)
+                for name in cached)
+        else:
+            is_changed = (
+                update_fields is None or names.intersection(update_fields))
+        if is_changed:
+            changed.update(names)
+    return changed
+
+
+def chunk_manifest(raw):
+    """Get the token and chunk count of a chunked entry's manifest.
+
+    Return is None if raw is not a manifest.
+    """
+    if isinstance(raw, six.string_types) and raw.startswith(CHUNKED):
+        token, count = raw[len(CHUNKED) + 1:].split(':')
+        return token, int(count)
+    return None
+
+
+def counter_matches(instance, fields, values):
+    """Return True if an instance's fields have the counter filter values."""
+    return all(
+        getattr(instance, field.attname) == value
+        for field, value in zip(fields, values))
+
+
+def change_pk_index(index, remove=(), add=()):
+    """Return a copy of a primary key index, with primary keys changed.
+
+    remove is the primary keys to remove.  add is the primary keys to add or
+    move, or (value, pk) pairs for an index with ordering values.
+    """
+    add = list(add)
+    if 'values' not in index:
+        remove = set(remove).union(add)
+        pks = [pk for pk in index['pks'] if pk not in remove]
+        pks.extend(add)
+        pks.sort()
+        return {'pks': pks}
+    remove = set(remove).union(pk for value, pk in add)
+    pairs = [
+        (value, pk) for value, pk in zip(index['values'], index['pks'])
+        if pk not in remove]
+    pairs.extend(add)
+    pairs.sort()
+    return {
+        'values': [value for value, pk in pairs],
+        'pks': [pk for value, pk in pairs],
+    }
+
+
+def pk_batches(pks, batch_size):
+    """Yield lists of primary keys, using the last pk as the next start.
+
+    pks is a values_list('pk', flat=True) queryset, ordered by pk.
+    """
+    batch = list(pks[:batch_size])
+    while batch:
+        yield batch
+        if len(batch) < batch_size:
+            break
+        batch = list(pks.filter(pk__gt=batch[-1])[:batch_size])
@@ -10,6 +10,26 @@ except ImportError:  # pragma: nocover
     from django.db.models.loading import get_model
 assert get_model
 
+# lzma - LZMA compression
+# Added in Python 3.3, not available in Python 2.7
+try:
+    import lzma
+except ImportError:  # pragma: nocover
+    lzma = None
+
+# accumulate(iterable)
+# Yields the running totals of an iterable
+# Added in Python 3.2
+try:
+    from itertools import accumulate
+except ImportError:  # pragma: nocover
+    def accumulate(iterable):
+        """Yield the running totals of an iterable."""
+        total = 0
+        for value in iterable:
+            total += value
+            yield total
+
 # parse_duration(string)
 # Parses a Django or ISO 8601 string into a datetime.timedelta
 try:
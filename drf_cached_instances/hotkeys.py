@@ -0,0 +1,90 @@
+"""Detect frequently read cache keys, for replication.
+
+A few instances, such as the front-page Question, can get a large share of
+reads.  Each cache key is stored on a single cache node, so that node can be
+overloaded.  BaseCache samples reads with the process-wide HotKeyTracker, and
+reads hot keys from one of several replica keys, which are spread across
+nodes by the cache client.
+"""
+
+from collections import defaultdict
+from random import random
+from threading import Lock
+from time import time
+
+
+class HotKeyTracker(object):
+    """Sample cache key reads to find hot keys, for the current process."""
+
+    def __init__(self):
+        """Initialize HotKeyTracker."""
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """Clear the samples and hot keys."""
+        with self.lock:
+            self.counts = defaultdict(int)
+            self.hot = {}
+            self.window_start = time()
+            self.sampled = 0
+            self.replica_reads = 0
+            self.replica_misses = 0
+
+    def sample(self, keys, rate, threshold, window):
+        """Sample reads of cache keys, and return the set of hot keys.
+
+        Keyword arguments:
+        keys - The cache keys being read
+        rate - The fraction of reads to sample, from 0.0 to 1.0
+        threshold - The estimated reads in a window that make a key hot
+        window - The length of the counting window, in seconds
+
+        A hot key stays hot for a window after it last passed the threshold.
+        """
+        now = time()
+        with self.lock:
+            if now - self.window_start >= window:
+                self.counts = defaultdict(int)
+                self.window_start = now
+                self.hot = dict(
+                    (key, expires) for key, expires in self.hot.items()
+                    if expires > now)
+            for key in keys:
+                if random() < rate:
+                    self.sampled += 1
+                    self.counts[key] += 1
+                    if self.counts[key] >= threshold * rate:
+                        self.hot[key] = now + window
+            return set(key for key in keys if self.hot.get(key, 0) > now)
+
+    def record_replica_reads(self, reads, misses):
+        """Count reads from replicas, and replicas that were missing."""
+        with self.lock:
+            self.replica_reads += reads
+            self.replica_misses += misses
+
+    def snapshot(self, top=10):
+        """Return the detection statistics as a JSON-serializable dict.
+
+        'top' is the most-sampled keys in the current window, with the
+        number of samples.
+        """
+        now = time()
+        with self.lock:
+            counts = sorted(
+                self.counts.items(), key=lambda item: (-item[1], item[0]))
+            return {
+                'sampled': self.sampled,
+                'replica_reads': self.replica_reads,
+                'replica_misses': self.replica_misses,
+                'window_start': self.window_start,
+                'hot': sorted(
+                    key for key, expires in self.hot.items()
+                    if expires > now),
+                'top': [[key, count] for key, count in counts[:top]],
+            }
+
+
+# The tracker for this process
+hot_key_tracker = HotKeyTracker()
@@ -0,0 +1 @@
+"""Management commands for drf-cached-instances."""
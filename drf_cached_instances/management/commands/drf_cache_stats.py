@@ -0,0 +1,78 @@
+"""Show the statistics collected for the instance cache."""
+
+import json
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from drf_cached_instances.stats import (
+    clear_published_stats, get_stats, published_stats)
+
+
+class Command(BaseCommand):
+    """Show the statistics collected for the instance cache."""
+
+    help = (
+        'Show instance cache statistics published by MemoryStats collectors,'
+        ' combined across processes.')
+
+    def add_arguments(self, parser):
+        """Add command-line arguments."""
+        parser.add_argument(
+            '--json', action='store_true', default=False,
+            help='Output statistics as JSON')
+        parser.add_argument(
+            '--reset', action='store_true', default=False,
+            help='Delete the published statistics after showing them')
+
+    def handle(self, *args, **options):
+        """Show the statistics."""
+        stats = get_stats()
+        if stats and hasattr(stats, 'publish'):
+            stats.publish(cache)
+        combined = published_stats(cache)
+
+        if options['json']:
+            self.stdout.write(json.dumps(combined, indent=2, sort_keys=True))
+        elif not combined:
+            self.stdout.write('No statistics have been published.')
+        else:
+            self.stdout.write('%-16s %-10s %-14s %s' % (
+                'Model', 'Version', 'Statistic', 'Value'))
+            for stat in self.with_hit_ratios(combined):
+                self.stdout.write('%-16s %-10s %-14s %s' % (
+                    stat['model'] or '(all)', stat['version'], stat['name'],
+                    self.format_value(stat)))
+
+        if options['reset']:
+            clear_published_stats(cache)
+            if stats and hasattr(stats, 'reset'):
+                stats.reset()
+
+    def with_hit_ratios(self, combined):
+        """Add a hit_ratio statistic after the hit and miss counters."""
+        counters = dict(
+            ((stat['model'], stat['version'], stat['name']), stat['value'])
+            for stat in combined if 'value' in stat)
+        done = set()
+        for stat in combined:
+            yield stat
+            model_version = (stat['model'], stat['version'])
+            if stat['name'] in ('hits', 'misses') and (
+                    model_version not in done):
+                done.add(model_version)
+                hits = counters.get(model_version + ('hits',), 0)
+                misses = counters.get(model_version + ('misses',), 0)
+                if hits + misses:
+                    ratio = float(hits) / (hits + misses)
+                    yield {
+                        'model': stat['model'], 'version': stat['version'],
+                        'name': 'hit_ratio', 'value': '%0.3f' % ratio}
+
+    def format_value(self, stat):
+        """Format a counter or timing."""
+        if 'value' in stat:
+            return str(stat['value'])
+        average = stat['total'] / stat['count'] if stat['count'] else 0
+        return 'count=%d total=%0.4fs avg=%0.6fs max=%0.6fs' % (
+            stat['count'], stat['total'], average, stat['max'])
@@ -0,0 +1,136 @@
+"""Pre-warm the instance cache for a model."""
+
+from multiprocessing import Pool
+from time import sleep, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from drf_cached_instances.cache import pk_batches
+from drf_cached_instances.compat import get_model
+
+
+def warm_batch(cache_path, model_name, version, pks):
+    """Cache a batch of instances.
+
+    This is a module-level function so that it can run in a worker process.
+    """
+    cache = import_string(cache_path)()
+    return cache.warm_instances(model_name, pks, version)
+
+
+def close_connections():
+    """Close database connections before and after forking workers."""
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    """Pre-warm the instance cache for a model."""
+
+    help = (
+        'Load, serialize, and cache all instances of a model, in batches'
+        ' ordered by primary key.')
+
+    def add_arguments(self, parser):
+        """Add command-line arguments."""
+        parser.add_argument(
+            'cache_class',
+            help='Dotted path to the cache, like myapp.cache.MyCache')
+        parser.add_argument(
+            'model', help='Model to cache, like auth.User')
+        parser.add_argument(
+            '--cache-version', default=None,
+            help='Cache version to warm (default is the default version)')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of instances in a batch (default 500)')
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help='Number of worker processes (default 1)')
+        parser.add_argument(
+            '--max-rate', type=float, default=0,
+            help='Maximum instances per second (default unlimited)')
+        parser.add_argument(
+            '--start-pk', default=None,
+            help='Resume after this primary key')
+
+    def handle(self, *args, **options):
+        """Warm the cache."""
+        cache_path = options['cache_class']
+        try:
+            cache = import_string(cache_path)()
+        except ImportError as error:
+            raise CommandError(str(error))
+        try:
+            app_label, model_name = options['model'].split('.')
+            model = get_model(app_label, model_name)
+        except (ValueError, LookupError):
+            raise CommandError(
+                'Unknown model %r, use app_label.ModelName' % options['model'])
+        model_name = model.__name__
+        version = options['cache_version'] or cache.default_version
+        if version not in cache.versions:
+            raise CommandError('Unknown cache version %r' % version)
+        batch_size = options['batch_size']
+        processes = options['processes']
+        max_rate = options['max_rate']
+        if batch_size < 1 or processes < 1:
+            raise CommandError('--batch-size and --processes must be >= 1')
+
+        all_pks = model._default_manager.order_by('pk').values_list(
+            'pk', flat=True)
+        start_pk = options['start_pk']
+        if start_pk is not None:
+            all_pks = all_pks.filter(pk__gt=start_pk)
+        total = all_pks.count()
+
+        if processes > 1:
+            close_connections()
+            pool = Pool(processes, initializer=close_connections)
+        else:
+            pool = None
+
+        start = time()
+        submitted = 0
+        warmed = 0
+        done = 0
+        pending = []
+        for pks in pk_batches(all_pks, batch_size):
+            # Throttle to the maximum rate
+            if max_rate:
+                delay = (submitted / max_rate) - (time() - start)
+                if delay > 0:
+                    sleep(delay)
+            submitted += len(pks)
+
+            args = (cache_path, model_name, version, pks)
+            if pool:
+                pending.append((pks, pool.apply_async(warm_batch, args)))
+                if len(pending) < processes * 2:
+                    continue
+                pks, result = pending.pop(0)
+                count = result.get()
+            else:
+                count = warm_batch(*args)
+            done += len(pks)
+            warmed += count
+            self.report(model_name, done, total, warmed, pks[-1])
+
+        for pks, result in pending:
+            done += len(pks)
+            warmed += result.get()
+            self.report(model_name, done, total, warmed, pks[-1])
+        if pool:
+            pool.close()
+            pool.join()
+
+        self.stdout.write(
+            'Cached %d %s instances in %0.1f seconds.' %
+            (warmed, model_name, time() - start))
+
+    def report(self, model_name, done, total, warmed, last_pk):
+        """Report progress, with the primary key to resume from."""
+        self.stdout.write(
+            '%d/%d %s instances processed, %d cached (resume with'
+            ' --start-pk %s)' % (done, total, model_name, warmed, last_pk))
@@ -1,18 +1,58 @@
 """Mixins to add caching to Django REST Framework viewsets."""
+from time import time
+
 from django.http import Http404
 from rest_framework.generics import get_object_or_404
 
 from .models import CachedQueryset
+from .stats import RequestTimings, get_stats
 
 
 class CachedViewMixin(object):
     """Mixin to add caching to a DRF viewset.
 
     A user should either define cache_class or override get_queryset_cache().
+
+    If server_timing is True, then responses include a Server-Timing header,
+    with the time spent in each phase of loading data from the cache.
+
+    Read actions accept a sparse fieldset in the fields_param query
+    parameter, such as ?fields=id,username.  Only the requested serializer
+    fields are returned, and only their cached fields are converted.  Set
+    fields_param to None to disable.
+
+    Read actions also accept related fields to embed in the expand_param
+    query parameter, such as ?expand=question.  expandable_fields maps the
+    allowed paths, such as 'question' or 'question.choices', to the
+    serializer classes for the related instances.  Paths with more than
+    max_expand_depth levels are ignored.
     """
 
     cache_version = 'default'
     get_object_or_404 = get_object_or_404
+    server_timing = False
+    request_timings = None
+    fields_param = 'fields'
+    expand_param = 'expand'
+    expandable_fields = {}
+    max_expand_depth = 2
+
+    def initial(self, request, *args, **kwargs):
+        """Start collecting timings for the request, if enabled."""
+        if self.server_timing:
+            self.request_timings = RequestTimings(get_stats())
+            self.request_start = time()
+        super(CachedViewMixin, self).initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """Add the Server-Timing header, if enabled."""
+        response = super(CachedViewMixin, self).finalize_response(
+            request, response, *args, **kwargs)
+        if self.request_timings:
+            total = time() - self.request_start
+            response['Server-Timing'] = self.request_timings.server_timing(
+                total)
+        return response
 
     def get_queryset(self):
         """Get the queryset for the action.
@@ -22,10 +62,105 @@ class CachedViewMixin(object):
         """
         queryset = super(CachedViewMixin, self).get_queryset()
         if self.action in ('list', 'retrieve'):
-            return CachedQueryset(self.get_queryset_cache(), queryset=queryset)
+            cache = self.get_queryset_cache()
+            if self.request_timings:
+                cache.stats = self.request_timings
+            cached = CachedQueryset(cache, queryset=queryset)
+            sources = self.get_requested_sources()
+            if sources is not None:
+                cached = cached.only(*sources)
+            expansions = self.get_requested_expansions()
+            if expansions:
+                cached = cached.expand(*expansions)
+            return cached
         else:
             return queryset
 
+    def get_param_list(self, param):
+        """Get a comma-separated query parameter for a read action."""
+        request = getattr(self, 'request', None)
+        if not param or request is None:
+            return None
+        if self.action not in ('list', 'retrieve'):
+            return None
+        params = getattr(request, 'query_params', request.GET)
+        value = params.get(param)
+        if not value:
+            return None
+        return set(name.strip() for name in value.split(','))
+
+    def get_requested_fields(self):
+        """Get the serializer field names requested, or None for all."""
+        return self.get_param_list(self.fields_param)
+
+    def get_requested_expansions(self):
+        """Get the requested paths to expand, sorted by depth.
+
+        Paths that are not in expandable_fields, that are deeper than
+        max_expand_depth, or that are in fields not requested, are ignored.
+        The parents of a path are included.
+        """
+        requested = self.get_param_list(self.expand_param)
+        if not requested:
+            return []
+        fields = self.get_requested_fields()
+        paths = set()
+        for path in requested:
+            names = path.split('.')
+            if len(names) > self.max_expand_depth:
+                continue
+            if fields is not None and names[0] not in fields:
+                continue
+            for depth in range(1, len(names) + 1):
+                parent = '.'.join(names[:depth])
+                if parent not in self.expandable_fields:
+                    break
+                paths.add(parent)
+        return sorted(paths, key=lambda path: (path.count('.'), path))
+
+    def get_requested_sources(self):
+        """Get the model attributes for the requested fields, or None for all.
+
+        A field with source='*' uses the whole instance, so all attributes
+        are needed.
+        """
+        requested = self.get_requested_fields()
+        if requested is None:
+            return None
+        sources = set()
+        fields = self.get_serializer_class()().fields
+        for name, field in fields.items():
+            if name in requested:
+                if field.source == '*':
+                    return None
+                sources.add(field.source.split('.')[0])
+        for path in self.get_requested_expansions():
+            sources.add(path.split('.')[0])
+        return sources
+
+    def get_serializer(self, *args, **kwargs):
+        """Get the serializer, with only the requested fields."""
+        serializer = super(CachedViewMixin, self).get_serializer(
+            *args, **kwargs)
+        requested = self.get_requested_fields()
+        if requested is not None:
+            fields = getattr(serializer, 'child', serializer).fields
+            for name in list(fields):
+                if name not in requested:
+                    fields.pop(name)
+        for path in self.get_requested_expansions():
+            parent = getattr(serializer, 'child', serializer)
+            names = path.split('.')
+            for name in names[:-1]:
+                parent = parent.fields[name]
+                parent = getattr(parent, 'child', parent)
+            name = names[-1]
+            model_field = parent.Meta.model._meta.get_field(name)
+            many = model_field.many_to_many or model_field.one_to_many
+            parent.fields[name] = self.expandable_fields[path](
+                many=many, read_only=True)
+        return serializer
+
     def get_queryset_cache(self):
         """Get the cache to use for querysets."""
         return self.cache_class()
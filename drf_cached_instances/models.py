@@ -5,6 +5,10 @@ These classes are look-alike replacements for django.db.model.Model and
 Queryset.  The full interface is not implemented, only enough to use then
 in common Django REST Framework use cases.
 """
+from collections import OrderedDict, defaultdict
+from time import time
+
+from django.utils import six
 
 
 class PkOnlyModel(object):
@@ -56,19 +60,94 @@ class PkOnlyQueryset(object):
 
 
 class CachedModel(object):
-    """Emulate a Django model, but with data loaded from the cache."""
+    """Emulate a Django model, but with data loaded from the cache.
+
+    If the cache is set, data can include typed fields from the cached
+    representation, such as 'pub_date:DateTime'.  A typed field is converted
+    when the attribute is first accessed, so unused fields are not converted.
+    If siblings is set, such as the list of CachedModels from a queryset, the
+    field is converted for all the siblings at once, with fields_from_json.
+
+    If fields is set, only those fields and the primary key are available.
+    The version is the cache version the data was loaded with, and is used
+    to report the 'convert' timing.  If unset, the cache's default version
+    is used.
+    """
 
-    def __init__(self, model, data):
+    _attrs = (
+        '_model', '_cache', '_values', '_typed', '_siblings', '_version')
+
+    def __init__(
+            self, model, data, cache=None, fields=None, siblings=None,
+            version=None):
         """Initialize a CachedModel."""
         self._model = model
-        self._data = data
+        self._cache = cache
+        self._version = version
+        self._values = {}
+        self._typed = {}
+        self._siblings = siblings
+        if fields is not None:
+            fields = set(fields)
+            fields.add(model._meta.pk.attname)
+        for key, value in data.items():
+            name = key.split(':', 1)[0]
+            if fields is not None and name not in fields:
+                continue
+            if cache is not None and ':' in key:
+                self._typed[name] = (key, value)
+            else:
+                self._values[key] = value
+
+    @property
+    def _data(self):
+        """Get the cached data, with all typed fields converted."""
+        for name in list(self._typed):
+            self._convert(name)
+        return self._values
+
+    def _convert(self, name):
+        """Convert a typed field, and store the value.
+
+        If there are siblings, the field is converted for all of them that
+        have not converted it yet.  The conversion is reported as the
+        'convert' timing.
+        """
+        start = time()
+        if self._siblings is None:
+            key_and_type, json_value = self._typed.pop(name)
+            name, value = self._cache.field_from_json(
+                key_and_type, json_value)
+            self._values[name] = value
+        else:
+            columns = OrderedDict()
+            for obj in [self] + self._siblings:
+                if name in obj._typed:
+                    key_and_type, json_value = obj._typed.pop(name)
+                    columns.setdefault(key_and_type, []).append(
+                        (obj, json_value))
+            for key_and_type, column in columns.items():
+                field_name, values = self._cache.fields_from_json(
+                    key_and_type, [json_value for obj, json_value in column])
+                for (obj, json_value), value in zip(column, values):
+                    obj._values[field_name] = value
+            value = self._values[field_name]
+        if self._cache.stats:
+            version = self._version or self._cache.default_version
+            self._cache.stats.timing(
+                self._model.__name__, version, 'convert', time() - start)
+        return value
 
     def __getattr__(self, name):
         """Return an attribute from the cached data."""
-        if name in self._data:
-            return self._data[name]
+        if name in self._attrs:
+            raise AttributeError(name)
+        if name in self._values:
+            return self._values[name]
+        elif name in self._typed:
+            return self._convert(name)
         elif name == 'pk':
-            return self._data.get(self._model._meta.pk.attname)
+            return getattr(self, self._model._meta.pk.attname, None)
         else:
             raise AttributeError(
                 "%r object has no attribute %r" %
@@ -79,34 +158,92 @@ class CachedQueryset(object):
     """Emulate a Djange queryset, but with data loaded from the cache.
 
     A real queryset is used to get filtered lists of primary keys, but the
-    cache is used instead of the database to get the instance data.
+    cache is used instead of the database to get the instance data.  If
+    fields is set, the CachedModels have only those fields.  The related
+    instances in the expand paths, such as 'question.choices', are loaded
+    from the cache as CachedModels.  The primary keys of an unfiltered
+    queryset come from the cache's primary key index for the ordering, if
+    there is one, and the count comes from the cache's counter for the
+    filter_kwargs of filter().  The instances, indexes, counters and
+    timings use the cache version, or the cache's default version if unset.
     """
 
-    def __init__(self, cache, queryset, primary_keys=None):
+    def __init__(
+            self, cache, queryset, primary_keys=None, fields=None,
+            expand=(), version=None):
         """Initialize a CachedQueryset."""
         self.cache = cache
+        self.version = version or cache.default_version
         assert queryset is not None
         self.queryset = queryset
         self.model = queryset.model
         self.filter_kwargs = {}
+        self._countable = is_unfiltered(queryset)
         self._primary_keys = primary_keys
+        self.fields = fields
+        self.expand_paths = tuple(expand)
 
     @property
     def pks(self):
         """Lazy-load the primary keys."""
         if self._primary_keys is None:
+            self._primary_keys = self._pk_index()
+        if self._primary_keys is None:
+            start = time()
             self._primary_keys = list(
                 self.queryset.values_list('pk', flat=True))
+            self._timing(start)
         return self._primary_keys
 
+    def _pk_index(self):
+        """Get the cached primary key index for the queryset's ordering.
+
+        Return is None if the queryset is filtered, sliced, or ordered by more
+        than one field or by an expression, or if the ordering is not indexed.
+        """
+        indexes = self.cache.model_option(
+            self.model.__name__, self.version, 'pk_indexes')
+        if not indexes or not is_unfiltered(self.queryset):
+            return None
+        query = self.queryset.query
+        ordering = query.order_by
+        if not ordering and query.default_ordering:
+            ordering = self.model._meta.ordering
+        ordering = list(ordering) or ['pk']
+        if len(ordering) != 1 or not isinstance(
+                ordering[0], six.string_types):
+            return None
+        ordering = ordering[0]
+        pk_name = self.model._meta.pk.name
+        if ordering.lstrip('-') == pk_name:
+            ordering = ordering.replace(pk_name, 'pk')
+        return self.cache.get_pk_index(
+            self.model, ordering, version=self.version)
+
+    def _timing(self, start):
+        """Record the duration of a database query."""
+        if self.cache.stats:
+            self.cache.stats.timing(
+                self.model.__name__, self.version, 'queryset', time() - start)
+
     def __iter__(self):
         """Return the cached data as a list."""
         model_name = self.model.__name__
         object_specs = [(model_name, pk, None) for pk in self.pks]
-        instances = self.cache.get_instances(object_specs)
+        instances = self.cache.get_instances(
+            object_specs, version=self.version, lazy=True)
+        cached = []
         for pk in self.pks:
-            model_data = instances.get((model_name, pk), {})[0]
-            yield CachedModel(self.model, model_data)
+            instance = instances.get((model_name, pk))
+            if instance:
+                cached.append(CachedModel(
+                    self.model, instance[0], self.cache, self.fields,
+                    siblings=cached, version=self.version))
+        if self.expand_paths:
+            expand_related(
+                self.cache, cached, self.expand_paths, self.version)
+        for obj in cached:
+            yield obj
 
     def all(self):
         """Handle asking for an unfiltered queryset."""
@@ -114,21 +251,52 @@ class CachedQueryset(object):
 
     def none(self):
         """Handle asking for an empty queryset."""
-        return CachedQueryset(self.cache, self.queryset.none(), [])
+        return CachedQueryset(
+            self.cache, self.queryset.none(), [], self.fields,
+            self.expand_paths, self.version)
 
     def count(self):
         """Return a count of instances."""
         if self._primary_keys is None:
-            return self.queryset.count()
+            if self._countable:
+                count = self.cache.get_count(
+                    self.model, self.filter_kwargs, version=self.version)
+                if count is not None:
+                    return count
+            pks = self._pk_index()
+            if pks is not None:
+                return len(pks)
+            start = time()
+            count = self.queryset.count()
+            self._timing(start)
+            return count
         else:
             return len(self.pks)
 
     def filter(self, **kwargs):
         """Filter the base queryset."""
         assert not self._primary_keys
+        if set(kwargs).intersection(self.filter_kwargs):
+            self._countable = False
+        self.filter_kwargs.update(kwargs)
         self.queryset = self.queryset.filter(**kwargs)
         return self
 
+    def only(self, *fields):
+        """Limit the CachedModels to some fields, and the primary key."""
+        self.fields = fields
+        return self
+
+    def expand(self, *paths):
+        """Load related instances from the cache, such as 'question'.
+
+        A path can include related instances of related instances, such as
+        'question.choices'.  Each level of the paths is loaded with one
+        get_instances call.
+        """
+        self.expand_paths = paths
+        return self
+
     def get(self, *args, **kwargs):
         """Return the single item from the filtered queryset."""
         assert not args
@@ -136,7 +304,8 @@ class CachedQueryset(object):
         pk = kwargs['pk']
         model_name = self.model.__name__
         object_spec = (model_name, pk, None)
-        instances = self.cache.get_instances((object_spec,))
+        instances = self.cache.get_instances(
+            (object_spec,), version=self.version, lazy=True)
         try:
             model_data = instances[(model_name, pk)][0]
         except KeyError:
@@ -144,12 +313,106 @@ class CachedQueryset(object):
                 "No match for %r with args %r, kwargs %r" %
                 (self.model, args, kwargs))
         else:
-            return CachedModel(self.model, model_data)
+            obj = CachedModel(
+                self.model, model_data, self.cache, self.fields,
+                version=self.version)
+            if self.expand_paths:
+                expand_related(
+                    self.cache, [obj], self.expand_paths, self.version)
+            return obj
 
     def __getitem__(self, key):
         """Access the queryset by index or range."""
         if self._primary_keys is None:
-            pks = self.queryset.values_list('pk', flat=True)[key]
+            pks = self._pk_index()
+            if pks is None:
+                pks = self.queryset.values_list('pk', flat=True)
+            pks = pks[key]
         else:
             pks = self.pks[key]
-        return CachedQueryset(self.cache, self.queryset, pks)
+        return CachedQueryset(
+            self.cache, self.queryset, pks, self.fields, self.expand_paths,
+            self.version)
+
+
+def is_unfiltered(queryset):
+    """Return True if a queryset has no filters, slicing, or extras."""
+    query = queryset.query
+    return not (
+        query.where or query.distinct or query.low_mark or
+        query.high_mark is not None or query.extra)
+
+
+def expand_related(cache, instances, paths, version=None):
+    """Replace related primary keys of CachedModels with CachedModels.
+
+    Keyword arguments:
+    cache - The BaseCache
+    instances - The CachedModels to expand
+    paths - The related fields to expand, such as 'question' for a PK field
+        or 'question.choices' for a PKList field of the related instance
+    version - The cache version, or None for the default version
+
+    The related instances for each level of the paths, across all the
+    instances, are loaded with one get_instances call.  A PK field becomes
+    a CachedModel, or None if the instance is missing, and a PKList field
+    becomes a list of CachedModels.
+    """
+    tree = {}
+    for path in paths:
+        node = tree
+        for name in path.split('.'):
+            node = node.setdefault(name, {})
+
+    level = [(instances, tree)]
+    while level:
+        # Collect the related instances for this level
+        refs = []
+        specs = []
+        for objs, node in level:
+            for obj in objs:
+                for name, subtree in node.items():
+                    value = getattr(obj, name, None)
+                    if isinstance(value, PkOnlyModel):
+                        specs.append((value.model, value.pk))
+                    elif isinstance(value, PkOnlyQueryset):
+                        specs.extend((value.model, pk) for pk in value.pks)
+                    refs.append((obj, name, value, subtree))
+
+        # Load them with one call
+        models = dict((model.__name__, model) for model, pk in specs)
+        loaded = {}
+        if specs:
+            loaded = cache.get_instances(
+                [(model.__name__, pk, None) for model, pk in set(specs)],
+                version=version, lazy=True)
+        related = {}
+        siblings = defaultdict(list)
+        for (model_name, pk), instance in loaded.items():
+            obj = CachedModel(
+                models[model_name], instance[0], cache,
+                siblings=siblings[model_name], version=version)
+            siblings[model_name].append(obj)
+            related[(model_name, pk)] = obj
+
+        # Replace the primary keys, and collect the next level
+        level = []
+        for obj, name, value, subtree in refs:
+            if isinstance(value, PkOnlyModel):
+                value = related.get((value.model.__name__, value.pk))
+                obj._values[name] = value
+                children = [] if value is None else [value]
+            elif isinstance(value, PkOnlyQueryset):
+                value = [
+                    related[(value.model.__name__, pk)] for pk in value.pks
+                    if (value.model.__name__, pk) in related]
+                obj._values[name] = value
+                children = value
+            elif isinstance(value, CachedModel):
+                children = [value]
+            elif isinstance(value, list):
+                children = value
+            else:
+                children = []
+            if subtree and children:
+                level.append((children, subtree))
@@ -0,0 +1,228 @@
+"""Buffer cache updates from model signals until the transaction commits.
+
+Signal receivers run in the middle of a transaction.  Updating the cache
+immediately can cache data that is later rolled back, and saving an instance
+several times in a transaction serializes it several times.  update_on_commit
+collects the updates for each transaction, drops duplicates, and runs them
+once after the transaction commits.
+
+defer_updates collects the instances to update instead, for a bulk update
+with BaseCache.deferred().
+
+pklist_on_commit changes cached primary key lists after the transaction
+commits, for m2m_changed signals.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import copy
+from functools import partial
+from threading import local
+
+from django.db import transaction
+
+_local = local()
+
+
+def update_on_commit(
+        func, model_name, pk, instance=None, version=None, using=None,
+        update_fields=None, created=False, deleted=False):
+    """Update the cache for an instance after the transaction commits.
+
+    Keyword arguments:
+    func - The update function, called as func(model_name, pk, instance,
+        version), such as a task that calls BaseCache.update_instance
+    model_name - The name of the model
+    pk - The primary key of the instance
+    instance - The Django model instance, or None to load it
+    version - Version to update, or None for all
+    using - The database alias, or None for the default database
+    update_fields - The names of the changed fields, or None for all.  If
+        set, func is called with the update_fields keyword argument.
+    created - True if the instance was created.  If set, func is called with
+        the created keyword argument.
+    deleted - True if the instance was deleted.  If set, func is called with
+        the deleted keyword argument.
+
+    Outside of an atomic block, func is called immediately.  Inside one, the
+    update is added to a batch for the current savepoint, replacing an
+    earlier update for the same instance, and the batch is run when the
+    transaction commits.  If the transaction or the savepoint is rolled back,
+    the batch is discarded.  An instance updated at several savepoint levels
+    is updated once per level, in order.
+
+    The instance is copied, so that it keeps its primary key if it is
+    deleted before the transaction commits.  The update_fields of several
+    updates are combined, an instance created by any of them is created, and
+    the last update decides if it is deleted.
+
+    Inside defer_updates, the update is recorded instead, with a copy of the
+    instance and the created and deleted flags.
+    """
+    deferred = getattr(_local, 'deferred', None)
+    if deferred:
+        record_deferred(
+            deferred[-1], (model_name, pk, version),
+            None if instance is None else copy(instance), created, deleted)
+        return
+    connection = transaction.get_connection(using)
+    if not in_transaction(connection):
+        call_update(
+            func, model_name, pk, instance, version, update_fields, created,
+            deleted)
+        return
+    batch = pending_batch(connection)
+    key = (func, model_name, pk, version)
+    if key in batch:
+        created = created or batch[key][2]
+    if update_fields is not None:
+        if key in batch:
+            pending_fields = batch[key][1]
+            if pending_fields is None:
+                update_fields = None
+            else:
+                update_fields = pending_fields | frozenset(update_fields)
+        else:
+            update_fields = frozenset(update_fields)
+    batch[key] = (
+        None if instance is None else copy(instance), update_fields, created,
+        deleted)
+
+
+def pklist_on_commit(
+        func, model_name, pk, field_name, add=(), remove=(), using=None):
+    """Change a cached primary key list after the transaction commits.
+
+    Keyword arguments:
+    func - The change function, called as func(model_name, pk, field_name,
+        add, remove), such as a task that calls BaseCache.update_pklist
+    model_name - The name of the model
+    pk - The primary key of the instance
+    field_name - The name of the primary key list field, such as 'voters'
+    add - Primary keys added to the list
+    remove - Primary keys removed from the list
+    using - The database alias, or None for the default database
+
+    Outside of an atomic block, func is called immediately.  Changes are
+    applied in order, and adding or removing a primary key twice has no
+    effect, so they can be mixed with updates from update_on_commit.
+
+    Inside defer_updates, the instance is recorded for a full update
+    instead.
+    """
+    deferred = getattr(_local, 'deferred', None)
+    if deferred:
+        record_deferred(deferred[-1], (model_name, pk, None))
+        return
+    add = list(add)
+    remove = list(remove)
+    on_commit(
+        partial(func, model_name, pk, field_name, add, remove), using=using)
+
+
+def call_update(
+        func, model_name, pk, instance, version, update_fields,
+        created=False, deleted=False):
+    """Call an update function, with the keyword arguments that are set."""
+    kwargs = {}
+    if update_fields is not None:
+        kwargs['update_fields'] = update_fields
+    if created:
+        kwargs['created'] = True
+    if deleted:
+        kwargs['deleted'] = True
+    func(model_name, pk, instance, version, **kwargs)
+
+
+def pending_batch(connection):
+    """Get the batch of updates for the connection's current savepoint.
+
+    There is a batch for each level of savepoints, with an on_commit callback
+    registered at that level, so that a rollback of the savepoint discards
+    the updates made inside it.  A new batch is started if there is none, or
+    if the batch's on_commit callback was discarded by a rollback.
+    """
+    batches = getattr(_local, 'batches', None)
+    if batches is None:
+        batches = _local.batches = {}
+    alias = connection.alias
+    batch_id = (alias, tuple(connection.savepoint_ids))
+    registered = set(func for sids, func in connection.run_on_commit)
+    for other_id in list(batches):
+        if other_id[0] == alias and batches[other_id][1] not in registered:
+            del batches[other_id]  # Discarded by a rollback
+    if batch_id in batches:
+        return batches[batch_id][0]
+
+    batch = OrderedDict()
+
+    def flush():
+        """Run the updates for a committed transaction."""
+        if batch_id in batches and batches[batch_id][0] is batch:
+            del batches[batch_id]
+        for key, (instance, update_fields, created, deleted) in batch.items():
+            func, model_name, pk, version = key
+            call_update(
+                func, model_name, pk, instance, version, update_fields,
+                created, deleted)
+
+    batches[batch_id] = (batch, flush)
+    transaction.on_commit(flush, using=alias)
+    return batch
+
+
+def in_transaction(connection):
+    """Return True if on_commit callbacks wait for a transaction."""
+    return (
+        connection.in_atomic_block and
+        hasattr(transaction, 'on_commit'))  # Django 1.9 and later
+
+
+def on_commit(func, using=None):
+    """Call func when the transaction commits, or now if not in one."""
+    if in_transaction(transaction.get_connection(using)):
+        transaction.on_commit(func, using=using)
+    else:
+        func()
+
+
+def record_deferred(
+        touched, spec, instance=None, created=False, deleted=False):
+    """Record an update in a defer_updates dictionary.
+
+    The updates of an instance are combined like in update_on_commit: the
+    latest instance is kept, an instance created by any update is created,
+    and the last update decides if it is deleted.
+    """
+    if spec in touched:
+        old_instance, old_created, old_deleted = touched[spec]
+        if instance is None:
+            instance = old_instance
+        created = created or old_created
+    touched[spec] = (instance, created, deleted)
+
+
+@contextmanager
+def defer_updates():
+    """Record the updates from update_on_commit, instead of running them.
+
+    The context value is an ordered dictionary, with keys (model name, pk,
+    version) for the instances to update, and values (instance, created,
+    deleted).  The instance is a copy of the instance passed to
+    update_on_commit, or None.  If defer_updates is nested, the inner updates
+    are added to the outer context, and the inner dictionary is empty on
+    exit.
+    """
+    stack = getattr(_local, 'deferred', None)
+    if stack is None:
+        stack = _local.deferred = []
+    touched = OrderedDict()
+    stack.append(touched)
+    try:
+        yield touched
+    finally:
+        stack.pop()
+    if stack:
+        for spec, (instance, created, deleted) in touched.items():
+            record_deferred(stack[-1], spec, instance, created, deleted)
+        touched.clear()
@@ -0,0 +1,217 @@
+"""Declarative cache specs, to generate the model functions for BaseCache.
+
+Instead of writing the serializer, loader, bulk loader, add_related_pks, and
+invalidator for a model, declare the cached fields and relations:
+
+    class MyCache(BaseCache):
+        specs = (
+            CacheSpec(
+                User, fields=('id', 'username', ('date_joined', 'DateTime')),
+                pklist_fields=('votes',)),
+            CacheSpec(
+                Choice, fields=('id', 'choice_text'),
+                pk_fields=('question',), pklist_fields=('voters',),
+                invalidates=(('question', True), ('voters', False))),
+        )
+
+Methods defined on the cache class, such as user_default_serializer, are
+used instead of the generated functions.
+"""
+
+from collections import defaultdict
+from functools import partial
+
+from django.utils import six
+
+
+class CacheSpec(object):
+    """Declare how a model is cached."""
+
+    def __init__(
+            self, model, fields=(), pk_fields=(), pklist_fields=(),
+            invalidates=(), invalidate_keys=(), version='default',
+            select_related=(), prefetch_related=(), pk_type='PK',
+            pklist_type='PKList'):
+        """Initialize CacheSpec.
+
+        Keyword arguments:
+        model - The Django model
+        fields - The names of cached fields, or (name, type code) pairs for
+            fields converted with a field type, such as ('pub_date',
+            'DateTime')
+        pk_fields - The names of foreign keys, cached as primary keys
+        pklist_fields - The names of many-to-many and reverse foreign key
+            relations, cached as lists of primary keys
+        invalidates - (relation name, immediate) pairs, for related
+            instances to update when an instance changes
+        invalidate_keys - Cache keys to delete when an instance changes
+        version - The cache version
+        select_related, prefetch_related - Passed to the loader's queryset,
+            for custom serializers
+        pk_type, pklist_type - The field types for related primary keys,
+            such as 'CompactPKList'
+        """
+        self.model = model
+        self.fields = [
+            (field, None) if isinstance(field, six.string_types)
+            else tuple(field)
+            for field in fields]
+        self.pk_fields = tuple(pk_fields)
+        self.pklist_fields = tuple(pklist_fields)
+        self.invalidates = tuple(invalidates)
+        self.invalidate_keys = list(invalidate_keys)
+        self.version = version
+        self.select_related = tuple(select_related)
+        self.prefetch_related = tuple(prefetch_related)
+        self.pk_type = pk_type
+        self.pklist_type = pklist_type
+
+    @property
+    def model_name(self):
+        """Get the model name used in cache keys and function names."""
+        return self.model.__name__
+
+    def install(self, cache):
+        """Add the generated model functions to a cache instance."""
+        assert self.version in cache.versions
+        for func_name in (
+                'serializer', 'field_serializer', 'loader', 'bulk_loader',
+                'add_related_pks', 'invalidator'):
+            name = '%s_%s_%s' % (
+                self.model_name.lower(), self.version, func_name)
+            if not hasattr(cache, name):
+                setattr(cache, name, partial(getattr(self, func_name), cache))
+
+    def related_pks_attr(self, name):
+        """Get the instance attribute for a list of related primary keys."""
+        return '_%s_pks' % name
+
+    def related_pk_pairs(self, name, pks):
+        """Query the (instance pk, related pk) pairs for a relation.
+
+        This uses one query for all the instances.
+        """
+        field = self.model._meta.get_field(name)
+        if field.many_to_many:
+            if field.auto_created:
+                # Reverse many-to-many, like User.votes
+                m2m = field.field
+                source = m2m.m2m_reverse_field_name()
+                target = m2m.m2m_field_name()
+            else:
+                m2m = field
+                source = m2m.m2m_field_name()
+                target = m2m.m2m_reverse_field_name()
+            remote_field = getattr(m2m, 'remote_field', None) or m2m.rel
+            queryset = remote_field.through._default_manager
+        else:
+            # Reverse foreign key, like Question.choices
+            source = field.field.name
+            target = 'pk'
+            queryset = field.related_model._default_manager
+        return queryset.filter(
+            **{source + '__in': pks}).values_list(source, target)
+
+    def related_model(self, name):
+        """Get the related model for a relation."""
+        return self.model._meta.get_field(name).related_model
+
+    def serializer(self, cache, obj):
+        """Convert an instance to a cached instance representation."""
+        if not obj:
+            return None
+        self.add_related_pks(cache, obj)
+        data = {}
+        for name, type_code in self.fields:
+            value = getattr(obj, name)
+            if type_code:
+                name, value = cache.field_to_json(type_code, name, value)
+            data[name] = value
+        for name in self.pk_fields:
+            field = self.model._meta.get_field(name)
+            key, value = cache.field_to_json(
+                self.pk_type, name, model=field.related_model,
+                pk=getattr(obj, field.attname))
+            data[key] = value
+        for name in self.pklist_fields:
+            key, value = cache.field_to_json(
+                self.pklist_type, name, model=self.related_model(name),
+                pks=getattr(obj, self.related_pks_attr(name)))
+            data[key] = value
+        return data
+
+    def field_serializer(self, cache, obj, field_names):
+        """Convert changed fields to a patch for the cached representation.
+
+        Fields that are not cached are ignored.  Return is None if a related
+        primary key changed, which needs a full update.
+        """
+        type_codes = dict(self.fields)
+        relations = set(self.pklist_fields)
+        for name in self.pk_fields:
+            relations.add(name)
+            relations.add(self.model._meta.get_field(name).attname)
+        patch = {}
+        for name in field_names:
+            if name in relations:
+                return None
+            if name in type_codes:
+                value = getattr(obj, name)
+                if type_codes[name]:
+                    key, value = cache.field_to_json(
+                        type_codes[name], name, value)
+                    patch[key] = value
+                else:
+                    patch[name] = value
+        return patch
+
+    def loader(self, cache, pk):
+        """Load an instance from the database, or None if missing."""
+        instances = self.bulk_loader(cache, [pk])
+        return instances[0] if instances else None
+
+    def bulk_loader(self, cache, pks):
+        """Load instances from the database.
+
+        The instances are loaded with one query, plus one query for each
+        list of related primary keys.
+        """
+        queryset = self.model._default_manager.filter(pk__in=pks)
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        instances = list(queryset)
+        if instances:
+            loaded_pks = [obj.pk for obj in instances]
+            for name in self.pklist_fields:
+                related = defaultdict(list)
+                for pk, related_pk in self.related_pk_pairs(name, loaded_pks):
+                    related[pk].append(related_pk)
+                for obj in instances:
+                    setattr(obj, self.related_pks_attr(name), related[obj.pk])
+        return instances
+
+    def add_related_pks(self, cache, obj, names=None):
+        """Add related primary keys to an instance, if not loaded."""
+        for name in (self.pklist_fields if names is None else names):
+            attr = self.related_pks_attr(name)
+            if not hasattr(obj, attr):
+                setattr(obj, attr, list(
+                    getattr(obj, name).values_list('pk', flat=True)))
+
+    def invalidator(self, cache, obj):
+        """Return the related instances and keys to update."""
+        invalid = list(self.invalidate_keys)
+        for name, immediate in self.invalidates:
+            field = self.model._meta.get_field(name)
+            model_name = field.related_model.__name__
+            if field.concrete and (field.many_to_one or field.one_to_one):
+                pk = getattr(obj, field.attname)
+                if pk is not None:
+                    invalid.append((model_name, pk, immediate))
+            else:
+                self.add_related_pks(cache, obj, [name])
+                for pk in getattr(obj, self.related_pks_attr(name)):
+                    invalid.append((model_name, pk, immediate))
+        return invalid
@@ -0,0 +1,241 @@
+"""Statistics collectors for the instance cache.
+
+A collector receives counters and timings from BaseCache, labeled by model
+name and cache version.  The collector is set with the DRF_INSTANCE_CACHE_STATS
+setting, which is the dotted path to a collector class, such as
+'drf_cached_instances.stats.MemoryStats'.  By default, no statistics are
+collected.
+
+Counters:
+requested - Instances requested from get_instances
+hits - Requested instances found in the cache
+misses - Requested instances loaded from the database
+missing - Requested instances cached as missing (also counted as hits)
+upgrades - Missed instances upgraded from an earlier cache version
+bytes_read - Size of cached entries read by get_instances and update_instance
+bytes_written - Size of entries written to the cache
+bytes_saved - Bytes saved by compressing entries
+updates - Cache entries changed or deleted by update_instance
+invalidations - Related instances and keys invalidated by update_instance
+fingerprint_checks - Updates compared by fingerprint, without reading the entry
+pklist_conflicts - Primary key list changes retried after a conflict
+pklist_rebuilds - Primary key list changes that rebuilt the entry
+pk_index_rebuilds - Primary key indexes loaded from the database
+counter_rebuilds - Counters loaded from the database
+
+Timings, in seconds:
+cache_get - Reading entries from the cache (model name is None)
+loader - Loading instances from the database
+serializer - Converting instances to the cached representation
+upgrader - Upgrading entries from an earlier cache version
+decode - Converting cached entries to native representations, recorded
+    once per model for each get_instances call
+convert - Converting typed fields of cached entries, by field
+queryset - Querying the database for primary keys and counts
+"""
+
+from collections import defaultdict
+from os import getpid
+from socket import gethostname
+from threading import Lock
+from time import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+_collectors = {}
+
+
+def get_stats():
+    """Get the process-wide statistics collector, or None if disabled."""
+    path = getattr(settings, 'DRF_INSTANCE_CACHE_STATS', None)
+    if not path:
+        return None
+    if path not in _collectors:
+        _collectors[path] = import_string(path)()
+    return _collectors[path]
+
+
+class BaseStats(object):
+    """Interface for statistics collectors.
+
+    This collector ignores all statistics.
+    """
+
+    def incr(self, model_name, version, name, value=1):
+        """Increment a counter."""
+
+    def timing(self, model_name, version, name, seconds):
+        """Record a duration."""
+
+    def timed(self, model_name, version, name, func):
+        """Wrap a function so that calls are timed."""
+        def timed_func(*args, **kwargs):
+            start = time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.timing(model_name, version, name, time() - start)
+        return timed_func
+
+    def flush(self, cache):
+        """Give the collector a chance to publish statistics."""
+
+
+class MemoryStats(BaseStats):
+    """Aggregate statistics in memory, for the current process.
+
+    When flushed, the statistics are stored in the cache at most every
+    DRF_INSTANCE_CACHE_STATS_INTERVAL seconds (default 60), so that the
+    drf_cache_stats management command can combine statistics across
+    processes.
+    """
+
+    index_key = 'drfc_stats_index'
+
+    def __init__(self):
+        """Initialize MemoryStats."""
+        self.lock = Lock()
+        self.key = 'drfc_stats_%s_%s' % (gethostname(), getpid())
+        self.reset()
+
+    def reset(self):
+        """Clear the statistics."""
+        with self.lock:
+            self.counters = defaultdict(int)
+            self.timings = defaultdict(lambda: [0, 0.0, 0.0])
+            self.last_publish = time()
+
+    def incr(self, model_name, version, name, value=1):
+        """Increment a counter."""
+        with self.lock:
+            self.counters[(model_name, version, name)] += value
+
+    def timing(self, model_name, version, name, seconds):
+        """Record a duration as a count, total, and maximum."""
+        with self.lock:
+            timing = self.timings[(model_name, version, name)]
+            timing[0] += 1
+            timing[1] += seconds
+            if seconds > timing[2]:
+                timing[2] = seconds
+
+    def snapshot(self):
+        """Return the statistics as a list of JSON-serializable dicts."""
+        with self.lock:
+            stats = []
+            for (model_name, version, name), value in self.counters.items():
+                stats.append({
+                    'model': model_name, 'version': version, 'name': name,
+                    'value': value})
+            for (model_name, version, name), timing in self.timings.items():
+                count, total, maximum = timing
+                stats.append({
+                    'model': model_name, 'version': version, 'name': name,
+                    'count': count, 'total': total, 'max': maximum})
+        return stats
+
+    def flush(self, cache):
+        """Publish statistics to the cache, if the interval has passed."""
+        interval = getattr(settings, 'DRF_INSTANCE_CACHE_STATS_INTERVAL', 60)
+        if cache is not None and time() - self.last_publish >= interval:
+            self.publish(cache)
+
+    def publish(self, cache):
+        """Store the statistics in the cache."""
+        self.last_publish = time()
+        cache.set(self.key, self.snapshot(), None)
+        index = cache.get(self.index_key) or []
+        if self.key not in index:
+            cache.set(self.index_key, index + [self.key], None)
+
+
+class RequestTimings(BaseStats):
+    """Collect the timings for a single request.
+
+    The timings are summed by phase for a Server-Timing header.  All
+    statistics are also passed to the process-wide collector, if any.
+    """
+
+    # Server-Timing metric names, by the timing names they include
+    phases = (
+        (('queryset',), 'pks', 'Primary key queries'),
+        (('cache_get',), 'cache', 'Cache reads'),
+        (('loader',), 'load', 'Database loaders'),
+        (('serializer',), 'serialize', 'Cache serializers'),
+        (('decode', 'convert', 'upgrader'), 'decode', 'Cache decoding'),
+    )
+
+    def __init__(self, parent=None):
+        """Initialize RequestTimings."""
+        self.parent = parent
+        self.durations = defaultdict(float)
+
+    def incr(self, model_name, version, name, value=1):
+        """Pass a counter to the parent collector."""
+        if self.parent:
+            self.parent.incr(model_name, version, name, value)
+
+    def timing(self, model_name, version, name, seconds):
+        """Add a duration to the request timings."""
+        self.durations[name] += seconds
+        if self.parent:
+            self.parent.timing(model_name, version, name, seconds)
+
+    def flush(self, cache):
+        """Give the parent collector a chance to publish statistics."""
+        if self.parent:
+            self.parent.flush(cache)
+
+    def server_timing(self, total):
+        """Format the timings as a Server-Timing header value.
+
+        The time not spent in the cache phases is reported as 'drf', and
+        is mostly Django REST Framework serialization.
+        """
+        metrics = []
+        cache_total = 0.0
+        for names, metric, description in self.phases:
+            duration = sum(self.durations.get(name, 0.0) for name in names)
+            cache_total += duration
+            metrics.append((metric, duration, description))
+        metrics.append(
+            ('drf', max(total - cache_total, 0.0), 'Other view processing'))
+        metrics.append(('total', total, 'Total'))
+        return ', '.join(
+            '%s;dur=%0.3f;desc="%s"' % (metric, duration * 1000, description)
+            for metric, duration, description in metrics)
+
+
+def combine_stats(snapshots):
+    """Combine statistics snapshots from several processes.
+
+    Return is a list of statistics dicts, sorted by model, version, and name.
+    """
+    combined = {}
+    for snapshot in snapshots:
+        for stat in snapshot:
+            key = (stat['model'] or '', stat['version'], stat['name'])
+            if key not in combined:
+                combined[key] = dict(stat)
+            elif 'value' in stat:
+                combined[key]['value'] += stat['value']
+            else:
+                existing = combined[key]
+                existing['count'] += stat['count']
+                existing['total'] += stat['total']
+                existing['max'] = max(existing['max'], stat['max'])
+    return [combined[key] for key in sorted(combined)]
+
+
+def published_stats(cache):
+    """Get the statistics published by MemoryStats collectors."""
+    keys = cache.get(MemoryStats.index_key) or []
+    snapshots = cache.get_many(keys)
+    return combine_stats(snapshots[key] for key in keys if key in snapshots)
+
+
+def clear_published_stats(cache):
+    """Delete the statistics published by MemoryStats collectors."""
+    keys = cache.get(MemoryStats.index_key) or []
+    cache.delete_many(keys + [MemoryStats.index_key])
@@ -1,5 +1,7 @@
 """Cache implementation for sample app."""
 
+from collections import defaultdict
+
 from django.contrib.auth.models import User, Group
 
 from drf_cached_instances.cache import BaseCache
@@ -10,6 +12,16 @@ from .models import Question, Choice
 class SampleCache(BaseCache):
     """Cache for the sample poll cache."""
 
+    # Users change rarely, but Choice voter lists change constantly
+    user_default_timeout = 60 * 60 * 24
+    choice_default_timeout = 60 * 5
+
+    # Question lists are paged by primary key or newest first
+    question_default_pk_indexes = ('pk', '-pub_date')
+
+    # User list pages are counted from the cache
+    user_default_counters = {'all': {}}
+
     def user_default_serializer(self, obj):
         """Convert a User to a cached instance representation."""
         if not obj:
@@ -23,6 +35,17 @@ class SampleCache(BaseCache):
                 'PKList', 'votes', model=Choice, pks=obj._votes_pks),
         ))
 
+    def user_default_field_serializer(self, obj, field_names):
+        """Convert changed User fields, such as last_login, to a patch."""
+        patch = {}
+        if 'username' in field_names:
+            patch['username'] = obj.username
+        if 'date_joined' in field_names:
+            key, value = self.field_to_json(
+                'DateTime', 'date_joined', obj.date_joined)
+            patch[key] = value
+        return patch
+
     def user_default_loader(self, pk):
         """Load a User from the database."""
         try:
@@ -33,6 +56,19 @@ class SampleCache(BaseCache):
             self.user_default_add_related_pks(obj)
             return obj
 
+    def user_default_bulk_loader(self, pks):
+        """Load Users from the database, with two queries."""
+        users = list(User.objects.filter(pk__in=pks))
+        if not users:
+            return users
+        votes = defaultdict(list)
+        through = Choice.voters.through.objects.filter(user_id__in=pks)
+        for user_id, choice_id in through.values_list('user_id', 'choice_id'):
+            votes[user_id].append(choice_id)
+        for user in users:
+            user._votes_pks = votes[user.pk]
+        return users
+
     def user_default_add_related_pks(self, obj):
         """Add related primary keys to a User instance."""
         if not hasattr(obj, '_votes_pks'):
@@ -80,6 +116,20 @@ class SampleCache(BaseCache):
             self.question_default_add_related_pks(obj)
             return obj
 
+    def question_default_bulk_loader(self, pks):
+        """Load Questions from the database, with two queries."""
+        questions = list(Question.objects.filter(pk__in=pks))
+        if not questions:
+            return questions
+        choices = defaultdict(list)
+        choice_pks = Choice.objects.filter(
+            question_id__in=pks).values_list('question_id', 'pk')
+        for question_id, choice_id in choice_pks:
+            choices[question_id].append(choice_id)
+        for question in questions:
+            question._choice_pks = choices[question.pk]
+        return questions
+
     def question_default_add_related_pks(self, obj):
         """Add related primary keys to a Question instance."""
         if not hasattr(obj, '_choice_pks'):
@@ -113,6 +163,19 @@ class SampleCache(BaseCache):
             self.choice_default_add_related_pks(obj)
             return obj
 
+    def choice_default_bulk_loader(self, pks):
+        """Load Choices from the database, with two queries."""
+        choices = list(Choice.objects.filter(pk__in=pks))
+        if not choices:
+            return choices
+        voters = defaultdict(list)
+        through = Choice.voters.through.objects.filter(choice_id__in=pks)
+        for choice_id, user_id in through.values_list('choice_id', 'user_id'):
+            voters[choice_id].append(user_id)
+        for choice in choices:
+            choice._voter_pks = voters[choice.pk]
+        return choices
+
     def choice_default_add_related_pks(self, obj):
         """Add related primary keys to a Choice instance."""
         if not hasattr(obj, '_voter_pks'):
@@ -8,6 +8,8 @@ from django.db import models
 from django.db.models.signals import post_delete, post_save, m2m_changed
 from django.dispatch import receiver
 
+from drf_cached_instances.signals import pklist_on_commit, update_on_commit
+
 
 class Question(models.Model):
     """A poll question."""
@@ -31,46 +33,72 @@ cached_model_names = ('User', 'Question', 'Choice')
     m2m_changed, sender=Choice.voters.through,
     dispatch_uid='m2m_choice_voters_changed_update_cache')
 def choice_voters_changed_update_cache(
-        sender, instance, action, reverse, model, pk_set, **kwargs):
-    """Update cache when choice.voters changes."""
-    if action not in ('post_add', 'post_remove', 'post_clear'):
-        # post_clear is not handled, because clear is called in
-        # django.db.models.fields.related.ReverseManyRelatedObjects.__set__
-        # before setting the new order
+        sender, instance, action, reverse, model, pk_set, using, **kwargs):
+    """Update cache when choice.voters changes.
+
+    Adding and removing voters changes the cached primary key lists of the
+    Choices and Users directly, without loading them.  Clearing the voters
+    updates the instance and the related instances.
+    """
+    if action not in ('pre_clear', 'post_add', 'post_remove', 'post_clear'):
         return
 
     if model == User:
         assert type(instance) == Choice
-        choices = [instance]
-        if pk_set:
-            users = list(User.objects.filter(pk__in=pk_set))
-        else:
-            users = []
+        model_name, field_name = 'Choice', 'voters'
+        other_name, other_field_name = 'User', 'votes'
     else:
-        if pk_set:
-            choices = list(Choice.objects.filter(pk__in=pk_set))
-        else:
-            choices = []
-        users = [instance]
+        model_name, field_name = 'User', 'votes'
+        other_name, other_field_name = 'Choice', 'voters'
+
+    if action == 'pre_clear':
+        # post_clear does not say which instances changed, so remember them
+        instance._cleared_pks = list(
+            getattr(instance, field_name).values_list('pk', flat=True))
+        return
+
+    if action == 'post_clear':
+        # clear is also called by ReverseManyRelatedObjects.__set__ before
+        # setting the new list, so update the instance and the related
+        # instances
+        from .tasks import update_cache_for_instance
+        update_on_commit(
+            update_cache_for_instance, model_name, instance.pk, instance,
+            using=using)
+        for pk in vars(instance).pop('_cleared_pks', ()):
+            update_on_commit(
+                update_cache_for_instance, other_name, pk, using=using)
+        return
+    pks = sorted(pk_set or ())
+    if not pks:
+        return
+    added = action == 'post_add'
 
-    from .tasks import update_cache_for_instance
-    for choice in choices:
-        update_cache_for_instance('Choice', choice.pk, choice)
-    for user in users:
-        update_cache_for_instance('User', user.pk, user)
+    from .tasks import update_pklist_for_instance
+    pklist_on_commit(
+        update_pklist_for_instance, model_name, instance.pk, field_name,
+        add=pks if added else (), remove=() if added else pks, using=using)
+    for pk in pks:
+        pklist_on_commit(
+            update_pklist_for_instance, other_name, pk, other_field_name,
+            add=[instance.pk] if added else (),
+            remove=() if added else [instance.pk], using=using)
 
 
 @receiver(post_delete, dispatch_uid='post_delete_update_cache')
-def post_delete_update_cache(sender, instance, **kwargs):
+def post_delete_update_cache(sender, instance, using, **kwargs):
     """Update the cache when an instance is deleted."""
     name = sender.__name__
     if name in cached_model_names:
         from .tasks import update_cache_for_instance
-        update_cache_for_instance(name, instance.pk, instance)
+        update_on_commit(
+            update_cache_for_instance, name, instance.pk, instance,
+            using=using, deleted=True)
 
 
 @receiver(post_save, dispatch_uid='post_save_update_cache')
-def post_save_update_cache(sender, instance, created, raw, **kwargs):
+def post_save_update_cache(
+        sender, instance, created, raw, using, update_fields, **kwargs):
     """Update the cache when an instance is created or modified."""
     if raw:
         return
@@ -79,4 +107,6 @@ def post_save_update_cache(sender, instance, created, raw, **kwargs):
         delay_cache = getattr(instance, '_delay_cache', False)
         if not delay_cache:
             from .tasks import update_cache_for_instance
-            update_cache_for_instance(name, instance.pk, instance)
+            update_on_commit(
+                update_cache_for_instance, name, instance.pk, instance,
+                using=using, update_fields=update_fields, created=created)
@@ -6,10 +6,25 @@ from .cache import SampleCache
 
 @shared_task(ignore_result=True)
 def update_cache_for_instance(
-        model_name, instance_pk, instance=None, version=None):
+        model_name, instance_pk, instance=None, version=None,
+        update_fields=None, created=False, deleted=False):
     """Update the cache for an instance, with cascading updates."""
     cache = SampleCache()
-    invalid = cache.update_instance(model_name, instance_pk, instance, version)
+    invalid = cache.update_instance(
+        model_name, instance_pk, instance, version,
+        update_fields=update_fields, created=created, deleted=deleted)
+    for invalid_name, invalid_pk, invalid_version in invalid:
+        update_cache_for_instance.delay(
+            invalid_name, invalid_pk, version=invalid_version)
+
+
+@shared_task(ignore_result=True)
+def update_pklist_for_instance(
+        model_name, instance_pk, field_name, add=(), remove=(), version=None):
+    """Change a cached primary key list, with cascading updates."""
+    cache = SampleCache()
+    invalid = cache.update_pklist(
+        model_name, instance_pk, field_name, add, remove, version)
     for invalid_name, invalid_pk, invalid_version in invalid:
         update_cache_for_instance.delay(
             invalid_name, invalid_pk, version=invalid_version)
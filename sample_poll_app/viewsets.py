@@ -26,6 +26,7 @@ class QuestionViewSet(ModelViewSet):
 
     queryset = Question.objects.all()
     serializer_class = QuestionSerializer
+    expandable_fields = {'choices': ChoiceSerializer}
 
 
 class ChoiceViewSet(ModelViewSet):
@@ -33,3 +34,7 @@ class ChoiceViewSet(ModelViewSet):
 
     queryset = Choice.objects.all()
     serializer_class = ChoiceSerializer
+    expandable_fields = {
+        'question': QuestionSerializer,
+        'question.choices': ChoiceSerializer,
+    }
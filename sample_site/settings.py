@@ -83,6 +83,7 @@ INSTALLED_APPS = [
     'rest_framework',
 
     # Our applications
+    'drf_cached_instances',
     'sample_poll_app',
 ]
 if environ.get('EXTRA_INSTALLED_APPS'):
@@ -0,0 +1,40 @@
+"""Tests for benchmarks/bench_cache.py."""
+
+from django.test import TestCase
+
+from benchmarks.bench_cache import (
+    DictCache, format_results, run_benchmarks)
+
+
+class TestDictCache(TestCase):
+    """Tests for the in-process cache stand-in."""
+
+    def test_get_and_set(self):
+        """A value can be set and retrieved."""
+        cache = DictCache({})
+        cache.set_many({'a': 1, 'b': 2})
+        cache.set('c', 3)
+        self.assertFalse(cache.add('c', 4))
+        self.assertEqual({'a': 1, 'c': 3}, cache.get_many(['a', 'c', 'd']))
+        cache.delete('a')
+        self.assertIsNone(cache.get('a'))
+        cache.clear()
+        self.assertNotIn('b', cache)
+
+
+class TestRunBenchmarks(TestCase):
+    """Smoke tests for the benchmark suite."""
+
+    def test_run_benchmarks(self):
+        """The benchmarks run and the results can be compared."""
+        results = run_benchmarks(sizes=(1,), repeat=1, iterations=1)
+        names = set(result['name'] for result in results)
+        self.assertIn('get_instances.hit', names)
+        self.assertIn('get_instances.miss', names)
+        self.assertIn('update_instance.cascade', names)
+        self.assertIn('CachedQueryset.iter', names)
+        self.assertIn('field_from_json.PKList.100 pks', names)
+        self.assertIn('loads_field_from_json.CompactPKList.100 pks', names)
+        report = format_results(results, results)
+        self.assertEqual(len(results), len(report.splitlines()))
+        self.assertIn('1.00x', report)
@@ -1,16 +1,23 @@
 """Tests for drf_cached_instances/cache.py."""
 
 from datetime import datetime, date, timedelta
-from json import dumps
+from json import dumps, loads
+from time import sleep
+from unittest import skipIf
 import mock
 
 from django.contrib.auth.models import User, Group
-from django.test import TestCase
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
 from django.test.utils import override_settings
+from django.utils import six
 from pytz import UTC
 
-from drf_cached_instances.cache import BaseCache
+from drf_cached_instances.cache import BaseCache, MISSING, decode_pks
+from drf_cached_instances.compat import lzma
+from drf_cached_instances.hotkeys import HotKeyTracker
 from drf_cached_instances.models import PkOnlyModel, PkOnlyQueryset
+from drf_cached_instances.stats import MemoryStats
 
 from sample_poll_app.cache import SampleCache
 from sample_poll_app.models import Question, Choice
@@ -96,8 +103,9 @@ class TestCache(SharedCacheTests, TestCase):
         """Setup environment for an enabled cache."""
         self.cache = SampleCache()
         self.cache.cache.clear()
-        self.mock_delete = mock.Mock()
-        self.cache.cache.delete = self.mock_delete
+        patcher = mock.patch.object(self.cache.cache, 'delete')
+        self.mock_delete = patcher.start()
+        self.addCleanup(patcher.stop)
 
     def test_cache_is_available(self):
         """When USE_DRF_INSTANCE_CACHE is True, cache is available."""
@@ -204,12 +212,9 @@ class TestCache(SharedCacheTests, TestCase):
             ('User', user.pk, 'default'),
         ]
         self.assertEqual(expected_update, to_update)
-        self.mock_delete.assert_has_calls([
-            mock.call('drfc_user_count'),
-            mock.call('drfc_default_Question_%s' % question.pk),
-            mock.call('drfc_user_count'),
-            mock.call('drfc_default_Question_%s' % question.pk)])
-        self.assertEqual(4, self.mock_delete.call_count)
+        # Signal updates wait for the test transaction to commit
+        self.mock_delete.assert_called_once_with(
+            'drfc_default_Question_%s' % question.pk)
 
     def test_update_instance_cache_miss_update_only(self):
         """With update_only, cache misses don't update or cascade."""
@@ -224,17 +229,1076 @@ class TestCache(SharedCacheTests, TestCase):
         to_update = self.cache.update_instance(
             'Choice', choice.pk, update_only=True)
         self.assertEqual([], to_update)
-        self.mock_delete.assert_has_calls([
-            mock.call('drfc_user_count'),
-            mock.call('drfc_default_Question_%s' % question.pk),
-            mock.call('drfc_user_count')])
-        self.assertEqual(3, self.mock_delete.call_count)
+        # Signal updates wait for the test transaction to commit
+        self.assertFalse(self.mock_delete.called)
 
     def test_delete_all_versions_one_version(self):
         """Delete all cached instances for a model and ID."""
         self.cache.delete_all_versions("Model", 86)
         self.mock_delete.assert_called_once_with("drfc_default_Model_86")
 
+    def test_warm_instances(self):
+        """A list of instances can be cached at once."""
+        user_pks = [
+            User.objects.create(username='user%d' % x).pk for x in range(3)]
+        self.cache.cache.clear()
+        with self.assertNumQueries(2):
+            count = self.cache.warm_instances('User', user_pks + [666])
+        self.assertEqual(3, count)
+        with self.assertNumQueries(0):
+            instances = self.cache.get_instances(
+                [('User', pk, None) for pk in user_pks])
+        self.assertEqual(3, len(instances))
+
+    def test_warm_instances_without_bulk_loader(self):
+        """The loader is used for models without a bulk loader."""
+        group = Group.objects.create()
+        self.cache.group_default_serializer = lambda obj: {'id': obj.pk}
+        count = self.cache.warm_instances('Group', [group.pk])
+        self.assertEqual(1, count)
+
+    def test_warm_instances_no_serializer(self):
+        """A model without a serializer is not cached."""
+        group = Group.objects.create()
+        self.assertEqual(0, self.cache.warm_instances('Group', [group.pk]))
+
+    def test_get_instances_bulk_loader(self):
+        """Cache misses are loaded with the bulk loader."""
+        users = [
+            User.objects.create(username='user%d' % x) for x in range(3)]
+        self.cache.cache.clear()
+        specs = [('User', str(user.pk), None) for user in users]
+        with self.assertNumQueries(2):
+            instances = self.cache.get_instances(specs + [('User', 666, None)])
+        self.assertEqual(
+            sorted(str(user.pk) for user in users),
+            sorted(pk for model_name, pk in instances))
+
+    def test_get_instances_caches_missing(self):
+        """A missing instance is cached, so the database is skipped."""
+        self.assertFalse(User.objects.filter(pk=666).exists())
+        with self.assertNumQueries(1):
+            instances = self.cache.get_instances([('User', 666, None)])
+        self.assertEqual({}, instances)
+        key = self.cache.key_for('default', 'User', 666)
+        self.assertEqual(MISSING, self.cache.cache.get(key))
+        with self.assertNumQueries(0):
+            instances = self.cache.get_instances([('User', 666, None)])
+        self.assertEqual({}, instances)
+
+    def test_get_instances_missing_timeout(self):
+        """A missing instance is cached with the missing timeout."""
+        self.cache.user_default_missing_timeout = 5
+        with mock.patch.object(self.cache.cache, 'set_many') as mock_set_many:
+            self.cache.get_instances([('User', 666, None)])
+        mock_set_many.assert_called_once_with(
+            {'drfc_default_User_666': MISSING}, 5)
+
+    def test_get_instances_missing_disabled(self):
+        """Caching missing instances can be disabled."""
+        self.cache.user_default_missing_timeout = 0
+        self.cache.get_instances([('User', 666, None)])
+        key = self.cache.key_for('default', 'User', 666)
+        self.assertIsNone(self.cache.cache.get(key))
+
+    def test_get_instances_missing_with_obj(self):
+        """An instance cached as missing is replaced if the obj is passed."""
+        user = User.objects.create(username='new_user')
+        key = self.cache.key_for('default', 'User', user.pk)
+        self.cache.cache.set(key, MISSING)
+        instances = self.cache.get_instances([('User', user.pk, user)])
+        self.assertEqual(
+            'new_user', instances[('User', user.pk)][0]['username'])
+        self.assertNotEqual(MISSING, self.cache.cache.get(key))
+
+    def test_update_instance_replaces_missing(self):
+        """A new instance replaces the cached missing value."""
+        user = User.objects.create(username='new_user')
+        key = self.cache.key_for('default', 'User', user.pk)
+        self.cache.cache.set(key, MISSING)
+        self.cache.update_instance('User', user.pk, user, update_only=True)
+        with self.assertNumQueries(0):
+            instances = self.cache.get_instances([('User', user.pk, None)])
+        self.assertEqual(
+            'new_user', instances[('User', user.pk)][0]['username'])
+
+    def test_model_option_default(self):
+        """A model without a specific option uses the default."""
+        self.assertEqual(
+            self.cache.default_timeout,
+            self.cache.model_option('Question', 'default', 'timeout'))
+
+    def test_model_option_override(self):
+        """A model and version can override the default option."""
+        self.assertEqual(
+            86400, self.cache.model_option('User', 'default', 'timeout'))
+
+    def test_get_instances_uses_model_timeout(self):
+        """New cache entries are set with the model's timeout."""
+        user = User.objects.create(username='the_user')
+        question = Question.objects.create(
+            question_text='What is your favorite color?',
+            pub_date=datetime(2014, 11, 6, 8, 45, 49, 538232, UTC))
+        self.cache.cache.clear()
+        with mock.patch.object(self.cache.cache, 'set_many') as mock_set_many:
+            self.cache.get_instances(
+                [('User', user.pk, None), ('Question', question.pk, None)])
+        mock_set_many.assert_has_calls([
+            mock.call({'drfc_default_User_%s' % user.pk: mock.ANY}, 86400),
+            mock.call(
+                {'drfc_default_Question_%s' % question.pk: mock.ANY},
+                self.cache.default_timeout),
+        ], any_order=True)
+        self.assertEqual(2, mock_set_many.call_count)
+
+    def test_update_instance_uses_model_timeout(self):
+        """Updated cache entries are set with the model's timeout."""
+        user = User.objects.create(username='the_user')
+        self.cache.cache.clear()
+        with mock.patch.object(self.cache.cache, 'set_many') as mock_set_many:
+            self.cache.update_instance('User', user.pk, user)
+        mock_set_many.assert_called_once_with(
+            {'drfc_default_User_%s' % user.pk: mock.ANY}, 86400)
+
+    def test_get_instances_lazy(self):
+        """With lazy=True, typed fields are not converted."""
+        user = User.objects.create(
+            username='the_user',
+            date_joined=datetime(2014, 11, 6, 8, 45, 49, 538232, UTC))
+        self.cache.cache.clear()
+        instances = self.cache.get_instances(
+            [('User', user.pk, None)], lazy=True)
+        native = instances[('User', user.pk)][0]
+        self.assertEqual('1415263549.538232', native['date_joined:DateTime'])
+        self.assertIn('votes:PKList', native)
+
+
+@override_settings(
+    USE_DRF_INSTANCE_CACHE=True,
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'drfc-test-default'},
+        'users': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'drfc-test-users'},
+    })
+class TestCacheAliases(TestCase):
+    """Test storing models in different cache backends."""
+
+    def setUp(self):
+        """Store Users in the 'users' cache."""
+        from django.core.cache import caches
+        self.cache = SampleCache()
+        self.cache.user_default_cache_alias = 'users'
+        self.default = caches['default']
+        self.users = caches['users']
+        self.default.clear()
+        self.users.clear()
+        self.user = User.objects.create(username='the_user')
+        self.question = Question.objects.create(
+            question_text='What is your favorite color?',
+            pub_date=datetime(2014, 11, 6, 8, 45, 49, 538232, UTC))
+        self.user_key = self.cache.key_for('default', 'User', self.user.pk)
+        self.question_key = self.cache.key_for(
+            'default', 'Question', self.question.pk)
+        self.default.clear()
+        self.users.clear()
+
+    def test_cache_for(self):
+        """The cache alias is a model option."""
+        self.assertEqual(self.cache.cache, self.cache.cache_for(
+            'Question', 'default'))
+        self.assertEqual(self.users, self.cache.cache_for('User', 'default'))
+
+    @override_settings(USE_DRF_INSTANCE_CACHE=False)
+    def test_cache_for_disabled(self):
+        """No backend is used when the cache is disabled."""
+        self.assertIsNone(self.cache.cache_for('User', 'default'))
+
+    def test_get_instances(self):
+        """Store and read instances from their model's backend."""
+        specs = [('User', self.user.pk, None),
+                 ('Question', self.question.pk, None)]
+        self.cache.get_instances(specs)
+        self.assertIsNotNone(self.users.get(self.user_key))
+        self.assertIsNone(self.default.get(self.user_key))
+        self.assertIsNotNone(self.default.get(self.question_key))
+        self.assertIsNone(self.users.get(self.question_key))
+        with mock.patch.object(
+                self.users, 'get_many',
+                wraps=self.users.get_many) as users_get_many:
+            with self.assertNumQueries(0):
+                instances = self.cache.get_instances(specs)
+        users_get_many.assert_called_once_with([self.user_key])
+        self.assertEqual(2, len(instances))
+
+    def test_update_instance(self):
+        """Update and invalidate instances in the model's backend."""
+        self.cache.update_instance('User', self.user.pk, self.user)
+        self.assertIsNotNone(self.users.get(self.user_key))
+        self.assertIsNone(self.default.get(self.user_key))
+        self.cache.user_default_invalidator = lambda obj: [
+            ('User', obj.pk, True)]
+        self.user.username = 'new_name'
+        self.cache.update_instance('User', self.user.pk, self.user)
+        self.assertIsNone(self.users.get(self.user_key))
+
+    def test_warm_instances(self):
+        """Warmed instances are stored in the model's backend."""
+        self.assertEqual(
+            1, self.cache.warm_instances('User', [self.user.pk]))
+        self.assertIsNotNone(self.users.get(self.user_key))
+        self.assertIsNone(self.default.get(self.user_key))
+
+    def test_delete_all_versions(self):
+        """All versions are deleted from the model's backend."""
+        self.cache.get_instances([('User', self.user.pk, None)])
+        self.cache.delete_all_versions('User', self.user.pk)
+        self.assertIsNone(self.users.get(self.user_key))
+
+
+class TestBulkUpdates(TestCase):
+    """Test updating cached instances in bulk."""
+
+    def setUp(self):
+        """Create some Choices for a Question."""
+        self.cache = SampleCache()
+        self.question = Question.objects.create(
+            question_text='What is your favorite color?',
+            pub_date=datetime(2014, 11, 6, 8, 45, 49, 538232, UTC))
+        Choice.objects.bulk_create([
+            Choice(question=self.question, choice_text=text)
+            for text in ('Red', 'Green', 'Blue')])
+        self.choices = Choice.objects.filter(question=self.question)
+        self.choice_pks = list(
+            self.choices.order_by('pk').values_list('pk', flat=True))
+        self.question_key = self.cache.key_for(
+            'default', 'Question', self.question.pk)
+        self.cache.cache.clear()
+
+    def choice_keys(self):
+        """Get the cache keys for the Choices."""
+        return [self.cache.key_for('default', 'Choice', pk)
+                for pk in self.choice_pks]
+
+    def test_refresh_queryset(self):
+        """Cache a queryset, with cascades merged across batches."""
+        self.cache.cache.set(self.question_key, MISSING)
+        invalid = self.cache.refresh_queryset(self.choices, batch_size=2)
+        self.assertEqual([('Question', self.question.pk, 'default')], invalid)
+        self.assertEqual(3, len(self.cache.cache.get_many(self.choice_keys())))
+        self.assertIsNone(self.cache.cache.get(self.question_key))
+        with self.assertNumQueries(0):
+            instances = self.cache.get_instances(
+                [('Choice', pk, None) for pk in self.choice_pks])
+        self.assertEqual(
+            ['Red', 'Green', 'Blue'],
+            [instances[('Choice', pk)][0]['choice_text']
+             for pk in self.choice_pks])
+
+    def test_refresh_unchanged(self):
+        """Unchanged cached instances do not cascade."""
+        self.cache.refresh_queryset(self.choices)
+        with mock.patch.object(self.cache.cache, 'set_many') as mock_set_many:
+            self.assertEqual([], self.cache.refresh_queryset(self.choices))
+        self.assertFalse(mock_set_many.called)
+
+    def test_invalidate_queryset(self):
+        """Update cached instances after QuerySet.update()."""
+        self.cache.get_instances([('Choice', self.choice_pks[0], None)])
+        self.choices.update(choice_text='Purple')
+        with self.assertNumQueries(4):
+            invalid = self.cache.invalidate_queryset(self.choices)
+        self.assertEqual([('Question', self.question.pk, 'default')], invalid)
+        cached = self.cache.cache.get_many(self.choice_keys())
+        self.assertEqual([self.choice_keys()[0]], list(cached.keys()))
+        instances = self.cache.get_instances(
+            [('Choice', self.choice_pks[0], None)])
+        self.assertEqual(
+            'Purple',
+            instances[('Choice', self.choice_pks[0])][0]['choice_text'])
+
+    def test_update_instances_deleted(self):
+        """Delete the cached instances that no longer exist."""
+        self.cache.refresh_queryset(self.choices)
+        Choice.objects.filter(pk=self.choice_pks[0]).delete()
+        self.cache.update_instances('Choice', self.choice_pks)
+        cached = self.cache.cache.get_many(self.choice_keys())
+        self.assertEqual(sorted(self.choice_keys()[1:]), sorted(cached))
+
+    def test_update_instances_invalidator_only(self):
+        """Cascade updates for models without a serializer."""
+        group = Group.objects.create()
+        user = User.objects.create(username='user')
+        self.assertEqual(
+            [('User', user.pk, 'default')],
+            self.cache.update_instances('Group', [group.pk]))
+
+
+class TestUpdateFields(TestCase):
+    """Test patching cached instances with update_fields."""
+
+    def setUp(self):
+        """Cache a User."""
+        self.cache = SampleCache()
+        self.user = User.objects.create(username='the_user')
+        self.key = self.cache.key_for('default', 'User', self.user.pk)
+        self.cache.cache.clear()
+        self.cache.get_instances([('User', self.user.pk, None)])
+
+    def test_uncached_field(self):
+        """Skip the update when no cached fields changed."""
+        with mock.patch.object(
+                self.cache.cache, 'get_many') as mock_get_many:
+            with self.assertNumQueries(0):
+                invalid = self.cache.update_instance(
+                    'User', self.user.pk, self.user,
+                    update_fields=['last_login'])
+        self.assertEqual([], invalid)
+        self.assertFalse(mock_get_many.called)
+
+    def test_patch(self):
+        """Patch the changed cached fields, without related pk queries."""
+        self.user.username = 'new_name'
+        with self.assertNumQueries(0):
+            invalid = self.cache.update_instance(
+                'User', self.user.pk, self.user,
+                update_fields=['username', 'last_login'])
+        self.assertEqual([], invalid)
+        native = self.cache.decode_entry(self.cache.cache.get(self.key))
+        self.assertEqual('new_name', native['username'])
+        self.assertIn('votes:PKList', native)
+
+    def test_patch_typed_field(self):
+        """Patch a field with a field type."""
+        self.user.date_joined = datetime(2014, 9, 22, 8, 52, 0, 0, UTC)
+        self.cache.update_instance(
+            'User', self.user.pk, self.user, update_fields=['date_joined'])
+        native = self.cache.decode_entry(self.cache.cache.get(self.key))
+        self.assertEqual(1411375920, native['date_joined:DateTime'])
+
+    def test_patch_uncached_instance(self):
+        """Do not cache an instance that was not cached."""
+        self.cache.cache.clear()
+        self.user.username = 'new_name'
+        self.cache.update_instance(
+            'User', self.user.pk, self.user, update_fields=['username'])
+        self.assertIsNone(self.cache.cache.get(self.key))
+
+    def test_patch_unchanged(self):
+        """Do not write an unchanged entry."""
+        with mock.patch.object(self.cache.cache, 'set_many') as mock_set_many:
+            self.assertFalse(self.cache.patch_instance(
+                'User', 'default', self.user.pk, {'username': 'the_user'}))
+        self.assertFalse(mock_set_many.called)
+
+    def test_no_field_serializer(self):
+        """Update the whole instance for models without a field serializer."""
+        question = Question.objects.create(
+            question_text='What is your favorite color?',
+            pub_date=datetime(2014, 11, 6, 8, 45, 49, 538232, UTC))
+        with mock.patch.object(
+                self.cache, 'question_default_serializer',
+                wraps=self.cache.question_default_serializer) as serializer:
+            self.cache.update_instance(
+                'Question', question.pk, question,
+                update_fields=['question_text'])
+        serializer.assert_called_once_with(question)
+
+
+class TestHotKeys(TestCase):
+    """Test replicating hot cache entries."""
+
+    def setUp(self):
+        """Detect a key as hot on the second read."""
+        self.cache = SampleCache()
+        self.cache.hot_key_threshold = 2
+        self.cache.hot_key_sample_rate = 1.0
+        self.cache.hot_key_replicas = 3
+        self.cache.hot_key_tracker = HotKeyTracker()
+        self.user = User.objects.create(username='the_user')
+        self.cache.cache.clear()
+        self.key = self.cache.key_for('default', 'User', self.user.pk)
+        self.replica_keys = [
+            self.cache.replica_key(self.key, number) for number in range(3)]
+        self.specs = [('User', self.user.pk, None)]
+
+    def test_replicate(self):
+        """A hot entry is replicated, and read from a replica."""
+        self.cache.get_instances(self.specs)
+        self.assertEqual({}, self.cache.cache.get_many(self.replica_keys))
+        self.cache.get_instances(self.specs)
+        replicas = self.cache.cache.get_many(self.replica_keys)
+        self.assertEqual(3, len(replicas))
+        self.assertEqual('3', self.cache.cache.get(
+            self.cache.hot_flag_key(self.key)))
+        self.cache.cache.delete(self.key)
+        with self.assertNumQueries(0):
+            instances = self.cache.get_instances(self.specs)
+        self.assertEqual(
+            'the_user', instances[('User', self.user.pk)][0]['username'])
+        stats = self.cache.hot_key_stats()
+        self.assertEqual([self.key], stats['hot'])
+        self.assertEqual(2, stats['replica_reads'])
+        self.assertEqual(1, stats['replica_misses'])
+
+    def test_update_instance(self):
+        """Updating a hot entry updates the replicas."""
+        self.cache.get_instances(self.specs)
+        self.cache.get_instances(self.specs)
+        self.user.username = 'new_name'
+        self.cache.update_instance('User', self.user.pk, self.user)
+        for raw in self.cache.cache.get_many(self.replica_keys).values():
+            self.assertEqual(
+                'new_name', self.cache.decode_entry(raw)['username'])
+
+    def test_delete(self):
+        """Deleting a hot entry deletes the replicas."""
+        self.cache.get_instances(self.specs)
+        self.cache.get_instances(self.specs)
+        self.cache.delete_all_versions('User', self.user.pk)
+        self.assertEqual({}, self.cache.cache.get_many(
+            [self.key, self.cache.hot_flag_key(self.key)] +
+            self.replica_keys))
+
+    def test_disabled(self):
+        """Hot key detection is disabled by default."""
+        cache = SampleCache()
+        self.assertIsNone(cache.hot_key_threshold)
+        for x in range(3):
+            cache.get_instances(self.specs)
+        self.assertEqual({}, cache.cache.get_many(self.replica_keys))
+
+
+class TestFingerprints(TestCase):
+    """Test comparing cache entries by fingerprint."""
+
+    def setUp(self):
+        """Cache a user, with a fingerprint."""
+        self.cache = SampleCache()
+        self.cache.fingerprints = True
+        self.user = User.objects.create(username='the_user')
+        self.cache.cache.clear()
+        self.key = self.cache.key_for('default', 'User', self.user.pk)
+        self.fp_key = self.cache.fingerprint_key(self.key)
+        self.cache.get_instances([('User', self.user.pk, None)])
+
+    def test_fingerprint_stored(self):
+        """The fingerprint is stored next to the entry."""
+        raw = self.cache.cache.get(self.key)
+        self.assertEqual(
+            self.cache.fingerprint(raw), self.cache.cache.get(self.fp_key))
+        self.assertEqual(
+            {self.user.pk: self.cache.fingerprint(raw)},
+            self.cache.get_fingerprints('User', [self.user.pk, 666]))
+
+    def test_unchanged_skips_entry(self):
+        """An unchanged instance is compared without reading the entry."""
+        with mock.patch.object(
+                self.cache.cache, 'get_many',
+                wraps=self.cache.cache.get_many) as mock_get_many:
+            with mock.patch.object(self.cache.cache, 'set_many') as mock_set:
+                self.cache.update_instance('User', self.user.pk, self.user)
+        for call in mock_get_many.call_args_list:
+            self.assertNotIn(self.key, call[0][0])
+        self.assertFalse(mock_set.called)
+
+    def test_changed(self):
+        """A changed instance updates the entry and fingerprint."""
+        old_fp = self.cache.cache.get(self.fp_key)
+        self.user.username = 'new_name'
+        self.cache.update_instance('User', self.user.pk, self.user)
+        raw = self.cache.cache.get(self.key)
+        self.assertEqual('new_name', self.cache.decode_entry(raw)['username'])
+        self.assertNotEqual(old_fp, self.cache.cache.get(self.fp_key))
+        self.assertEqual(
+            self.cache.fingerprint(raw), self.cache.cache.get(self.fp_key))
+
+    def test_missing_fingerprint(self):
+        """An entry without a fingerprint is compared by decoding it."""
+        self.cache.cache.delete(self.fp_key)
+        self.user.username = 'new_name'
+        self.cache.update_instance('User', self.user.pk, self.user)
+        raw = self.cache.cache.get(self.key)
+        self.assertEqual('new_name', self.cache.decode_entry(raw)['username'])
+        self.assertEqual(
+            self.cache.fingerprint(raw), self.cache.cache.get(self.fp_key))
+
+    def test_update_instances(self):
+        """Bulk updates compare and write fingerprints."""
+        User.objects.filter(pk=self.user.pk).update(username='new_name')
+        self.cache.update_instances('User', [self.user.pk])
+        raw = self.cache.cache.get(self.key)
+        self.assertEqual('new_name', self.cache.decode_entry(raw)['username'])
+        self.assertEqual(
+            self.cache.fingerprint(raw), self.cache.cache.get(self.fp_key))
+
+    def test_delete(self):
+        """Deleting an entry deletes the fingerprint."""
+        self.cache.delete_all_versions('User', self.user.pk)
+        self.assertIsNone(self.cache.cache.get(self.fp_key))
+
+    def test_stable(self):
+        """The same representation has the same fingerprint."""
+        native = {'b': 1, 'a': [1, 2], 'c': 'text'}
+        reordered = {'c': 'text', 'a': [1, 2], 'b': 1}
+        self.assertEqual(
+            self.cache.fingerprint(
+                self.cache.encode_entry('User', 'default', native)),
+            self.cache.fingerprint(
+                self.cache.encode_entry('User', 'default', reordered)))
+
+    def test_disabled(self):
+        """Test that fingerprints are disabled by default."""
+        cache = SampleCache()
+        self.assertFalse(cache.fingerprints)
+        self.assertEqual({}, cache.get_fingerprints('User', [self.user.pk]))
+
+
+class TestUpdatePKList(TestCase):
+    """Test changing cached primary key lists."""
+
+    def setUp(self):
+        """Cache a choice with a voter."""
+        self.cache = SampleCache()
+        self.question = Question.objects.create(
+            question_text='What is your favorite color?',
+            pub_date=datetime(2014, 11, 6, 8, 45, 49, 538232, UTC))
+        self.choice = Choice.objects.create(
+            question=self.question, choice_text='Blue')
+        self.users = [
+            User.objects.create(username='user%d' % x) for x in range(3)]
+        self.choice.voters.add(self.users[0])
+        self.cache.cache.clear()
+        self.key = self.cache.key_for('default', 'Choice', self.choice.pk)
+        self.specs = [('Choice', self.choice.pk, None)]
+        self.cache.get_instances(self.specs)
+
+    def get_voters(self):
+        """Get the cached voter primary keys."""
+        raw = self.cache.cache.get(self.key)
+        return self.cache.decode_entry(raw)['voters:PKList']['pks']
+
+    def test_add_and_remove(self):
+        """Primary keys are added and removed without loading the choice."""
+        with self.assertNumQueries(0):
+            invalid = self.cache.update_pklist(
+                'Choice', self.choice.pk, 'voters',
+                add=[self.users[1].pk, self.users[2].pk, self.users[0].pk],
+                remove=[self.users[0].pk])
+        self.assertEqual([], invalid)
+        self.assertEqual(
+            [self.users[1].pk, self.users[2].pk, self.users[0].pk],
+            self.get_voters())
+
+    def test_compact(self):
+        """Change a CompactPKList field."""
+        native = {
+            'id': self.choice.pk,
+            'voters:CompactPKList': self.cache.field_compactpklist_to_json(
+                User, [self.users[0].pk])}
+        self.cache.cache.set(
+            self.key, self.cache.encode_entry('Choice', 'default', native))
+        self.cache.update_pklist(
+            'Choice', self.choice.pk, 'voters', add=[self.users[1].pk])
+        native = self.cache.decode_entry(self.cache.cache.get(self.key))
+        label, encoded = native['voters:CompactPKList']
+        self.assertEqual('auth.user', label)
+        self.assertEqual(
+            [self.users[0].pk, self.users[1].pk], list(decode_pks(encoded)))
+
+    def test_not_cached(self):
+        """Skip entries that are not cached."""
+        self.cache.cache.delete(self.key)
+        with self.assertNumQueries(0):
+            self.cache.update_pklist(
+                'Choice', self.choice.pk, 'voters', add=[self.users[1].pk])
+        self.assertIsNone(self.cache.cache.get(self.key))
+
+    def test_conflict_rebuilds(self):
+        """The entry is rebuilt after repeated conflicts."""
+        self.cache.cache.set(self.key + '_lock', 'other', 60)
+        self.choice.voters.add(self.users[1])
+        with mock.patch.object(
+                self.cache, 'update_instance',
+                wraps=self.cache.update_instance) as mock_update:
+            self.cache.update_pklist(
+                'Choice', self.choice.pk, 'voters', add=[self.users[1].pk])
+        mock_update.assert_called_once_with(
+            'Choice', self.choice.pk, version='default')
+        self.assertEqual(
+            [self.users[0].pk, self.users[1].pk], sorted(self.get_voters()))
+
+    def test_changed_entry_conflicts(self):
+        """A changed entry is a conflict, and the change is retried."""
+        original = self.cache.get_entries
+        calls = []
+
+        def get_entries(keys, cache=None, chunks=None):
+            calls.append(keys)
+            if len(calls) == 2:
+                # Another process changes the entry
+                native = self.cache.decode_entry(self.cache.cache.get(
+                    self.key))
+                native['voters:PKList']['pks'].append(self.users[2].pk)
+                self.cache.cache.set(self.key, self.cache.encode_entry(
+                    'Choice', 'default', native))
+            return original(keys, cache, chunks)
+
+        with mock.patch.object(self.cache, 'get_entries', get_entries):
+            self.cache.update_pklist(
+                'Choice', self.choice.pk, 'voters', add=[self.users[1].pk])
+        self.assertEqual(4, len(calls))
+        self.assertEqual(
+            [self.users[0].pk, self.users[2].pk, self.users[1].pk],
+            self.get_voters())
+
+    def test_unknown_field_rebuilds(self):
+        """Rebuild the entry if it does not have the field."""
+        with mock.patch.object(
+                self.cache, 'update_instance',
+                return_value=[]) as mock_update:
+            self.cache.update_pklist(
+                'Choice', self.choice.pk, 'choices', add=[1])
+        mock_update.assert_called_once_with(
+            'Choice', self.choice.pk, version='default')
+
+
+class TestPKIndexes(TestCase):
+    """Test cached primary key indexes."""
+
+    def setUp(self):
+        """Create Questions, and cache the indexes."""
+        self.cache = SampleCache()
+        self.questions = [
+            Question.objects.create(
+                question_text='Question %d' % x,
+                pub_date=datetime(2014, 11, 10 + x, tzinfo=UTC))
+            for x in range(3)]
+        self.cache.cache.clear()
+        self.pks = [q.pk for q in self.questions]
+        self.cache.get_pk_index(Question, 'pk')
+        self.cache.get_pk_index(Question, '-pub_date')
+
+    def get_indexes(self):
+        """Get the cached indexes, without querying the database."""
+        with self.assertNumQueries(0):
+            return (
+                self.cache.get_pk_index(Question, 'pk'),
+                self.cache.get_pk_index(Question, '-pub_date'))
+
+    def test_cached(self):
+        """The indexes are loaded from the database once."""
+        by_pk, newest = self.get_indexes()
+        self.assertEqual(self.pks, by_pk)
+        self.assertEqual(self.pks[::-1], newest)
+
+    def test_not_indexed(self):
+        """Return None for orderings without an index."""
+        self.assertIsNone(self.cache.get_pk_index(Question, 'question_text'))
+        self.assertIsNone(self.cache.get_pk_index(Choice, 'pk'))
+
+    def test_created(self):
+        """A created instance is added to the indexes."""
+        question = Question.objects.create(
+            question_text='Question 3',
+            pub_date=datetime(2014, 11, 11, 12, tzinfo=UTC))
+        self.cache.update_instance(
+            'Question', question.pk, question, created=True)
+        by_pk, newest = self.get_indexes()
+        self.assertEqual(self.pks + [question.pk], by_pk)
+        self.assertEqual(
+            [self.pks[2], question.pk, self.pks[1], self.pks[0]], newest)
+
+    def test_deleted(self):
+        """A deleted instance is removed from the indexes."""
+        question = self.questions[1]
+        question.delete()
+        question.pk = self.pks[1]
+        self.cache.update_instance(
+            'Question', question.pk, question, deleted=True)
+        by_pk, newest = self.get_indexes()
+        self.assertEqual([self.pks[0], self.pks[2]], by_pk)
+        self.assertEqual([self.pks[2], self.pks[0]], newest)
+
+    def test_moved(self):
+        """An instance is moved when its ordering field changes."""
+        question = self.questions[0]
+        question.pub_date = datetime(2014, 12, 1, tzinfo=UTC)
+        question.save(update_fields=['pub_date'])
+        self.cache.update_instance(
+            'Question', question.pk, question, update_fields=['pub_date'])
+        by_pk, newest = self.get_indexes()
+        self.assertEqual(self.pks, by_pk)
+        self.assertEqual([self.pks[0], self.pks[2], self.pks[1]], newest)
+
+    def test_invalidate_queryset(self):
+        """Bulk updates move the instances in the indexes."""
+        Question.objects.filter(pk=self.pks[0]).update(
+            pub_date=datetime(2014, 12, 1, tzinfo=UTC))
+        self.cache.invalidate_queryset(Question.objects.all())
+        by_pk, newest = self.get_indexes()
+        self.assertEqual(self.pks, by_pk)
+        self.assertEqual(
+            list(Question.objects.order_by('-pub_date').values_list(
+                'pk', flat=True)), newest)
+
+    def test_refresh_queryset(self):
+        """Bulk created and deleted instances are added and removed."""
+        Question.objects.bulk_create([
+            Question(
+                question_text='Question %d' % x,
+                pub_date=datetime(2014, 11, x, tzinfo=UTC))
+            for x in (1, 20)])
+        Question.objects.filter(pk=self.pks[1]).delete()
+        self.cache.refresh_queryset(Question.objects.all())
+        self.cache.update_instances('Question', [self.pks[1]])
+        by_pk, newest = self.get_indexes()
+        self.assertEqual(
+            list(Question.objects.order_by('pk').values_list(
+                'pk', flat=True)), by_pk)
+        self.assertEqual(
+            list(Question.objects.order_by('-pub_date').values_list(
+                'pk', flat=True)), newest)
+
+    def test_conflict_deletes(self):
+        """An index is deleted after repeated conflicts."""
+        key = self.cache.pk_index_key('default', 'Question', '-pub_date')
+        self.cache.cache.set(key + '_lock', 'other', 60)
+        question = Question.objects.create(
+            question_text='Question 3',
+            pub_date=datetime(2014, 11, 20, tzinfo=UTC))
+        self.cache.update_instance(
+            'Question', question.pk, question, created=True)
+        self.assertIsNone(self.cache.cache.get(key))
+        self.cache.cache.delete(key + '_lock')
+        self.assertEqual(
+            [question.pk] + self.pks[::-1],
+            self.cache.get_pk_index(Question, '-pub_date'))
+
+
+class CounterCache(SampleCache):
+    """A cache that also counts active Users."""
+
+    user_default_counters = {'all': {}, 'active': {'is_active': True}}
+
+    def user_default_serializer(self, obj):
+        """Also cache is_active, so that changes to it can be detected."""
+        data = super(CounterCache, self).user_default_serializer(obj)
+        if data:
+            data['is_active'] = obj.is_active
+        return data
+
+
+class TestCounters(TransactionTestCase):
+    """Test cached counters.
+
+    Counters are not cached inside a transaction, so these tests run
+    outside of one.
+    """
+
+    def setUp(self):
+        """Create Users, and cache the counters."""
+        patcher = mock.patch('sample_poll_app.tasks.update_cache_for_instance')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = CounterCache()
+        self.users = [
+            User.objects.create(username='user%d' % x, is_active=bool(x))
+            for x in range(3)]
+        self.cache.cache.clear()
+        self.cache.get_count(User)
+        self.cache.get_count(User, {'is_active': True})
+
+    def get_counts(self):
+        """Get the cached counts, without querying the database."""
+        with self.assertNumQueries(0):
+            return (
+                self.cache.get_count(User),
+                self.cache.get_count(User, {'is_active': True}))
+
+    def test_cached(self):
+        """The counts are loaded from the database once."""
+        self.assertEqual((3, 2), self.get_counts())
+
+    def test_timeout(self):
+        """Cache the counts with the counter timeout."""
+        self.cache.cache.clear()
+        with mock.patch.object(self.cache.cache, 'add') as mock_add:
+            self.cache.get_count(User)
+        key = self.cache.counter_key('default', 'User', 'all')
+        mock_add.assert_called_once_with(key, 3, 300)
+
+    def test_atomic(self):
+        """Do not cache counts loaded inside a transaction."""
+        self.cache.cache.clear()
+        with transaction.atomic():
+            User.objects.create(username='uncommitted')
+            self.assertEqual(4, self.cache.get_count(User))
+        key = self.cache.counter_key('default', 'User', 'all')
+        self.assertIsNone(self.cache.cache.get(key))
+
+    def test_no_counter(self):
+        """Return None for filters without a counter."""
+        self.assertIsNone(self.cache.get_count(User, {'username': 'user0'}))
+        self.assertIsNone(self.cache.get_count(Question))
+
+    def test_created(self):
+        """A created instance increments the counters it matches."""
+        active = User.objects.create(username='active')
+        inactive = User.objects.create(username='inactive', is_active=False)
+        self.cache.update_instance('User', active.pk, active, created=True)
+        self.cache.update_instance(
+            'User', inactive.pk, inactive, created=True)
+        self.assertEqual((5, 3), self.get_counts())
+
+    def test_deleted(self):
+        """A deleted instance decrements the counters it matches."""
+        user = self.users[1]
+        pk = user.pk
+        user.delete()
+        user.pk = pk
+        self.cache.update_instance('User', user.pk, user, deleted=True)
+        self.assertEqual((2, 1), self.get_counts())
+
+    def test_not_cached(self):
+        """Skip counters that are not cached."""
+        self.cache.cache.clear()
+        user = User.objects.create(username='active')
+        self.cache.update_instance('User', user.pk, user, created=True)
+        key = self.cache.counter_key('default', 'User', 'all')
+        self.assertIsNone(self.cache.cache.get(key))
+        self.assertEqual(4, self.cache.get_count(User))
+
+    def test_updated(self):
+        """Delete counters when a filter field may have changed."""
+        user = self.users[0]
+        user.is_active = True
+        user.save(update_fields=['is_active'])
+        self.cache.update_instance(
+            'User', user.pk, user, update_fields=['username'])
+        self.assertEqual((3, 2), self.get_counts())
+        self.cache.update_instance(
+            'User', user.pk, user, update_fields=['is_active'])
+        self.assertIsNone(self.cache.cache.get(
+            self.cache.counter_key('default', 'User', 'active')))
+        self.assertEqual(3, self.cache.get_count(User, {'is_active': True}))
+
+    def test_updated_unchanged(self):
+        """Keep counters if the filter fields did not change in the entry."""
+        user = self.users[0]
+        self.cache.get_instances([('User', user.pk, None)])
+        user.username = 'renamed'
+        user.save()
+        self.cache.update_instance('User', user.pk, user)
+        self.assertEqual((3, 2), self.get_counts())
+        user.is_active = True
+        user.save()
+        self.cache.update_instance('User', user.pk, user)
+        self.assertIsNone(self.cache.cache.get(
+            self.cache.counter_key('default', 'User', 'active')))
+
+    def test_cascade(self):
+        """Cascaded updates, without an instance, keep the counters."""
+        user = self.users[0]
+        user.is_active = True
+        user.save()
+        self.cache.update_instance('User', user.pk)
+        self.cache.update_instances(
+            'User', [user.pk], created=[], cascade=True)
+        self.assertEqual((3, 2), self.get_counts())
+
+    def test_update_instances_unchanged(self):
+        """Keep counters in bulk updates if filter fields did not change."""
+        self.cache.get_instances(
+            [('User', user.pk, None) for user in self.users])
+        for user in self.users:
+            user.username += '_renamed'
+            user.save()
+        pks = [user.pk for user in self.users]
+        self.cache.update_instances('User', pks, created=[])
+        self.assertEqual((3, 2), self.get_counts())
+        User.objects.filter(pk=pks[0]).update(is_active=True)
+        self.cache.update_instances('User', pks, created=[])
+        self.assertIsNone(self.cache.cache.get(
+            self.cache.counter_key('default', 'User', 'active')))
+        self.assertEqual(3, self.cache.get_count(User))
+
+    def test_refresh_queryset(self):
+        """Rebuild the counters after refresh_queryset."""
+        User.objects.bulk_create([
+            User(username='bulk%d' % x, is_active=False) for x in range(6)])
+        self.cache.refresh_queryset(User.objects.all())
+        self.assertEqual(9, self.cache.get_count(User))
+        self.assertEqual(2, self.cache.get_count(User, {'is_active': True}))
+
+    def test_update_instances(self):
+        """Adjust the counters for known created and deleted instances."""
+        user = User.objects.create(username='active')
+        deleted = self.users[1]
+        pk = deleted.pk
+        deleted.delete()
+        deleted.pk = pk
+        self.cache.update_instances(
+            'User', [user.pk, pk], deleted={pk: deleted}, created=[user.pk])
+        self.assertEqual((3, 2), self.get_counts())
+
+
+class UpgradeCache(SampleCache):
+    """A cache with a v2 User representation, upgraded from default."""
+
+    versions = ['default', 'v2']
+    user_v2_upgrade_from = 'default'
+
+    def user_v2_serializer(self, obj):
+        """Convert a User to the v2 representation."""
+        native = self.user_default_serializer(obj)
+        if native:
+            native['name'] = native.pop('username')
+        return native
+
+    def user_v2_upgrader(self, native):
+        """Upgrade a default User representation to v2."""
+        native['name'] = native.pop('username')
+        return native
+
+    user_v2_loader = SampleCache.user_default_loader
+    user_v2_invalidator = SampleCache.user_default_invalidator
+
+
+class TestUpgrades(TestCase):
+    """Test upgrading cache entries from an earlier version."""
+
+    def setUp(self):
+        """Cache a user in the default version."""
+        self.cache = UpgradeCache()
+        self.cache.stats = MemoryStats()
+        self.user = User.objects.create(username='the_user')
+        self.cache.cache.clear()
+        self.cache.get_instances([('User', self.user.pk, None)])
+        self.specs = [('User', self.user.pk, None)]
+
+    def test_upgrade(self):
+        """A missing entry is upgraded without loading the instance."""
+        with self.assertNumQueries(0):
+            instances = self.cache.get_instances(self.specs, 'v2')
+        native = instances[('User', self.user.pk)][0]
+        self.assertEqual('the_user', native['name'])
+        self.assertNotIn('username', native)
+        raw = self.cache.cache.get(
+            self.cache.key_for('v2', 'User', self.user.pk))
+        self.assertEqual('the_user', self.cache.decode_entry(raw)['name'])
+        self.assertEqual(
+            1, self.cache.stats.counters[('User', 'v2', 'upgrades')])
+        self.assertEqual(
+            1, self.cache.stats.timings[('User', 'v2', 'upgrader')][0])
+
+    def test_upgrade_not_decode_timing(self):
+        """The upgrader is not counted in the decode timing."""
+        upgrader = self.cache.user_v2_upgrader
+
+        def slow_upgrader(native):
+            sleep(0.02)
+            return upgrader(native)
+
+        self.cache.user_v2_upgrader = slow_upgrader
+        self.cache.get_instances(self.specs, 'v2')
+        timings = self.cache.stats.timings
+        self.assertGreaterEqual(timings[('User', 'v2', 'upgrader')][1], 0.02)
+        self.assertLess(timings[('User', 'v2', 'decode')][1], 0.02)
+
+    def test_one_get_many(self):
+        """The earlier entry is read in the same get_many."""
+        with mock.patch.object(
+                self.cache.cache, 'get_many',
+                wraps=self.cache.cache.get_many) as mock_get_many:
+            self.cache.get_instances(self.specs, 'v2')
+        mock_get_many.assert_called_once_with(mock.ANY)
+        self.assertEqual(
+            sorted([self.cache.key_for('default', 'User', self.user.pk),
+                    self.cache.key_for('v2', 'User', self.user.pk)]),
+            sorted(mock_get_many.call_args[0][0]))
+
+    def test_no_earlier_entry(self):
+        """An instance without an earlier entry is loaded."""
+        self.cache.cache.clear()
+        with self.assertNumQueries(2):
+            instances = self.cache.get_instances(self.specs, 'v2')
+        self.assertEqual(
+            'the_user', instances[('User', self.user.pk)][0]['name'])
+        self.assertNotIn(
+            ('User', 'v2', 'upgrades'), self.cache.stats.counters)
+
+    def test_instance_given(self):
+        """A given instance is serialized, not upgraded."""
+        with mock.patch.object(self.cache, 'user_v2_upgrader') as mock_up:
+            self.cache.get_instances(
+                [('User', self.user.pk, self.user)], 'v2')
+        self.assertFalse(mock_up.called)
+
+
+@override_settings(USE_DRF_INSTANCE_CACHE=True)
+class TestCacheStats(TestCase):
+    """Test collecting statistics for the instance cache."""
+
+    def setUp(self):
+        """Setup a cache with a statistics collector."""
+        self.cache = SampleCache()
+        self.cache.cache.clear()
+        self.cache.stats = MemoryStats()
+
+    def get_stats(self):
+        """Get the collected statistics, by model, version, and name."""
+        return dict(
+            ((stat['model'], stat['version'], stat['name']),
+             stat.get('value', stat.get('count')))
+            for stat in self.cache.stats.snapshot())
+
+    def test_get_instances(self):
+        """A get_instances call collects hits, misses, bytes, and timings."""
+        user = User.objects.create(username='the_user')
+        self.cache.cache.clear()
+        self.cache.get_instances([('User', user.pk, None)])
+        self.cache.get_instances(
+            [('User', user.pk, None), ('User', 666, None)])
+        stats = self.get_stats()
+        self.assertEqual(3, stats[('User', 'default', 'requested')])
+        self.assertEqual(1, stats[('User', 'default', 'hits')])
+        self.assertEqual(2, stats[('User', 'default', 'misses')])
+        self.assertEqual(2, stats[(None, 'default', 'cache_get')])
+        self.assertEqual(2, stats[('User', 'default', 'loader')])
+        self.assertEqual(2, stats[('User', 'default', 'serializer')])
+        self.assertEqual(2, stats[('User', 'default', 'decode')])
+        written = stats[('User', 'default', 'bytes_written')]
+        self.assertEqual(written, stats[('User', 'default', 'bytes_read')])
+
+    def test_update_instance(self):
+        """An update_instance call collects updates and invalidations."""
+        user = User.objects.create(username='voter')
+        question = Question.objects.create(
+            question_text='What is your favorite color?',
+            pub_date=datetime(2014, 11, 6, 8, 45, 49, 538232, UTC))
+        choice = Choice.objects.create(
+            question=question, choice_text="Blue. No, Green!")
+        choice.voters.add(user)
+        self.cache.stats.reset()
+        self.cache.update_instance('Choice', choice.pk)
+        self.cache.update_instance('Choice', choice.pk)
+        stats = self.get_stats()
+        self.assertEqual(2, stats[('Choice', 'default', 'invalidations')])
+        self.assertEqual(1, stats[('Choice', 'default', 'updates')])
+        self.assertTrue(stats[('Choice', 'default', 'bytes_read')])
+        self.assertTrue(stats[('Choice', 'default', 'bytes_written')])
+
+    def test_warm_instances(self):
+        """Warming the cache collects loader timings and bytes written."""
+        user = User.objects.create(username='the_user')
+        self.cache.warm_instances('User', [user.pk])
+        stats = self.get_stats()
+        self.assertEqual(1, stats[('User', 'default', 'loader')])
+        self.assertTrue(stats[('User', 'default', 'bytes_written')])
+
 
 @override_settings(USE_DRF_INSTANCE_CACHE=True)
 class TestVersionsCache(SharedCacheTests, TestCase):
@@ -245,8 +1309,9 @@ class TestVersionsCache(SharedCacheTests, TestCase):
         self.cache = SampleCache()
         self.cache.versions = ['default', 'v2']
         self.cache.cache.clear()
-        self.mock_delete = mock.Mock()
-        self.cache.cache.delete = self.mock_delete
+        patcher = mock.patch.object(self.cache.cache, 'delete')
+        self.mock_delete = patcher.start()
+        self.addCleanup(patcher.stop)
 
     def test_update_instance_unhandled_model(self):
         """An error is raised update a model defined as None in the Cache."""
@@ -285,6 +1350,276 @@ class TestCacheDisabled(SharedCacheTests, TestCase):
         """No error when requesting to delete all cached instances."""
         self.cache.delete_all_versions("Model", 86)
 
+    def test_warm_instances(self):
+        """When cache is disabled, warming is skipped."""
+        with self.assertNumQueries(0):
+            self.assertEqual(0, self.cache.warm_instances('User', [123]))
+
+
+class TestEntryEncoding(TestCase):
+    """Test converting representations to and from cache entries."""
+
+    def setUp(self):
+        """Use a non-customized BaseCache for tests."""
+        self.cache = BaseCache()
+        self.native = {'id': 1, 'text': 'Hello, World! ' * 100}
+
+    def test_uncompressed(self):
+        """By default, an entry is stored as JSON."""
+        raw = self.cache.encode_entry('Model', 'default', self.native)
+        self.assertEqual(dumps(self.native, sort_keys=True), raw)
+        self.assertEqual(self.native, self.cache.decode_entry(raw))
+
+    def test_below_threshold(self):
+        """An entry below the compression threshold is stored as JSON."""
+        self.cache.default_compress_threshold = 2000
+        raw = self.cache.encode_entry('Model', 'default', self.native)
+        self.assertEqual(dumps(self.native, sort_keys=True), raw)
+
+    def test_zlib(self):
+        """An entry above the threshold is compressed with zlib."""
+        self.cache.default_compress_threshold = 1000
+        raw = self.cache.encode_entry('Model', 'default', self.native)
+        self.assertEqual(b'z', raw[:1])
+        self.assertLess(len(raw), len(dumps(self.native)))
+        self.assertEqual(self.native, self.cache.decode_entry(raw))
+
+    @skipIf(lzma is None, 'lzma requires Python 3')
+    def test_lzma(self):
+        """An entry can be compressed with lzma."""
+        self.cache.model_default_compressor = 'lzma'
+        self.cache.model_default_compress_threshold = 0
+        self.cache.model_default_compress_level = 1
+        raw = self.cache.encode_entry('Model', 'default', self.native)
+        self.assertEqual(b'x', raw[:1])
+        self.assertEqual(self.native, self.cache.decode_entry(raw))
+
+    def test_incompressible(self):
+        """An entry that does not get smaller is stored as JSON."""
+        self.cache.default_compress_threshold = 0
+        raw = self.cache.encode_entry('Model', 'default', {'id': 1})
+        self.assertEqual('{"id": 1}', raw)
+
+    def test_bytes_saved(self):
+        """The bytes saved by compression are counted."""
+        self.cache.default_compress_threshold = 0
+        self.cache.stats = MemoryStats()
+        raw = self.cache.encode_entry('Model', 'default', self.native)
+        saved = len(dumps(self.native)) - len(raw)
+        self.assertEqual(
+            [{'model': 'Model', 'version': 'default', 'name': 'bytes_saved',
+              'value': saved}],
+            self.cache.stats.snapshot())
+
+    def test_get_instances(self):
+        """A compressed and an uncompressed entry can be mixed."""
+        cache = SampleCache()
+        cache.cache.clear()
+        cache.user_default_compress_threshold = 0
+        user_pks = [
+            User.objects.create(username='user%d' % x).pk for x in range(2)]
+        cache.cache.clear()
+        cache.get_instances([('User', user_pks[0], None)])
+        key = cache.key_for('default', 'User', user_pks[0])
+        self.assertEqual(b'z', cache.cache.get(key)[:1])
+        cache.user_default_compress_threshold = None
+        cache.get_instances([('User', user_pks[1], None)])
+        with self.assertNumQueries(0):
+            instances = cache.get_instances(
+                [('User', pk, None) for pk in user_pks])
+        self.assertEqual(2, len(instances))
+
+
+class TestChunkedEntries(TestCase):
+    """Test splitting large cache entries into chunks."""
+
+    def setUp(self):
+        """Use a small maximum entry size."""
+        self.cache = SampleCache()
+        self.cache.cache.clear()
+        self.cache.max_entry_size = 100
+
+    def test_small_entry(self):
+        """An entry below the maximum size is stored under its key."""
+        self.assertEqual(
+            {'key': 'x' * 100}, self.cache.split_entry('key', 'x' * 100))
+
+    def test_split_and_join(self):
+        """A large entry is split into chunks and reassembled."""
+        raw = dumps({'text': 'x' * 250})
+        self.cache.set_entries({'key': raw}, None)
+        manifest = self.cache.cache.get('key')
+        self.assertTrue(manifest.startswith('drfc_chunked:'))
+        self.assertTrue(manifest.endswith(':3'))
+        entries = self.cache.get_entries(['key', 'other'])
+        self.assertEqual(['key'], list(entries.keys()))
+        self.assertEqual(raw.encode('utf-8'), entries['key'])
+        self.assertEqual(
+            {'text': 'x' * 250}, self.cache.decode_entry(entries['key']))
+
+    def test_compressed(self):
+        """A compressed entry can be split into chunks."""
+        raw = b'z' + bytes(bytearray(range(256)))
+        self.cache.set_entries({'key': raw}, None)
+        self.assertEqual(raw, self.cache.get_entries(['key'])['key'])
+
+    def test_missing_chunk(self):
+        """An entry with a missing chunk is a cache miss."""
+        self.cache.set_entries({'key': 'x' * 250}, None)
+        self.cache.cache.delete(self.cache.chunk_key('key', 1))
+        self.assertEqual({}, self.cache.get_entries(['key']))
+
+    def test_mixed_chunks(self):
+        """An entry with a chunk from a different write is a cache miss."""
+        self.cache.set_entries({'key': 'x' * 250}, None)
+        chunk_key = self.cache.chunk_key('key', 1)
+        self.cache.cache.set(chunk_key, b'00000000' + b'y' * 92)
+        self.assertEqual({}, self.cache.get_entries(['key']))
+
+    def chunk_keys(self):
+        """Get the chunk keys in the cache."""
+        return sorted(
+            key for key in self.cache.cache._cache
+            if '_chunk_' in key)
+
+    def test_rewrite(self):
+        """Rewriting a chunked entry replaces or deletes its chunks."""
+        self.cache.set_entries({'key': 'x' * 500}, None)
+        self.assertEqual(6, len(self.chunk_keys()))
+        self.cache.set_entries({'key': 'y' * 250}, None)
+        self.assertEqual(3, len(self.chunk_keys()))
+        self.assertEqual(
+            {'key': b'y' * 250}, self.cache.get_entries(['key']))
+        chunks = {}
+        self.cache.get_entries(['key'], chunks=chunks)
+        self.assertEqual({'key': 3}, chunks)
+        self.cache.set_entries({'key': 'z' * 50}, None, chunks=chunks)
+        self.assertEqual([], self.chunk_keys())
+
+    def test_delete(self):
+        """Deleting chunked entries deletes their chunks."""
+        self.cache.set_entries({'key': 'x' * 250, 'other': 'y' * 250}, None)
+        self.cache.delete_entry('key', self.cache.cache)
+        self.assertEqual(3, len(self.chunk_keys()))
+        self.cache.delete_entries(['other'], self.cache.cache)
+        self.assertEqual([], self.chunk_keys())
+
+    def test_get_instances(self):
+        """Large entries are read with one extra get_many."""
+        user_pks = [
+            User.objects.create(username='%d%s' % (x, 'x' * 149)).pk
+            for x in range(2)]
+        self.cache.cache.clear()
+        specs = [('User', pk, None) for pk in user_pks]
+        self.cache.get_instances(specs)
+        with mock.patch.object(
+                self.cache.cache, 'get_many',
+                wraps=self.cache.cache.get_many) as mock_get_many:
+            with self.assertNumQueries(0):
+                instances = self.cache.get_instances(specs)
+        self.assertEqual(2, mock_get_many.call_count)
+        self.assertEqual(
+            '0' + 'x' * 149, instances[('User', user_pks[0])][0]['username'])
+
+    def test_update_instance(self):
+        """A chunked entry is compared and replaced by update_instance."""
+        user = User.objects.create(username='x' * 150)
+        self.cache.update_instance('User', user.pk, user)
+        self.assertEqual(
+            [], self.cache.update_instance('User', user.pk, user,
+                                           update_only=True))
+        user.username = 'y' * 150
+        self.cache.update_instance('User', user.pk, user)
+        instances = self.cache.get_instances([('User', user.pk, None)])
+        self.assertEqual(
+            'y' * 150, instances[('User', user.pk)][0]['username'])
+        self.assertEqual(4, len(self.chunk_keys()))
+        user.username = 'short'
+        self.cache.update_instance('User', user.pk, user)
+        key = self.cache.key_for('default', 'User', user.pk)
+        self.assertTrue(self.cache.cache.get(key).endswith(':2'))
+        self.assertEqual(2, len(self.chunk_keys()))
+
+
+class TestColumnConverters(TestCase):
+    """Test converting a field of many instances at once."""
+
+    def setUp(self):
+        """Use a non-customized BaseCache for tests."""
+        self.cache = BaseCache()
+
+    def assert_same_as_scalar(self, type_code, json_values):
+        """Assert that from_json_many matches from_json for each value."""
+        from_json = self.cache.field_function(type_code, 'from_json')
+        from_json_many = self.cache.field_function(
+            type_code, 'from_json_many')
+        expected = [from_json(value) for value in json_values]
+        actual = from_json_many(json_values)
+        self.assertEqual(len(expected), len(actual))
+        return expected, actual
+
+    def test_datetime(self):
+        """Convert DateTimes to the same values."""
+        dts = [
+            datetime(2014, 9, 22, 8, 52, 0, 123456, UTC),
+            datetime(2014, 9, 22, 8, 52, 0, 0, UTC),
+            datetime(1969, 12, 31, 23, 59, 55, 1, UTC),
+            None]
+        expected, actual = self.assert_same_as_scalar(
+            'DateTime', [self.cache.field_datetime_to_json(dt) for dt in dts])
+        self.assertEqual(dts, expected)
+        self.assertEqual(dts, actual)
+        self.assertEqual(UTC, actual[0].tzinfo)
+
+    def test_date(self):
+        """Convert Dates to the same values."""
+        expected, actual = self.assert_same_as_scalar(
+            'Date', [[2014, 9, 22], None])
+        self.assertEqual(expected, actual)
+
+    def test_pk_and_pklist(self):
+        """Convert PKs and PKLists to the same values."""
+        expected, actual = self.assert_same_as_scalar('PK', [
+            self.cache.field_pk_to_json(User, 1),
+            self.cache.field_pk_to_json(Group, 2)])
+        self.assertEqual(
+            [(e.model, e.pk) for e in expected],
+            [(a.model, a.pk) for a in actual])
+        expected, actual = self.assert_same_as_scalar('PKList', [
+            self.cache.field_pklist_to_json(User, [1, 2]),
+            self.cache.field_pklist_to_json(User, [])])
+        self.assertEqual(
+            [(e.model, e.pks) for e in expected],
+            [(a.model, a.pks) for a in actual])
+
+    def test_fields_from_json_fallback(self):
+        """Convert types without from_json_many one at a time."""
+        self.assertIsNone(
+            self.cache.field_function('TimeDelta', 'from_json_many'))
+        name, values = self.cache.fields_from_json(
+            'duration:TimeDelta', [5, '1.5', None])
+        self.assertEqual('duration', name)
+        self.assertEqual(
+            [timedelta(seconds=5), timedelta(seconds=1.5), None], values)
+
+    def test_get_instances(self):
+        """Convert each field of all the instances at once."""
+        cache = SampleCache()
+        users = [User.objects.create(username='user%d' % x) for x in range(3)]
+        cache.cache.clear()
+        specs = [('User', user.pk, None) for user in users]
+        cache.get_instances(specs)
+        with mock.patch.object(
+                cache, 'field_datetime_from_json_many',
+                wraps=cache.field_datetime_from_json_many) as mock_many:
+            instances = cache.get_instances(specs)
+        self.assertEqual(1, mock_many.call_count)
+        self.assertEqual(3, len(mock_many.call_args[0][0]))
+        for user in users:
+            self.assertEqual(
+                user.date_joined,
+                instances[('User', user.pk)][0]['date_joined'])
+
 
 class TestFieldConverters(TestCase):
     """Test the built-in field converter methods."""
@@ -408,3 +1743,54 @@ class TestFieldConverters(TestCase):
         self.assertIsInstance(out, PkOnlyModel)
         self.assertEqual(User, out.model)
         self.assertEqual(1, out.pk)
+
+    def test_compactpklist(self):
+        """Integer primary keys are stored as fixed-width deltas."""
+        pks = [1, 2, 3, 200, 100000, 50, 2 ** 40]
+        converted = self.cache.field_compactpklist_to_json(User, pks)
+        self.assertEqual('auth.user', converted[0])
+        self.assertIsInstance(converted[1], six.text_type)
+        self.assertEqual(converted, loads(dumps(converted)))
+        out = self.cache.field_compactpklist_from_json(converted)
+        self.assertIsInstance(out, PkOnlyQueryset)
+        self.assertEqual(User, out.model)
+        self.assertIsInstance(out.pks, list)
+        self.assertEqual(pks, list(out.pks))
+
+    def test_compactpklist_sorted_size(self):
+        """Sorted primary keys are smaller than a JSON list."""
+        pks = list(range(1000, 2000))
+        converted = self.cache.field_compactpklist_to_json(User, pks)
+        self.assertLess(len(dumps(converted)) * 4, len(dumps(pks)))
+
+    def test_compactpklist_sorted_width(self):
+        """Sorted, dense primary keys take one byte each."""
+        dense = self.cache.field_compactpklist_to_json(User, range(1, 101))
+        gap = self.cache.field_compactpklist_to_json(
+            User, list(range(1, 100)) + [1000])
+        self.assertLess(len(dense[1]), 140)
+        self.assertGreater(len(gap[1]), 260)
+        self.assertEqual(
+            list(range(1, 100)) + [1000], list(decode_pks(gap[1])))
+
+    def test_compactpklist_empty(self):
+        """An empty primary key list can be stored and retrieved."""
+        converted = self.cache.field_compactpklist_to_json(User, [])
+        out = self.cache.field_compactpklist_from_json(converted)
+        self.assertEqual([], list(out.pks))
+
+    def test_compactpklist_strings(self):
+        """Non-integer primary keys are stored as a list."""
+        converted = self.cache.field_compactpklist_to_json(User, ['a', 'b'])
+        self.assertEqual(['auth.user', ['a', 'b']], converted)
+        out = self.cache.field_compactpklist_from_json(converted)
+        self.assertEqual(['a', 'b'], out.pks)
+
+    def test_compactpk(self):
+        """A primary key is stored with the model label."""
+        converted = self.cache.field_compactpk_to_json(User, 1)
+        self.assertEqual(['auth.user', 1], converted)
+        out = self.cache.field_compactpk_from_json(converted)
+        self.assertIsInstance(out, PkOnlyModel)
+        self.assertEqual(User, out.model)
+        self.assertEqual(1, out.pk)
@@ -0,0 +1,58 @@
+"""Tests for drf_cached_instances/hotkeys.py."""
+
+import mock
+
+from django.test import TestCase
+
+from drf_cached_instances.hotkeys import HotKeyTracker
+
+
+class TestHotKeyTracker(TestCase):
+    """Test the hot key tracker."""
+
+    def setUp(self):
+        """Create a tracker."""
+        self.tracker = HotKeyTracker()
+
+    def test_threshold(self):
+        """A key becomes hot when it passes the threshold."""
+        for x in range(2):
+            self.assertEqual(
+                set(), self.tracker.sample(['a', 'b'], 1.0, 3, 60))
+        self.assertEqual(
+            set(['a']), self.tracker.sample(['a', 'c'], 1.0, 3, 60))
+        self.assertEqual(set(['a']), self.tracker.sample(['a'], 1.0, 3, 60))
+
+    def test_sample_rate(self):
+        """Sample reads, with the threshold scaled by the rate."""
+        with mock.patch('drf_cached_instances.hotkeys.random') as mock_random:
+            mock_random.side_effect = [0.05, 0.5, 0.05]
+            self.assertEqual(
+                set(), self.tracker.sample(['a', 'a'], 0.1, 20, 60))
+            self.assertEqual(
+                set(['a']), self.tracker.sample(['a'], 0.1, 20, 60))
+        self.assertEqual(2, self.tracker.sampled)
+
+    def test_window(self):
+        """Reset counts each window, and expire hot keys."""
+        with mock.patch('drf_cached_instances.hotkeys.time') as mock_time:
+            mock_time.return_value = 1000.0
+            self.tracker.reset()
+            self.tracker.sample(['a', 'b'], 1.0, 2, 60)
+            self.tracker.sample(['a'], 1.0, 2, 60)
+            mock_time.return_value = 1061.0
+            self.assertEqual(
+                set(), self.tracker.sample(['a', 'b'], 1.0, 2, 60))
+            self.assertEqual({'b': 1, 'a': 1}, dict(self.tracker.counts))
+            self.assertEqual({}, self.tracker.hot)
+
+    def test_snapshot(self):
+        """The detection statistics can be inspected."""
+        self.tracker.sample(['a', 'b', 'b'], 1.0, 2, 60)
+        self.tracker.record_replica_reads(3, 1)
+        snapshot = self.tracker.snapshot()
+        self.assertEqual(['b'], snapshot['hot'])
+        self.assertEqual([['b', 2], ['a', 1]], snapshot['top'])
+        self.assertEqual(3, snapshot['sampled'])
+        self.assertEqual(3, snapshot['replica_reads'])
+        self.assertEqual(1, snapshot['replica_misses'])
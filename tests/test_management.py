@@ -0,0 +1,136 @@
+"""Tests for drf_cached_instances/management/commands."""
+
+import json
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+
+from drf_cached_instances.stats import MemoryStats, published_stats
+from sample_poll_app.cache import SampleCache
+
+
+@override_settings(USE_DRF_INSTANCE_CACHE=True)
+class TestWarmDrfCache(TestCase):
+    """Tests for the warm_drf_cache command."""
+
+    cache_path = 'sample_poll_app.cache.SampleCache'
+
+    def setUp(self):
+        """Create some users with an empty cache."""
+        self.cache = SampleCache()
+        self.user_pks = [
+            User.objects.create(username='user%d' % x).pk for x in range(5)]
+        self.cache.cache.clear()
+
+    def call(self, *args, **kwargs):
+        """Call the command, returning the output."""
+        out = StringIO()
+        call_command('warm_drf_cache', *args, stdout=out, **kwargs)
+        return out.getvalue()
+
+    def cached_pks(self):
+        """Return the primary keys of the cached users."""
+        keys = [
+            self.cache.key_for('default', 'User', pk) for pk in self.user_pks]
+        cached = self.cache.cache.get_many(keys)
+        return [pk for pk, key in zip(self.user_pks, keys) if key in cached]
+
+    def test_warm_all(self):
+        """All instances are cached, in keyset batches."""
+        out = self.call(self.cache_path, 'auth.User', batch_size=2)
+        self.assertEqual(self.user_pks, self.cached_pks())
+        lines = out.splitlines()
+        self.assertEqual(4, len(lines))
+        self.assertEqual(
+            '2/5 User instances processed, 2 cached (resume with --start-pk'
+            ' %s)' % self.user_pks[1], lines[0])
+        self.assertTrue(lines[-1].startswith('Cached 5 User instances'))
+
+    def test_warm_with_bulk_loader(self):
+        """A batch is loaded with the bulk loader's queries."""
+        with self.assertNumQueries(4):  # Count, batch pks, users, votes
+            self.call(self.cache_path, 'auth.User', batch_size=10)
+
+    def test_start_pk(self):
+        """Warming can resume after a primary key."""
+        self.call(self.cache_path, 'auth.User', start_pk=self.user_pks[2])
+        self.assertEqual(self.user_pks[3:], self.cached_pks())
+
+    def test_max_rate(self):
+        """A maximum rate can be set."""
+        self.call(self.cache_path, 'auth.User', max_rate=1000)
+        self.assertEqual(self.user_pks, self.cached_pks())
+
+    def test_unknown_model(self):
+        """An unknown model is an error."""
+        self.assertRaises(
+            CommandError, self.call, self.cache_path, 'auth.Foo')
+
+    def test_unknown_version(self):
+        """An unknown cache version is an error."""
+        self.assertRaises(
+            CommandError, self.call, self.cache_path, 'auth.User',
+            cache_version='v2')
+
+    def test_unknown_cache(self):
+        """An unknown cache class is an error."""
+        self.assertRaises(
+            CommandError, self.call, 'sample_poll_app.cache.Foo', 'auth.User')
+
+
+@override_settings(
+    DRF_INSTANCE_CACHE_STATS='drf_cached_instances.stats.MemoryStats')
+class TestDrfCacheStats(TestCase):
+    """Tests for the drf_cache_stats command."""
+
+    def setUp(self):
+        """Clear published statistics."""
+        cache.clear()
+        self.stats = SampleCache().stats
+        self.stats.reset()
+
+    def call(self, *args, **kwargs):
+        """Call the command, returning the output."""
+        out = StringIO()
+        call_command('drf_cache_stats', *args, stdout=out, **kwargs)
+        return out.getvalue()
+
+    def test_no_stats(self):
+        """A message is shown when there are no statistics."""
+        self.assertEqual(
+            'No statistics have been published.\n', self.call())
+
+    def test_table(self):
+        """The statistics of all processes are combined and shown."""
+        other = MemoryStats()
+        other.key = 'drfc_stats_other'
+        other.incr('User', 'default', 'hits', 3)
+        other.publish(cache)
+        self.stats.incr('User', 'default', 'misses')
+        self.stats.timing(None, 'default', 'cache_get', 0.5)
+        lines = self.call().splitlines()
+        expected = [
+            'Model            Version    Statistic      Value',
+            '(all)            default    cache_get      count=1'
+            ' total=0.5000s avg=0.500000s max=0.500000s',
+            'User             default    hits           3',
+            'User             default    hit_ratio      0.750',
+            'User             default    misses         1',
+        ]
+        self.assertEqual(expected, lines)
+
+    def test_json_and_reset(self):
+        """The statistics can be shown as JSON, and then reset."""
+        self.stats.incr('User', 'default', 'hits')
+        out = self.call(json=True, reset=True)
+        expected = [
+            {'model': 'User', 'version': 'default', 'name': 'hits',
+             'value': 1}]
+        self.assertEqual(expected, json.loads(out))
+        self.assertEqual([], published_stats(cache))
+        self.assertEqual([], self.stats.snapshot())
@@ -2,14 +2,23 @@
 
 from datetime import datetime
 
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.http import Http404
 from django.core.urlresolvers import reverse
 from rest_framework.test import APIRequestFactory, APITestCase
 from pytz import UTC
 
 from drf_cached_instances.models import CachedModel, CachedQueryset
-from sample_poll_app.models import Question
-from sample_poll_app.viewsets import QuestionViewSet
+from sample_poll_app.models import Choice, Question
+from sample_poll_app.viewsets import (
+    ChoiceViewSet, QuestionViewSet, UserViewSet)
+
+
+class TimedQuestionViewSet(QuestionViewSet):
+    """QuestionViewSet with Server-Timing headers."""
+
+    server_timing = True
 
 
 class CachedViewMixinTest(APITestCase):
@@ -74,3 +83,139 @@ class CachedViewMixinTest(APITestCase):
         view.kwargs = {'pk': 666}
         view.request = request
         self.assertRaises(Http404, view.get_object)
+
+    def test_server_timing_disabled(self):
+        """By default, there is no Server-Timing header."""
+        view = QuestionViewSet.as_view({'get': 'list'})
+        response = view(APIRequestFactory().get(reverse('question-list')))
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_server_timing_list(self):
+        """The Server-Timing header has the duration of each phase."""
+        Question.objects.create(
+            question_text="What is your quest?",
+            pub_date=datetime(2014, 11, 6, 15, 30, 29, 135492, UTC))
+        cache.clear()
+        view = TimedQuestionViewSet.as_view({'get': 'list'})
+        response = view(APIRequestFactory().get(reverse('question-list')))
+        self.assertEqual(200, response.status_code)
+        metrics = response['Server-Timing'].split(', ')
+        names = [metric.split(';')[0] for metric in metrics]
+        self.assertEqual(
+            ['pks', 'cache', 'load', 'serialize', 'decode', 'drf', 'total'],
+            names)
+        load_ms = float(metrics[2].split(';')[1][len('dur='):])
+        self.assertGreater(load_ms, 0)
+
+    def test_sparse_fields_list(self):
+        """A list with ?fields= returns only the requested fields."""
+        Question.objects.create(
+            question_text="What is your quest?",
+            pub_date=datetime(2014, 11, 6, 15, 30, 29, 135492, UTC))
+        view = QuestionViewSet.as_view({'get': 'list'})
+        response = view(APIRequestFactory().get(
+            reverse('question-list'), {'fields': 'id,pub_date,unknown'}))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['id', 'pub_date'], list(response.data[0].keys()))
+
+    def test_sparse_fields_retrieve(self):
+        """A retrieve with ?fields= converts only the requested fields."""
+        user = User.objects.create(username='the_user')
+        url = reverse('user-detail', kwargs={'pk': user.pk})
+        view = UserViewSet()
+        view.action = 'retrieve'
+        view.kwargs = {'pk': user.pk}
+        view.request = APIRequestFactory().get(url, {'fields': 'username'})
+        obj = view.get_object()
+        self.assertEqual({'id': user.pk, 'username': 'the_user'}, obj._data)
+        view = UserViewSet.as_view({'get': 'retrieve'})
+        response = view(
+            APIRequestFactory().get(url, {'fields': 'username'}), pk=user.pk)
+        self.assertEqual({'username': 'the_user'}, response.data)
+
+    def test_sparse_fields_disabled(self):
+        """With fields_param = None, all fields are returned."""
+        question = Question.objects.create(
+            question_text="What is your quest?",
+            pub_date=datetime(2014, 11, 6, 15, 30, 29, 135492, UTC))
+
+        class AllFieldsViewSet(QuestionViewSet):
+            fields_param = None
+
+        view = AllFieldsViewSet.as_view({'get': 'retrieve'})
+        url = reverse('question-detail', kwargs={'pk': question.pk})
+        response = view(
+            APIRequestFactory().get(url, {'fields': 'id'}), pk=question.pk)
+        self.assertEqual(
+            ['id', 'question_text', 'pub_date'], list(response.data.keys()))
+
+    def create_choices(self):
+        """Create a question with two choices, and warm the cache."""
+        question = Question.objects.create(
+            question_text="What is your quest?",
+            pub_date=datetime(2014, 11, 6, 15, 30, 29, 135492, UTC))
+        choices = [
+            Choice.objects.create(question=question, choice_text=text)
+            for text in ('To seek the Holy Grail', 'To find a shrubbery')]
+        view = ChoiceViewSet.as_view({'get': 'list'})
+        view(APIRequestFactory().get(
+            reverse('choice-list'), {'expand': 'question.choices'}))
+        return question, choices
+
+    def test_expand_list(self):
+        """A list with ?expand= embeds related instances from the cache."""
+        question, choices = self.create_choices()
+        view = ChoiceViewSet.as_view({'get': 'list'})
+        request = APIRequestFactory().get(
+            reverse('choice-list'), {'expand': 'question.choices'})
+        with self.assertNumQueries(1):
+            response = view(request)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, len(response.data))
+        for data in response.data:
+            self.assertEqual(question.pk, data['question']['id'])
+            self.assertEqual(
+                sorted(choice.pk for choice in choices),
+                sorted(child['id'] for child in data['question']['choices']))
+            self.assertEqual(question.pk, data['question']['choices'][0][
+                'question'])
+
+    def test_expand_retrieve(self):
+        """A retrieve with ?expand= embeds a list of related instances."""
+        question, choices = self.create_choices()
+        view = QuestionViewSet.as_view({'get': 'retrieve'})
+        url = reverse('question-detail', kwargs={'pk': question.pk})
+        response = view(
+            APIRequestFactory().get(url, {'expand': 'choices'}),
+            pk=question.pk)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            sorted(choice.choice_text for choice in choices),
+            sorted(child['choice_text'] for child in response.data['choices']))
+
+    def test_expand_depth_limit(self):
+        """Ignore paths deeper than max_expand_depth."""
+        view = ChoiceViewSet()
+        view.action = 'list'
+        view.request = APIRequestFactory().get(
+            reverse('choice-list'),
+            {'expand': 'question.choices.voters,question.choices'})
+        self.assertEqual(
+            ['question', 'question.choices'],
+            view.get_requested_expansions())
+        view.max_expand_depth = 1
+        self.assertEqual([], view.get_requested_expansions())
+        view.request = APIRequestFactory().get(
+            reverse('choice-list'), {'expand': 'question.choices.voters'})
+        view.max_expand_depth = 2
+        self.assertEqual([], view.get_requested_expansions())
+
+    def test_expand_with_fields(self):
+        """Ignore expansions of fields that are not requested."""
+        view = ChoiceViewSet()
+        view.action = 'list'
+        view.request = APIRequestFactory().get(
+            reverse('choice-list'),
+            {'expand': 'question', 'fields': 'choice_text'})
+        self.assertEqual([], view.get_requested_expansions())
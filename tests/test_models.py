@@ -1,11 +1,19 @@
 """Tests for drf_cached_instances/models.py."""
+from datetime import date, datetime
+
+import mock
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase
+from pytz import UTC
 
 from drf_cached_instances.models import (
-    CachedModel, CachedQueryset, PkOnlyModel, PkOnlyQueryset)
+    CachedModel, CachedQueryset, PkOnlyModel, PkOnlyQueryset, expand_related)
 
+from drf_cached_instances.cache import MISSING
+from drf_cached_instances.stats import MemoryStats
 from sample_poll_app.cache import SampleCache
+from sample_poll_app.models import Choice, Question
 
 
 class TestCachedModel(TestCase):
@@ -29,6 +37,59 @@ class TestCachedModel(TestCase):
         cm = CachedModel(User, {'id': 7, 'username': 'frank'})
         self.assertEqual(7, cm.pk)
 
+    def test_typed_field_converted_on_access(self):
+        """Typed fields are converted when first accessed."""
+        cache = SampleCache()
+        joined = datetime(2014, 11, 6, 8, 45, 49, 0, UTC)
+        key, value = cache.field_to_json('DateTime', 'date_joined', joined)
+        cm = CachedModel(User, {'id': 7, key: value}, cache)
+        with mock.patch.object(
+                cache, 'field_from_json',
+                wraps=cache.field_from_json) as mock_from_json:
+            self.assertEqual(7, cm.pk)
+            self.assertFalse(mock_from_json.called)
+            self.assertEqual(joined, cm.date_joined)
+            self.assertEqual(joined, cm.date_joined)
+        mock_from_json.assert_called_once_with(key, value)
+
+    def test_typed_field_conversion_timed(self):
+        """The conversion of a typed field is reported as a timing."""
+        cache = SampleCache()
+        cache.stats = mock.Mock()
+        key, value = cache.field_to_json(
+            'DateTime', 'date_joined', datetime(2014, 11, 6, tzinfo=UTC))
+        cm = CachedModel(User, {'id': 7, key: value}, cache)
+        cm.date_joined
+        cache.stats.timing.assert_called_once_with(
+            'User', 'default', 'convert', mock.ANY)
+
+    def test_typed_field_conversion_timed_version(self):
+        """The conversion is reported under the version of the data."""
+        cache = SampleCache()
+        cache.stats = mock.Mock()
+        key, value = cache.field_to_json(
+            'DateTime', 'date_joined', datetime(2014, 11, 6, tzinfo=UTC))
+        cm = CachedModel(User, {'id': 7, key: value}, cache, version='v2')
+        cm.date_joined
+        cache.stats.timing.assert_called_once_with(
+            'User', 'v2', 'convert', mock.ANY)
+
+    def test_fields(self):
+        """Only the selected fields and the primary key are available."""
+        cache = SampleCache()
+        key, value = cache.field_to_json('Date', 'birthday', date(2014, 11, 6))
+        data = {'id': 7, 'username': 'frank', key: value}
+        cm = CachedModel(User, data, cache, fields=['username'])
+        self.assertEqual({'id': 7, 'username': 'frank'}, cm._data)
+        self.assertRaises(AttributeError, getattr, cm, 'birthday')
+
+    def test_data_converts_typed_fields(self):
+        """The _data property converts all typed fields."""
+        cache = SampleCache()
+        key, value = cache.field_to_json('Date', 'birthday', date(2014, 11, 6))
+        cm = CachedModel(User, {'id': 7, key: value}, cache)
+        self.assertEqual({'id': 7, 'birthday': date(2014, 11, 6)}, cm._data)
+
 
 class TestCachedQueryset(TestCase):
     """Tests for TestCachedQueryset."""
@@ -56,6 +117,23 @@ class TestCachedQueryset(TestCase):
         cq = CachedQueryset(self.cache, User.objects.all())
         self.assertRaises(User.DoesNotExist, cq.get, pk=666)
 
+    def test_get_nonexisting_instance_is_cached(self):
+        """A missing instance is cached, and the database is skipped."""
+        cq = CachedQueryset(self.cache, User.objects.all())
+        self.assertRaises(User.DoesNotExist, cq.get, pk=666)
+        with self.assertNumQueries(0):
+            self.assertRaises(User.DoesNotExist, cq.get, pk=666)
+
+    def test_iteration_skips_missing_instances(self):
+        """Iterating skips instances cached as missing."""
+        self.create_users(2)
+        user_pks = list(
+            User.objects.order_by('pk').values_list('pk', flat=True))
+        key = self.cache.key_for('default', 'User', user_pks[0])
+        self.cache.cache.set(key, MISSING)
+        cq = CachedQueryset(self.cache, User.objects.order_by('pk'))
+        self.assertEqual(user_pks[1:], [cm.id for cm in cq])
+
     def test_all(self):
         """Filtering by all() returns the CachedQueryset."""
         cq = CachedQueryset(self.cache, User.objects.all())
@@ -93,6 +171,35 @@ class TestCachedQueryset(TestCase):
             self.assertIsInstance(cm, CachedModel)
             self.assertEqual(pk, cm.id)
 
+    def test_only(self):
+        """Select fields for the CachedModels with only()."""
+        self.create_users(3)
+        cq = CachedQueryset(self.cache, User.objects.order_by('pk'))
+        self.assertIs(cq, cq.only('username'))
+        cms = list(cq[:2])
+        self.assertEqual(2, len(cms))
+        for cm in cms:
+            self.assertEqual(['id', 'username'], sorted(cm._data))
+
+    def test_iteration_converts_columns(self):
+        """A typed field is converted for all iterated instances at once."""
+        self.create_users(5)
+        cq = CachedQueryset(self.cache, User.objects.order_by('pk'))
+        with mock.patch.object(
+                self.cache, 'field_datetime_from_json_many',
+                wraps=self.cache.field_datetime_from_json_many) as mock_many:
+            with mock.patch.object(
+                    self.cache, 'field_datetime_from_json') as mock_one:
+                users = list(cq)
+                self.assertFalse(mock_many.called)
+                joined = [user.date_joined for user in users]
+        self.assertEqual(1, mock_many.call_count)
+        self.assertEqual(5, len(mock_many.call_args[0][0]))
+        self.assertFalse(mock_one.called)
+        self.assertEqual(
+            list(User.objects.order_by('pk').values_list(
+                'date_joined', flat=True)), joined)
+
     def test_iteration_of_empty_queryset(self):
         """Iterating through a queryset returns CachedModels."""
         cq = CachedQueryset(self.cache, User.objects.order_by('pk'))
@@ -140,6 +247,148 @@ class TestCachedQueryset(TestCase):
         with self.assertNumQueries(0):
             self.assertEqual(5, users.count())
 
+    def test_count_without_counter(self):
+        """Count querysets without a matching counter in the database."""
+        self.create_users(3)
+        self.cache.get_count(User)
+        querysets = (
+            CachedQueryset(self.cache, User.objects.all()).filter(
+                username='user1'),
+            CachedQueryset(self.cache, User.objects.filter(username='user1')),
+        )
+        for cq in querysets:
+            with self.assertNumQueries(1):
+                self.assertEqual(1, cq.count())
+
+    def create_questions(self, number):
+        """Create Questions, published a day apart, newest first."""
+        return [
+            Question.objects.create(
+                question_text='Question %d' % x,
+                pub_date=datetime(2014, 11, 30 - x, tzinfo=UTC))
+            for x in range(number)]
+
+    def test_pk_index(self):
+        """Unfiltered querysets with an indexed ordering use the index."""
+        questions = self.create_questions(5)
+        cq = CachedQueryset(self.cache, Question.objects.order_by('-pub_date'))
+        with self.assertNumQueries(1):
+            self.assertEqual(5, cq.count())
+        cq = CachedQueryset(self.cache, Question.objects.order_by('-pub_date'))
+        with self.assertNumQueries(0):
+            self.assertEqual(5, cq.count())
+            page = cq[1:3]
+            self.assertEqual([q.pk for q in questions[1:3]], page.pks)
+        cq = CachedQueryset(self.cache, Question.objects.all())
+        with self.assertNumQueries(1):
+            self.assertEqual(sorted(q.pk for q in questions), cq.pks)
+
+    def test_pk_index_not_used(self):
+        """Filtered and unindexed querysets query the database."""
+        self.create_questions(3)
+        self.cache.get_pk_index(Question, '-pub_date')
+        querysets = (
+            Question.objects.order_by('-pub_date').filter(
+                question_text='Question 1'),
+            Question.objects.order_by('question_text'),
+            Question.objects.order_by('-pub_date', 'question_text'),
+        )
+        for queryset in querysets:
+            cq = CachedQueryset(self.cache, queryset)
+            with self.assertNumQueries(1):
+                cq.count()
+
+    def test_pk_index_expression(self):
+        """Query the database for querysets ordered by an expression."""
+        questions = self.create_questions(3)
+        choice = Choice.objects.create(
+            question=questions[0], choice_text='Blue')
+        self.cache.get_pk_index(Question, '-pub_date')
+        cq = CachedQueryset(
+            self.cache, Question.objects.order_by(F('pub_date').desc()))
+        self.assertEqual([q.pk for q in questions], [q.pk for q in cq])
+        cq = CachedQueryset(
+            self.cache, Choice.objects.order_by(F('id').asc()))
+        self.assertEqual([choice.pk], [c.pk for c in cq])
+        self.assertIsNone(
+            self.cache.get_pk_index(Question, F('pub_date').desc()))
+
+
+class VersionCache(SampleCache):
+    """A cache with a v2 User representation."""
+
+    versions = ['default', 'v2']
+
+    def user_v2_serializer(self, obj):
+        """Convert a User to the v2 representation."""
+        native = self.user_default_serializer(obj)
+        if native:
+            native['name'] = native.pop('username')
+        return native
+
+    user_v2_loader = SampleCache.user_default_loader
+    user_v2_invalidator = SampleCache.user_default_invalidator
+
+
+class TestCachedQuerysetVersion(TestCase):
+    """Tests for a CachedQueryset using a cache version."""
+
+    def setUp(self):
+        """Shared objects for testing."""
+        self.cache = VersionCache()
+        self.cache.cache.clear()
+        self.cache.stats = MemoryStats()
+        self.user = User.objects.create(username='frank')
+
+    def get_versions(self, name):
+        """Get the versions of the collected statistic."""
+        return set(
+            stat['version'] for stat in self.cache.stats.snapshot()
+            if stat['name'] == name)
+
+    def test_iter(self):
+        """Use the queryset's version for instances and timings."""
+        cq = CachedQueryset(
+            self.cache, User.objects.filter(username='frank'), version='v2')
+        users = list(cq)
+        self.assertEqual('frank', users[0].name)
+        self.assertTrue(users[0].date_joined)
+        self.assertEqual(set(['v2']), self.get_versions('queryset'))
+        self.assertEqual(set(['v2']), self.get_versions('convert'))
+
+    def test_get(self):
+        """A single instance uses the queryset's version."""
+        cq = CachedQueryset(self.cache, User.objects.all(), version='v2')
+        self.assertEqual('frank', cq.get(pk=self.user.pk).name)
+        self.assertEqual('v2', cq[:1].version)
+        self.assertEqual('v2', cq.none().version)
+
+    def test_default_version(self):
+        """The version defaults to the cache's default version."""
+        cq = CachedQueryset(self.cache, User.objects.all())
+        self.assertEqual('default', cq.version)
+
+
+class TestCachedQuerysetCounters(TransactionTestCase):
+    """Tests for CachedQueryset counts outside of a transaction."""
+
+    def setUp(self):
+        """Shared objects for testing."""
+        self.cache = SampleCache()
+        self.cache.cache.clear()
+
+    def test_count_by_counter(self):
+        """The count of a queryset with a counter is cached."""
+        for x in range(3):
+            User.objects.create(username='user%d' % x)
+        cq = CachedQueryset(self.cache, User.objects.all())
+        with self.assertNumQueries(1):
+            self.assertEqual(3, cq.count())
+        cq = CachedQueryset(self.cache, User.objects.all())
+        with self.assertNumQueries(0):
+            self.assertEqual(3, cq.count())
+        self.assertIsNone(cq._primary_keys)
+
 
 class TestPkOnlvQueryset(TestCase):
     """Tests for PkOnlyQueryset."""
@@ -173,3 +422,49 @@ class TestPkOnlvQueryset(TestCase):
         pkvl = PkOnlyQueryset(self.cache, User, range(5))
         values_list = pkvl.values_list('id', flat=True)
         self.assertEqual(range(5), values_list)
+
+
+class TestExpandRelated(TestCase):
+    """Tests for expand_related."""
+
+    def setUp(self):
+        """Create a question with choices."""
+        self.cache = SampleCache()
+        self.question = Question.objects.create(
+            question_text='What is your favorite color?',
+            pub_date=datetime(2014, 11, 6, 8, 45, 49, 538232, UTC))
+        self.choices = [
+            Choice.objects.create(question=self.question, choice_text=text)
+            for text in ('Blue', 'Yellow')]
+        self.cache.cache.clear()
+
+    def test_one_call_per_level(self):
+        """Each level of the paths is loaded with one get_instances call."""
+        cq = CachedQueryset(self.cache, Choice.objects.order_by('pk'))
+        with mock.patch.object(
+                self.cache, 'get_instances',
+                wraps=self.cache.get_instances) as mock_get:
+            cms = list(cq.expand('question.choices'))
+        self.assertEqual(3, mock_get.call_count)
+        question = cms[0].question
+        self.assertIsInstance(question, CachedModel)
+        self.assertIs(question, cms[1].question)
+        self.assertEqual(
+            [choice.pk for choice in self.choices],
+            [choice.pk for choice in question.choices])
+        self.assertEqual('Blue', question.choices[0].choice_text)
+
+    def test_missing_related(self):
+        """A missing related instance is None."""
+        cm = CachedModel(Choice, {
+            'id': 1, 'question': PkOnlyModel(self.cache, Question, 666)})
+        expand_related(self.cache, [cm], ['question', 'question.choices'])
+        self.assertIsNone(cm.question)
+
+    def test_get(self):
+        """A CachedModel from get() is expanded."""
+        cq = CachedQueryset(self.cache, Question.objects.all())
+        cm = cq.expand('choices').get(pk=self.question.pk)
+        self.assertEqual(
+            ['Blue', 'Yellow'],
+            sorted(choice.choice_text for choice in cm.choices))
@@ -0,0 +1,450 @@
+"""Tests for drf_cached_instances/signals.py."""
+from datetime import datetime
+
+import mock
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TransactionTestCase
+from pytz import UTC
+
+from drf_cached_instances.signals import (
+    defer_updates, pklist_on_commit, update_on_commit)
+
+from sample_poll_app.cache import SampleCache
+from sample_poll_app.models import Choice, Question
+
+
+class TestUpdateOnCommit(TransactionTestCase):
+    """Test buffering cache updates until the transaction commits."""
+
+    def setUp(self):
+        """Use a mock update function."""
+        self.func = mock.Mock()
+
+    def test_not_in_transaction(self):
+        """Update immediately outside of a transaction."""
+        update_on_commit(self.func, 'User', 1)
+        self.func.assert_called_once_with('User', 1, None, None)
+
+    def test_commit(self):
+        """Run updates once, in order, when the transaction commits."""
+        user = User(pk=1, username='user')
+        with transaction.atomic():
+            update_on_commit(self.func, 'User', 1, user)
+            update_on_commit(self.func, 'Question', 2, version='v1')
+            update_on_commit(self.func, 'User', 1, user)
+            self.assertFalse(self.func.called)
+        self.assertEqual([
+            mock.call('User', 1, mock.ANY, None),
+            mock.call('Question', 2, None, 'v1'),
+        ], self.func.call_args_list)
+        instance = self.func.call_args_list[0][0][2]
+        self.assertEqual(1, instance.pk)
+        self.assertIsNot(user, instance)
+
+    def test_update_fields(self):
+        """Combine the update_fields of updates for an instance."""
+        with transaction.atomic():
+            update_on_commit(self.func, 'User', 1, update_fields=['a'])
+            update_on_commit(self.func, 'User', 1, update_fields=['b'])
+            update_on_commit(self.func, 'User', 2, update_fields=['a'])
+            update_on_commit(self.func, 'User', 2)
+            update_on_commit(self.func, 'User', 2, update_fields=['b'])
+        self.assertEqual([
+            mock.call('User', 1, None, None, update_fields=set(['a', 'b'])),
+            mock.call('User', 2, None, None),
+        ], self.func.call_args_list)
+
+    def test_update_fields_not_in_transaction(self):
+        """Pass update_fields to an immediate update."""
+        update_on_commit(self.func, 'User', 1, update_fields=['a'])
+        self.func.assert_called_once_with(
+            'User', 1, None, None, update_fields=['a'])
+
+    def test_created_deleted(self):
+        """Combine created for an instance, and use the last deleted."""
+        with transaction.atomic():
+            update_on_commit(self.func, 'User', 1, created=True)
+            update_on_commit(self.func, 'User', 1)
+            update_on_commit(self.func, 'User', 2, created=True)
+            update_on_commit(self.func, 'User', 2, deleted=True)
+            update_on_commit(self.func, 'User', 3, deleted=True)
+        self.assertEqual([
+            mock.call('User', 1, None, None, created=True),
+            mock.call('User', 2, None, None, created=True, deleted=True),
+            mock.call('User', 3, None, None, deleted=True),
+        ], self.func.call_args_list)
+
+    def test_rollback(self):
+        """Discard updates when the transaction is rolled back."""
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                update_on_commit(self.func, 'User', 1)
+                raise ValueError('rollback')
+        self.assertFalse(self.func.called)
+        with transaction.atomic():
+            update_on_commit(self.func, 'User', 2)
+        self.func.assert_called_once_with('User', 2, None, None)
+
+    def test_savepoint_rollback(self):
+        """A batch started in a rolled back savepoint is discarded."""
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    update_on_commit(self.func, 'User', 1)
+                    raise ValueError('rollback')
+            except ValueError:
+                pass
+            update_on_commit(self.func, 'User', 2)
+        self.func.assert_called_once_with('User', 2, None, None)
+
+    def test_inner_savepoint_rollback(self):
+        """Discard updates queued in a rolled back savepoint."""
+        with transaction.atomic():
+            update_on_commit(self.func, 'User', 1)
+            try:
+                with transaction.atomic():
+                    update_on_commit(self.func, 'User', 2, created=True)
+                    update_on_commit(self.func, 'User', 1, deleted=True)
+                    raise ValueError('rollback')
+            except ValueError:
+                pass
+            update_on_commit(self.func, 'User', 3)
+        self.assertEqual([
+            mock.call('User', 1, None, None),
+            mock.call('User', 3, None, None),
+        ], self.func.call_args_list)
+
+    def test_inner_savepoint_commit(self):
+        """Run updates queued in a released savepoint, in order."""
+        with transaction.atomic():
+            update_on_commit(self.func, 'User', 1)
+            with transaction.atomic():
+                update_on_commit(self.func, 'User', 2, created=True)
+                update_on_commit(self.func, 'User', 2)
+            update_on_commit(self.func, 'User', 1)
+        self.assertEqual([
+            mock.call('User', 1, None, None),
+            mock.call('User', 2, None, None, created=True),
+        ], self.func.call_args_list)
+
+
+class TestPKListOnCommit(TransactionTestCase):
+    """Test changing primary key lists when the transaction commits."""
+
+    def setUp(self):
+        """Use a mock change function."""
+        self.func = mock.Mock()
+
+    def test_not_in_transaction(self):
+        """Change immediately outside of a transaction."""
+        pklist_on_commit(self.func, 'Choice', 1, 'voters', add=[2])
+        self.func.assert_called_once_with('Choice', 1, 'voters', [2], [])
+
+    def test_commit(self):
+        """Run changes in order when the transaction commits."""
+        with transaction.atomic():
+            pklist_on_commit(self.func, 'Choice', 1, 'voters', add=[2])
+            pklist_on_commit(self.func, 'Choice', 1, 'voters', remove=[2])
+            self.assertFalse(self.func.called)
+        self.assertEqual([
+            mock.call('Choice', 1, 'voters', [2], []),
+            mock.call('Choice', 1, 'voters', [], [2]),
+        ], self.func.call_args_list)
+
+    def test_deferred(self):
+        """Record the instance inside defer_updates."""
+        with defer_updates() as touched:
+            pklist_on_commit(self.func, 'Choice', 1, 'voters', add=[2])
+        self.assertEqual([('Choice', 1, None)], list(touched))
+        self.assertFalse(self.func.called)
+
+
+class TestDeferUpdates(TransactionTestCase):
+    """Test recording updates instead of running them."""
+
+    def test_record(self):
+        """Record updates instead of running them."""
+        func = mock.Mock()
+        with defer_updates() as touched:
+            update_on_commit(func, 'User', 1)
+            update_on_commit(func, 'Question', 2, version='v1')
+            update_on_commit(func, 'User', 1)
+        self.assertFalse(func.called)
+        self.assertEqual(
+            [('User', 1, None), ('Question', 2, 'v1')], list(touched))
+        update_on_commit(func, 'User', 1)
+        func.assert_called_once_with('User', 1, None, None)
+
+    def test_record_instance(self):
+        """Record a copy of the instance, and the created and deleted flags."""
+        user = User(pk=1, username='user')
+        with defer_updates() as touched:
+            update_on_commit(mock.Mock(), 'User', 1, user, created=True)
+            update_on_commit(mock.Mock(), 'User', 1, deleted=True)
+            update_on_commit(mock.Mock(), 'User', 2, user)
+            pklist_on_commit(mock.Mock(), 'User', 2, 'votes', add=[3])
+        instance, created, deleted = touched[('User', 1, None)]
+        self.assertEqual(1, instance.pk)
+        self.assertIsNot(user, instance)
+        self.assertEqual((True, True), (created, deleted))
+        instance, created, deleted = touched[('User', 2, None)]
+        self.assertEqual((1, False, False), (instance.pk, created, deleted))
+
+    def test_nested(self):
+        """Add nested updates to the outer context."""
+        func = mock.Mock()
+        with defer_updates() as outer:
+            with defer_updates() as inner:
+                update_on_commit(func, 'User', 1)
+            self.assertEqual([], list(inner))
+        self.assertEqual([('User', 1, None)], list(outer))
+
+
+class TestDeferred(TransactionTestCase):
+    """Test BaseCache.deferred()."""
+
+    def setUp(self):
+        """Create a Question."""
+        self.cache = SampleCache()
+        self.question = Question.objects.create(
+            question_text='What is your favorite color?',
+            pub_date=datetime(2014, 11, 6, 8, 45, 49, 538232, UTC))
+        self.cache.cache.clear()
+
+    def test_deferred(self):
+        """Update the touched instances in bulk on exit."""
+        with mock.patch.object(
+                self.cache, 'update_instances',
+                wraps=self.cache.update_instances) as mock_update:
+            with self.cache.deferred():
+                choices = [
+                    Choice.objects.create(
+                        question=self.question, choice_text=text)
+                    for text in ('Red', 'Green', 'Blue')]
+                choices[0].choice_text = 'Purple'
+                choices[0].save()
+                self.assertFalse(mock_update.called)
+        choice_pks = [choice.pk for choice in choices]
+        self.assertEqual([
+            mock.call(
+                'Choice', choice_pks, None, deleted={}, created=choice_pks,
+                cascade=False),
+            mock.call(
+                'Question', [self.question.pk], 'default', deleted={},
+                created=[], cascade=True),
+        ], mock_update.call_args_list)
+        with self.assertNumQueries(0):
+            instances = self.cache.get_instances(
+                [('Choice', pk, None) for pk in choice_pks] +
+                [('Question', self.question.pk, None)])
+        self.assertEqual(
+            'Purple', instances[('Choice', choice_pks[0])][0]['choice_text'])
+        self.assertEqual(
+            choice_pks,
+            list(instances[('Question', self.question.pk)][0]['choices']
+                 .values_list('id', flat=True)))
+
+    def test_delete_cascades(self):
+        """Update the related instances of a deleted instance."""
+        choices = [
+            Choice.objects.create(question=self.question, choice_text=text)
+            for text in ('Red', 'Green')]
+        spec = ('Question', self.question.pk, None)
+        self.cache.get_instances([spec])
+        with self.cache.deferred():
+            choices[0].delete()
+        instances = self.cache.get_instances([spec])
+        self.assertEqual(
+            [choices[1].pk],
+            list(instances[('Question', self.question.pk)][0]['choices']
+                 .values_list('id', flat=True)))
+
+    def test_pk_index(self):
+        """Add instances created in the block to the primary key index."""
+        self.cache.get_pk_index(Question, 'pk')
+        with self.cache.deferred():
+            for x in range(3):
+                Question.objects.create(
+                    question_text='Question %d' % x,
+                    pub_date=datetime(2014, 11, 7 + x, tzinfo=UTC))
+        with self.assertNumQueries(0):
+            cached = self.cache.get_pk_index(Question, 'pk')
+        self.assertEqual(
+            list(Question.objects.order_by('pk').values_list(
+                'pk', flat=True)), cached)
+
+    def test_counter(self):
+        """Count instances created and deleted in the block."""
+        User.objects.create(username='first')
+        self.assertEqual(1, self.cache.get_count(User))
+        with self.cache.deferred():
+            users = [
+                User.objects.create(username='user%d' % x) for x in range(5)]
+            users[0].delete()
+            User.objects.get(username='first').delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(4, self.cache.get_count(User))
+
+    def test_transaction(self):
+        """Wait for the transaction to commit to update."""
+        with mock.patch.object(self.cache, 'update_deferred') as mock_update:
+            with transaction.atomic():
+                with self.cache.deferred():
+                    Choice.objects.create(
+                        question=self.question, choice_text='Red')
+                self.assertFalse(mock_update.called)
+        self.assertEqual(1, mock_update.call_count)
+
+    def test_exception(self):
+        """Discard the updates if the block raises an exception."""
+        with mock.patch.object(self.cache, 'update_deferred') as mock_update:
+            with self.assertRaises(ValueError):
+                with self.cache.deferred():
+                    Choice.objects.create(
+                        question=self.question, choice_text='Red')
+                    raise ValueError('Import failed')
+        self.assertFalse(mock_update.called)
+
+
+class TestSampleAppSignals(TransactionTestCase):
+    """Test the sample app's signal receivers."""
+
+    def setUp(self):
+        """Clear the cache."""
+        self.cache = SampleCache()
+        self.cache.cache.clear()
+
+    def test_saves_in_transaction(self):
+        """Saving a Choice several times updates the cache once."""
+        question = Question.objects.create(
+            question_text='What is your favorite color?',
+            pub_date=datetime(2014, 11, 6, 8, 45, 49, 538232, UTC))
+        with mock.patch.object(
+                SampleCache, 'update_instance',
+                autospec=True, return_value=[]) as mock_update:
+            with transaction.atomic():
+                choice = Choice.objects.create(
+                    question=question, choice_text='Blue')
+                for text in ('Green', 'Red', 'Yellow', 'Blue'):
+                    choice.choice_text = text
+                    choice.save()
+                self.assertFalse(mock_update.called)
+        mock_update.assert_called_once_with(
+            mock.ANY, 'Choice', choice.pk, mock.ANY, None,
+            update_fields=None, created=True, deleted=False)
+
+    def test_save_update_fields(self):
+        """Pass update_fields from save() to the update."""
+        user = User.objects.create(username='the_user')
+        self.cache.get_instances([('User', user.pk, None)])
+        user.username = 'new_name'
+        with mock.patch.object(
+                SampleCache, 'user_default_serializer') as mock_serializer:
+            user.save(update_fields=['username'])
+        self.assertFalse(mock_serializer.called)
+        instances = self.cache.get_instances([('User', user.pk, None)])
+        self.assertEqual(
+            'new_name', instances[('User', user.pk)][0]['username'])
+
+    def test_delete(self):
+        """Update a deleted instance with its primary key."""
+        question = Question.objects.create(
+            question_text='What is your favorite color?',
+            pub_date=datetime(2014, 11, 6, 8, 45, 49, 538232, UTC))
+        choice = Choice.objects.create(question=question, choice_text='Blue')
+        choice_pk = choice.pk
+        with mock.patch.object(
+                SampleCache, 'update_instance',
+                autospec=True, return_value=[]) as mock_update:
+            with transaction.atomic():
+                choice.delete()
+        self.assertIsNone(choice.pk)
+        mock_update.assert_called_once_with(
+            mock.ANY, 'Choice', choice_pk, mock.ANY, None,
+            update_fields=None, created=False, deleted=True)
+        self.assertEqual(choice_pk, mock_update.call_args[0][3].pk)
+
+    def test_pk_index(self):
+        """Add created Questions to the index, and remove deleted ones."""
+        first = Question.objects.create(
+            question_text='What is your favorite color?',
+            pub_date=datetime(2014, 11, 6, 8, 45, 49, 538232, UTC))
+        self.assertEqual(
+            [first.pk], self.cache.get_pk_index(Question, '-pub_date'))
+        with transaction.atomic():
+            second = Question.objects.create(
+                question_text='What is your quest?',
+                pub_date=datetime(2014, 11, 7, tzinfo=UTC))
+        first.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [second.pk], self.cache.get_pk_index(Question, '-pub_date'))
+
+    def test_counter(self):
+        """Count created and deleted Users in the cached counter."""
+        User.objects.create(username='first')
+        self.assertEqual(1, self.cache.get_count(User))
+        with transaction.atomic():
+            second = User.objects.create(username='second')
+            User.objects.create(username='third')
+        second.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(2, self.cache.get_count(User))
+
+    def test_counter_atomic(self):
+        """Do not count a user twice if the count is loaded before commit."""
+        User.objects.create(username='first')
+        with transaction.atomic():
+            User.objects.create(username='second')
+            self.assertEqual(2, self.cache.get_count(User))
+        self.assertEqual(2, self.cache.get_count(User))
+        with self.assertNumQueries(0):
+            self.assertEqual(2, self.cache.get_count(User))
+
+    def test_voters_changed(self):
+        """Change the cached voters and votes without loading instances."""
+        question = Question.objects.create(
+            question_text='What is your favorite color?',
+            pub_date=datetime(2014, 11, 6, 8, 45, 49, 538232, UTC))
+        choice = Choice.objects.create(question=question, choice_text='Blue')
+        user = User.objects.create(username='the_user')
+        specs = [('Choice', choice.pk, None), ('User', user.pk, None)]
+        self.cache.get_instances(specs)
+        with self.assertNumQueries(3):
+            # Select existing, insert, and the transaction savepoint
+            with transaction.atomic():
+                choice.voters.add(user)
+        self.assertEqual([user.pk], self.cached_pks(choice, 'voters'))
+        self.assertEqual([choice.pk], self.cached_pks(user, 'votes'))
+        user.votes.remove(choice)
+        self.assertEqual([], self.cached_pks(choice, 'voters'))
+        self.assertEqual([], self.cached_pks(user, 'votes'))
+
+    def test_voters_cleared(self):
+        """Clearing the voters updates the Choice and the Users."""
+        question = Question.objects.create(
+            question_text='What is your favorite color?',
+            pub_date=datetime(2014, 11, 6, 8, 45, 49, 538232, UTC))
+        choice = Choice.objects.create(question=question, choice_text='Blue')
+        users = [
+            User.objects.create(username='user%d' % x) for x in range(2)]
+        choice.voters.add(*users)
+        specs = [('Choice', choice.pk, None)] + [
+            ('User', user.pk, None) for user in users]
+        self.cache.get_instances(specs)
+        choice.voters.clear()
+        self.assertEqual([], self.cached_pks(choice, 'voters'))
+        for user in users:
+            self.assertEqual([], self.cached_pks(user, 'votes'))
+        users[0].votes.add(choice)
+        users[0].votes.clear()
+        self.assertEqual([], self.cached_pks(choice, 'voters'))
+        self.assertEqual([], self.cached_pks(users[0], 'votes'))
+
+    def cached_pks(self, instance, field_name):
+        """Get a cached list of primary keys."""
+        key = self.cache.key_for(
+            'default', type(instance).__name__, instance.pk)
+        native = self.cache.decode_entry(self.cache.cache.get(key))
+        return native[field_name + ':PKList']['pks']
@@ -0,0 +1,183 @@
+"""Tests for drf_cached_instances/spec.py."""
+from datetime import datetime
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from pytz import UTC
+
+from drf_cached_instances.cache import BaseCache
+from drf_cached_instances.spec import CacheSpec
+
+from sample_poll_app.cache import SampleCache
+from sample_poll_app.models import Choice, Question
+
+
+class SpecCache(BaseCache):
+    """A cache like SampleCache, declared with specs."""
+
+    specs = (
+        CacheSpec(
+            User, fields=('id', 'username', ('date_joined', 'DateTime')),
+            pklist_fields=('votes',), invalidate_keys=('drfc_user_count',)),
+        CacheSpec(
+            Question, fields=('id', 'question_text', ('pub_date', 'DateTime')),
+            pklist_fields=('choices',)),
+        CacheSpec(
+            Choice, fields=('id', 'choice_text'), pk_fields=('question',),
+            pklist_fields=('voters',),
+            invalidates=(('question', True), ('voters', False))),
+    )
+
+    def question_default_invalidator(self, obj):
+        """Use a hand-written invalidator."""
+        return ['custom']
+
+
+class TestCacheSpec(TestCase):
+    """Test the functions generated from specs."""
+
+    def setUp(self):
+        """Create a Question with votes."""
+        self.cache = SpecCache()
+        self.sample = SampleCache()
+        self.users = [
+            User.objects.create(
+                username='user%d' % x,
+                date_joined=datetime(2014, 11, 5, 22, 2, 16, 0, UTC))
+            for x in range(2)]
+        self.question = Question.objects.create(
+            question_text='What is your favorite color?',
+            pub_date=datetime(2014, 11, 6, 8, 45, 49, 538232, UTC))
+        self.choices = [
+            Choice.objects.create(question=self.question, choice_text=text)
+            for text in ('Red', 'Green')]
+        self.choices[0].voters.add(*self.users)
+        self.choices[1].voters.add(self.users[0])
+
+    def assert_same_as_sample(self, model_name, pk):
+        """Assert the spec and SampleCache representations match."""
+        loader = self.cache.model_function(model_name, 'default', 'loader')
+        serializer = self.cache.model_function(
+            model_name, 'default', 'serializer')
+        sample_loader = self.sample.model_function(
+            model_name, 'default', 'loader')
+        sample_serializer = self.sample.model_function(
+            model_name, 'default', 'serializer')
+        native = serializer(loader(pk))
+        expected = sample_serializer(sample_loader(pk))
+        for value in native.values():
+            if isinstance(value, dict) and 'pks' in value:
+                value['pks'] = sorted(value['pks'])
+        for value in expected.values():
+            if isinstance(value, dict) and 'pks' in value:
+                value['pks'] = sorted(value['pks'])
+        self.assertEqual(expected, native)
+
+    def test_user(self):
+        """Serialize a User like SampleCache."""
+        self.assert_same_as_sample('User', self.users[0].pk)
+
+    def test_question(self):
+        """Serialize a Question like SampleCache."""
+        self.assert_same_as_sample('Question', self.question.pk)
+
+    def test_choice(self):
+        """Serialize a Choice like SampleCache."""
+        self.assert_same_as_sample('Choice', self.choices[0].pk)
+
+    def test_loader(self):
+        """Load an instance and the related primary keys."""
+        with self.assertNumQueries(2):
+            choice = self.cache.choice_default_loader(self.choices[0].pk)
+        self.assertEqual(
+            sorted(user.pk for user in self.users),
+            sorted(choice._voters_pks))
+
+    def test_loader_missing(self):
+        """Return None for a missing instance."""
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.cache.choice_default_loader(666))
+
+    def test_bulk_loader(self):
+        """Load instances in bulk, with one query per relation."""
+        pks = [user.pk for user in self.users]
+        with self.assertNumQueries(2):
+            users = self.cache.user_default_bulk_loader(pks + [666])
+        votes = dict((user.pk, sorted(user._votes_pks)) for user in users)
+        self.assertEqual({
+            self.users[0].pk: sorted(choice.pk for choice in self.choices),
+            self.users[1].pk: [self.choices[0].pk],
+        }, votes)
+
+    def test_bulk_loader_reverse_foreign_key(self):
+        """Load a reverse foreign key relation in bulk."""
+        with self.assertNumQueries(2):
+            questions = self.cache.question_default_bulk_loader(
+                [self.question.pk])
+        self.assertEqual(
+            sorted(choice.pk for choice in self.choices),
+            sorted(questions[0]._choices_pks))
+
+    def test_get_instances_bulk_loader(self):
+        """Load the cache misses of get_instances with the bulk loader."""
+        users = [
+            User.objects.create(username='bulk%d' % x) for x in range(10)]
+        self.cache.cache.clear()
+        with self.assertNumQueries(2):
+            instances = self.cache.get_instances(
+                [('User', user.pk, None) for user in users])
+        self.assertEqual(
+            sorted(user.pk for user in users),
+            sorted(pk for model_name, pk in instances))
+
+    def test_invalidator(self):
+        """Invalidate related instances and cache keys."""
+        choice = self.cache.choice_default_loader(self.choices[0].pk)
+        with self.assertNumQueries(0):
+            invalid = self.cache.choice_default_invalidator(choice)
+        self.assertEqual(
+            [('Question', self.question.pk, True)] +
+            sorted(('User', user.pk, False) for user in self.users),
+            invalid[:1] + sorted(invalid[1:]))
+        self.assertEqual(
+            ['drfc_user_count'],
+            self.cache.user_default_invalidator(self.users[0]))
+
+    def test_field_serializer(self):
+        """Patch the changed cached fields."""
+        choice = self.choices[0]
+        choice.choice_text = 'Purple'
+        self.assertEqual(
+            {'choice_text': 'Purple'},
+            self.cache.choice_default_field_serializer(
+                choice, ['choice_text', 'other']))
+        question = self.question
+        self.assertEqual(
+            {'pub_date:DateTime': '1415263549.538232'},
+            self.cache.question_default_field_serializer(
+                question, ['pub_date']))
+
+    def test_field_serializer_relation(self):
+        """Require a full update when a related primary key changes."""
+        for field_names in (['question'], ['question_id'], ['voters']):
+            self.assertIsNone(self.cache.choice_default_field_serializer(
+                self.choices[0], field_names))
+
+    def test_hand_written(self):
+        """Use hand-written functions instead of generated functions."""
+        self.assertEqual(
+            ['custom'], self.cache.question_default_invalidator(None))
+
+    def test_get_instances(self):
+        """Use the generated functions with get_instances."""
+        self.cache.cache.clear()
+        self.assertEqual(
+            2, self.cache.warm_instances(
+                'Choice', [choice.pk for choice in self.choices]))
+        with self.assertNumQueries(0):
+            instances = self.cache.get_instances(
+                [('Choice', choice.pk, None) for choice in self.choices])
+        native = instances[('Choice', self.choices[1].pk)][0]
+        self.assertEqual('Green', native['choice_text'])
+        self.assertEqual(self.question.pk, native['question'].pk)
+        self.assertEqual([self.users[0].pk], native['voters'].pks)
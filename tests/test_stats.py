@@ -0,0 +1,126 @@
+"""Tests for drf_cached_instances/stats.py."""
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase
+from django.test.utils import override_settings
+import mock
+
+from drf_cached_instances.stats import (
+    BaseStats, MemoryStats, RequestTimings, clear_published_stats,
+    combine_stats, get_stats, published_stats)
+
+
+class TestGetStats(TestCase):
+    """Tests for get_stats."""
+
+    @override_settings(DRF_INSTANCE_CACHE_STATS=None)
+    def test_disabled(self):
+        """By default, no statistics are collected."""
+        self.assertIsNone(get_stats())
+
+    @override_settings(
+        DRF_INSTANCE_CACHE_STATS='drf_cached_instances.stats.MemoryStats')
+    def test_enabled(self):
+        """The collector is shared by the process."""
+        stats = get_stats()
+        self.assertIsInstance(stats, MemoryStats)
+        self.assertIs(stats, get_stats())
+
+
+class TestBaseStats(TestCase):
+    """Tests for BaseStats."""
+
+    def test_timed(self):
+        """A timed function returns the result and records a timing."""
+        stats = BaseStats()
+        with mock.patch.object(stats, 'timing') as mock_timing:
+            func = stats.timed('User', 'default', 'loader', lambda x: x * 2)
+            self.assertEqual(4, func(2))
+        mock_timing.assert_called_once_with(
+            'User', 'default', 'loader', mock.ANY)
+
+
+class TestRequestTimings(TestCase):
+    """Tests for RequestTimings."""
+
+    def test_decode_phase(self):
+        """Field conversion and upgrades are reported as decoding."""
+        timings = RequestTimings()
+        timings.timing('User', 'default', 'decode', 0.001)
+        timings.timing('User', 'default', 'convert', 0.002)
+        timings.timing('User', 'default', 'upgrader', 0.004)
+        metrics = timings.server_timing(0.010).split(', ')
+        self.assertEqual('decode;dur=7.000;desc="Cache decoding"', metrics[4])
+        self.assertEqual(
+            'drf;dur=3.000;desc="Other view processing"', metrics[5])
+
+
+class TestMemoryStats(TestCase):
+    """Tests for MemoryStats."""
+
+    def setUp(self):
+        """Create a collector and a private cache."""
+        self.stats = MemoryStats()
+        self.cache = LocMemCache('test-stats', {})
+        self.cache.clear()
+
+    def test_snapshot(self):
+        """A counter or timing is aggregated."""
+        self.stats.incr('User', 'default', 'hits')
+        self.stats.incr('User', 'default', 'hits', 2)
+        self.stats.timing('User', 'default', 'loader', 0.5)
+        self.stats.timing('User', 'default', 'loader', 0.25)
+        snapshot = sorted(self.stats.snapshot(), key=lambda s: s['name'])
+        expected = [
+            {'model': 'User', 'version': 'default', 'name': 'hits',
+             'value': 3},
+            {'model': 'User', 'version': 'default', 'name': 'loader',
+             'count': 2, 'total': 0.75, 'max': 0.5},
+        ]
+        self.assertEqual(expected, snapshot)
+
+    def test_reset(self):
+        """A collector can be cleared."""
+        self.stats.incr('User', 'default', 'hits')
+        self.stats.reset()
+        self.assertEqual([], self.stats.snapshot())
+
+    @override_settings(DRF_INSTANCE_CACHE_STATS_INTERVAL=0)
+    def test_flush_publishes(self):
+        """A flush publishes after the interval has passed."""
+        self.stats.incr('User', 'default', 'hits')
+        self.stats.flush(self.cache)
+        self.assertEqual(
+            [{'model': 'User', 'version': 'default', 'name': 'hits',
+              'value': 1}],
+            published_stats(self.cache))
+
+    @override_settings(DRF_INSTANCE_CACHE_STATS_INTERVAL=3600)
+    def test_flush_waits_for_interval(self):
+        """A flush does not publish before the interval has passed."""
+        self.stats.incr('User', 'default', 'hits')
+        self.stats.flush(self.cache)
+        self.assertEqual([], published_stats(self.cache))
+
+    def test_clear_published_stats(self):
+        """The published statistics can be deleted."""
+        self.stats.incr('User', 'default', 'hits')
+        self.stats.publish(self.cache)
+        clear_published_stats(self.cache)
+        self.assertEqual([], published_stats(self.cache))
+
+    def test_combine_stats(self):
+        """A snapshot from each process is combined."""
+        other = MemoryStats()
+        for stats in (self.stats, other):
+            stats.incr(None, 'default', 'misses')
+            stats.timing(None, 'default', 'cache_get', 0.1)
+        other.timing(None, 'default', 'cache_get', 0.3)
+        combined = combine_stats([self.stats.snapshot(), other.snapshot()])
+        expected = [
+            {'model': None, 'version': 'default', 'name': 'cache_get',
+             'count': 3, 'total': 0.5, 'max': 0.3},
+            {'model': None, 'version': 'default', 'name': 'misses',
+             'value': 2},
+        ]
+        self.assertEqual(expected, combined)